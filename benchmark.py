@@ -0,0 +1,225 @@
+# DSP benchmark for every effect of the pedal, rendered on pyo's offline server so it runs on any Linux machine
+# without a Raspberry Pi or a guitar plugged in. Each effect is fed a guitar DI recording (or a synthetic one
+# when no recording is given) and rendered for every combination of buffer size and sample rate asked for.
+#
+# For every run the benchmark reports the realtime factor (seconds of audio rendered per second of wall time),
+# the CPU time spent per audio buffer and the peak resident memory. Every run happens in a fresh process, so
+# the memory figures of one effect don't include another one. The results are written as JSON, and passing a
+# previous results file with --baseline flags every effect whose CPU time per buffer got worse by more than
+# the tolerance, so a change to an effect's parameters can't silently make it more expensive.
+#
+#     python benchmark.py --output results.json
+#     python benchmark.py --effects Flanger Leslie --buffersizes 64 128 256 --baseline results.json
+#
+# Passing --compare-leslie instead compares the Leslie speaker against the way it used to be wired, with its
+# sub-effects playing out on their own as well as through its mixer.
+#
+#     python benchmark.py --compare-leslie
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import time
+import wave
+
+from effects import EFFECTS
+from measurements import peakMemory, formatBytes
+
+# Name used in the results for rendering the DI signal alone, the cost every effect is compared against
+INPUT_ONLY = "(input only)"
+
+
+def writeSyntheticDI(path, dur=10.0, sr=44100, seed=1):
+    # Writes a mono 16-bit WAV that stands in for a guitar DI track: plucked strings from a Karplus-Strong
+    # synthesis, with a new note every half second picked from the open strings of a guitar in standard tuning
+    rng = random.Random(seed)
+    strings = [82.41, 110.0, 146.83, 196.0, 246.94, 329.63]
+    total = int(dur * sr)
+    noteLength = int(0.5 * sr)
+    frames = bytearray()
+    written = 0
+    while written < total:
+        freq = rng.choice(strings) * rng.choice([1, 1, 1.5, 2])
+        period = max(2, int(sr / freq))
+        line = [rng.uniform(-1, 1) for i in range(period)]
+        count = min(noteLength, total - written)
+        for i in range(count):
+            index = i % period
+            sample = line[index]
+            line[index] = 0.996 * 0.5 * (sample + line[(index + 1) % period])
+            frames += struct.pack("<h", int(max(-1.0, min(1.0, sample * 0.5)) * 32767))
+        written += count
+    with wave.open(path, "wb") as output:
+        output.setnchannels(1)
+        output.setsampwidth(2)
+        output.setframerate(sr)
+        output.writeframes(bytes(frames))
+    return path
+
+
+def _runOne(job):
+    # Renders one effect with one server configuration. Runs in its own process.
+    from pyo import Server, SfPlayer
+
+    factories = dict(EFFECTS)
+    name, buffersize, sr, dur, diPath = job
+    server = Server(sr=sr, buffersize=buffersize, audio="offline")
+    server.setVerbosity(0)
+    server.boot()
+    handle, filename = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    try:
+        server.recordOptions(dur=dur, filename=filename)
+        source = SfPlayer(diPath, loop=True)
+        if name == INPUT_ONLY:
+            keep = source.out()
+        else:
+            keep = factories[name](source).out()
+        wallStart = time.perf_counter()
+        cpuStart = time.process_time()
+        server.start()
+        cpu = time.process_time() - cpuStart
+        wall = time.perf_counter() - wallStart
+        del keep
+        server.shutdown()
+    finally:
+        os.remove(filename)
+
+    buffers = max(1, int(math.ceil(dur * sr / float(buffersize))))
+    return {
+        "effect": name,
+        "buffersize": buffersize,
+        "sr": sr,
+        "dur": dur,
+        "wall": wall,
+        "cpu": cpu,
+        "realtimeFactor": dur / wall if wall > 0 else float("inf"),
+        "cpuPerBuffer": cpu / buffers,
+        # Share of the time available for each buffer spent computing it, above 1 the effect can't keep up
+        "load": (cpu / buffers) / (buffersize / float(sr)),
+        "peakMemory": peakMemory(),
+    }
+
+
+def runBenchmark(effects, buffersizes, sampleRates, dur, diPath):
+    jobs = [(name, buffersize, sr, dur, diPath)
+            for name in [INPUT_ONLY] + list(effects) for sr in sampleRates for buffersize in buffersizes]
+    # One process per job, run one at a time so the runs don't compete for the CPU
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=1, maxtasksperchild=1) as pool:
+        results = []
+        for result in pool.imap(_runOne, jobs):
+            results.append(result)
+            print("%-18s %5d samples %6d Hz: %7.1fx realtime, %8.1f us per buffer, load %5.1f%%, %s peak"
+                  % (result["effect"], result["buffersize"], result["sr"], result["realtimeFactor"],
+                     result["cpuPerBuffer"] * 1e6, result["load"] * 100, formatBytes(result["peakMemory"])))
+    return results
+
+
+def findRegressions(results, baseline, tolerance):
+    # Compares CPU time per buffer against a previous results file, returning the runs that got slower
+    previous = {}
+    for result in baseline["results"]:
+        previous[(result["effect"], result["buffersize"], result["sr"])] = result
+    regressions = []
+    for result in results:
+        old = previous.get((result["effect"], result["buffersize"], result["sr"]))
+        if old is None or old["cpuPerBuffer"] <= 0:
+            continue
+        change = result["cpuPerBuffer"] / old["cpuPerBuffer"] - 1.0
+        if change > tolerance:
+            regressions.append((result, old, change))
+    return regressions
+
+
+def buildLegacyLeslie(input, mul=.7):
+    # Rebuilds the Leslie speaker the way it used to be wired: the Tremolo, Phaser and Vibrato all tapped the input
+    # directly, each ran its own oscillator, and every one of them was sent out on its own as well as through the
+    # three-output mixer
+    from pyo import Mixer, Phaser, Sine
+    from effects import Tremolo, Vibrato
+    lfofreq = Sine(freq=[.2, .20], mul=70, add=200)
+    lfospread = Sine(freq=[.16, .13], mul=.6, add=1.5)
+    tremolo = Tremolo(input, freq=4).out()
+    phaser = Phaser(input, freq=lfofreq, spread=lfospread, q=1, feedback=.5, num=18, mul=.1).out()
+    vibrato = Vibrato(input, depth=6).out()
+    mixer = Mixer(outs=3, chnls=3, time=0.5, mul=mul).out()
+    for voice, effect in enumerate((tremolo, phaser, vibrato)):
+        mixer.addInput(voice=voice, input=effect)
+        mixer.setAmp(voice, 1, 1)
+    return [lfofreq, lfospread, tremolo, phaser, vibrato, mixer]
+
+
+def compareLeslie(dur=10.0, buffersize=256, sr=44100, repeats=3):
+    # Renders the old and the composite Leslie offline, returning the CPU time of each on top of the input alone
+    from pyo import Noise, Server, Sig
+    from cpuReport import measureScenario
+    from effects import makeLeslie
+    server = Server(sr=sr, buffersize=buffersize, audio="offline")
+    server.setVerbosity(0)
+
+    def buildInput():
+        return Sig(Noise(mul=.2)).out()
+
+    measureScenario(server, dur, 1, buildInput)
+    base = measureScenario(server, dur, repeats, buildInput)
+    return {"legacy": measureScenario(server, dur, repeats, lambda: buildLegacyLeslie(Noise(mul=.2))) - base,
+            "composite": measureScenario(server, dur, repeats, lambda: makeLeslie(Noise(mul=.2)).out()) - base}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline DSP benchmark of the pedal's effects")
+    parser.add_argument("--effects", nargs="*", default=[name for name, factory in EFFECTS])
+    parser.add_argument("--buffersizes", nargs="*", type=int, default=[64, 128, 256, 512])
+    parser.add_argument("--sample-rates", nargs="*", type=int, default=[44100, 48000])
+    parser.add_argument("--dur", type=float, default=10.0, help="seconds of audio to render per run")
+    parser.add_argument("--input", help="guitar DI WAV file, a synthetic one is generated if left out")
+    parser.add_argument("--output", default="benchmark.json", help="where to write the JSON results")
+    parser.add_argument("--baseline", help="previous JSON results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed relative increase in CPU time per buffer before a run counts as a regression")
+    parser.add_argument("--compare-leslie", action="store_true",
+                        help="only compare the Leslie speaker against its old wiring")
+    args = parser.parse_args()
+
+    if args.compare_leslie:
+        result = compareLeslie(args.dur)
+        print("Leslie Speaker: old wiring %.3f s CPU, composite %.3f s CPU (%.0f%% less)" % (
+            result["legacy"], result["composite"], 100.0 * (1.0 - result["composite"] / result["legacy"])))
+        raise SystemExit(0)
+
+    unknown = [name for name in args.effects if name not in dict(EFFECTS)]
+    if unknown:
+        parser.error("unknown effects: %s" % ", ".join(unknown))
+
+    diPath = args.input
+    if diPath is None:
+        diPath = os.path.join(tempfile.gettempdir(), "pedal_synthetic_di.wav")
+        if not os.path.exists(diPath):
+            writeSyntheticDI(diPath)
+
+    results = runBenchmark(args.effects, args.buffersizes, args.sample_rates, args.dur, diPath)
+    with open(args.output, "w") as output:
+        json.dump({
+            "machine": platform.machine(),
+            "python": sys.version.split()[0],
+            "input": os.path.basename(diPath),
+            "results": results,
+        }, output, indent=2)
+    print("Results written to %s" % args.output)
+
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            regressions = findRegressions(results, json.load(baselineFile), args.tolerance)
+        for result, old, change in regressions:
+            print("REGRESSION: %s at %d samples %d Hz: %.1f -> %.1f us per buffer (+%.0f%%)"
+                  % (result["effect"], result["buffersize"], result["sr"], old["cpuPerBuffer"] * 1e6,
+                     result["cpuPerBuffer"] * 1e6, change * 100))
+        if regressions:
+            raise SystemExit(1)
@@ -1,529 +1,408 @@
-# Import libraries needed to make everything work
-import RPi.GPIO as GPIO
+# Import libraries needed to make everything work. Only what every start of the pedal needs is imported up front,
+# the worker pool, the NumPy backend, the effect cache and telemetry being imported when their flags ask for them,
+# so the pedal makes a sound again sooner after a power cut. The looper is imported only with --looper.
 import time
-from pyo import *
+startTime = time.perf_counter()
+import argparse
+import os
+import signal
+import sys
+from pyo import Input, Sig
+from controlServer import BYPASS, PRESET, SELECT, ControlServer, ParameterBatcher, RtMidiInput
+from effectRegistry import EffectRegistry, formatReport
+from effects import EFFECTS, makeLeslie
+from footswitch import Footswitch, RPiGPIOBackend, SimulatedGPIOBackend, PRESS, RELEASE
+from pedalState import STATE_PATH, StateStore, loadState, restoreParameters
+from presets import PresetBank
+from serverProfile import addProfileArguments, autoTune, createServer, describeProfile, measureRoundTrip, \
+    profileFromArgs
+from signalGraph import FADE_TIME, SignalGraph
+from tempo import HOLD_TIME, REFERENCE_BPM, TempoClock
+importTime = time.perf_counter() - startTime
+
+parser = argparse.ArgumentParser(description="Cheesy Waves Raspberry Pi guitar pedal")
+parser.add_argument("--eager", action="store_true", help="build every effect at startup instead of on demand")
+parser.add_argument("--telemetry-port", type=int,
+                    help="serve process CPU, dropout and switch latency telemetry on this localhost port")
+parser.add_argument("--presets", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "presets.json"),
+                    help="JSON file with the preset bank")
+parser.add_argument("--preset", help="preset to start with, the saved one or the bank's Default preset if left out")
+parser.add_argument("--crossfade", type=float, default=FADE_TIME,
+                    help="seconds to crossfade over when switching effects")
+parser.add_argument("--control-port", type=int, help="listen for OSC control messages on this localhost UDP port")
+parser.add_argument("--control-host", default="127.0.0.1", help="address the control server listens on")
+parser.add_argument("--midi-port", help="MIDI input port, by number or part of its name, to control the pedal from")
+parser.add_argument("--bpm", type=float,
+                    help="tempo to start with, before any tapping, the saved one or %d BPM if left out" % REFERENCE_BPM)
+parser.add_argument("--free-running", action="store_true",
+                    help="run every effect on its own oscillators instead of locking them to the tap tempo")
+parser.add_argument("--workers", type=int, default=0,
+                    help="run the effects in this many worker processes, one buffer later, to use more cores")
+parser.add_argument("--numpy", action="store_true",
+                    help="run the Flanger, Tremolo, Vibrato and Leslie on the NumPy backend, one buffer later and "
+                         "free-running")
+parser.add_argument("--baked-lfos", action="store_true",
+                    help="read the Flanger's sweep from a table baked ahead of time instead of a live LFO, the "
+                         "other effects' modulators being plain sines that already read a table")
+parser.add_argument("--convolution-reverb", action="store_true",
+                    help="run the Reverb as a convolution with a cached room response, on the NumPy backend. This "
+                         "changes the sound, not the load: it takes about 15 times the CPU of the STRev it replaces")
+parser.add_argument("--cache-dir", help="where the baked tables and room responses are kept, ~/.cache/cheesywaves "
+                                        "if left out")
+parser.add_argument("--cache-size", type=float,
+                    help="MB the cache may grow to before the least recently used entries are dropped, 64 if left out")
+parser.add_argument("--state", default=STATE_PATH, help="file the pedal saves its state to and restores it from")
+parser.add_argument("--fresh", action="store_true", help="start from the defaults instead of the saved state")
+parser.add_argument("--expression", action="store_true",
+                    help="read the expression pedal and knobs through an MCP3008 ADC on the SPI bus")
+parser.add_argument("--looper", choices=["before", "after"],
+                    help="add a looper before or after the effects, worked by the footswitches in looper mode")
+parser.add_argument("--loop-time", type=float,
+                    help="seconds of the longest loop, allocated at startup, 60 if left out")
+parser.add_argument("--loop-dir", help="export every loop to this directory in the background when it is stopped")
+parser.add_argument("--chain", nargs="+", metavar="EFFECT",
+                    help="play these effects in series on a pedalboard, the first button turning the selected one on "
+                         "and off and the second stepping through them")
+parser.add_argument("--simulate", action="store_true",
+                    help="run without the Raspberry Pi's GPIO pins, on simulated footswitches")
+parser.add_argument("--standby", action="store_true",
+                    help="get ready and wait for a line on stdin before taking the sound card, used by pedalService.py")
+addProfileArguments(parser)
+parser.set_defaults(config=os.path.join(os.path.dirname(os.path.abspath(__file__)), "pedal.json"))
+args = parser.parse_args()
+if args.numpy and args.workers:
+    parser.error("--numpy and --workers can't be used together")
+if args.convolution_reverb and args.workers:
+    parser.error("--convolution-reverb and --workers can't be used together")
+if args.chain:
+    # The remote controls and the other backends address the effects of the registry, which a chain doesn't play
+    for option in ("workers", "numpy", "convolution_reverb", "control_port", "midi_port", "expression"):
+        if getattr(args, option):
+            parser.error("--chain and --%s can't be used together" % option.replace("_", "-"))
+    unknown = [name for name in args.chain if name not in dict(EFFECTS)]
+    if unknown:
+        parser.error("unknown effects %s" % ", ".join(unknown))
+
+# The presets are read before standing by, which leaves as little as possible to do once the pedal takes over
+presets = PresetBank.load(args.presets)
+if args.preset and args.preset not in presets:
+    parser.error("unknown preset %s, the bank has %s" % (args.preset, ", ".join(presets.names)))
+
+# A warm standby kept by pedalService.py has done its imports and waits here until the running pedal goes away,
+# then takes over the footswitches and the sound card
+if args.standby:
+    print("Standing by")
+    sys.stdout.flush()
+    if not sys.stdin.readline():
+        sys.exit(0)
+    startTime = time.perf_counter()
+    importTime = 0.0
+
+# The state saved by the last run, which the pedal picks up where it left off unless started with --fresh. A preset,
+# or tempo given on the command line wins over the saved one.
+state = None if args.fresh else loadState(args.state)
+if args.preset:
+    presets.current = args.preset
+elif state is not None and state.get("preset") in presets:
+    presets.current = state["preset"]
 
 # Set up GPIO pins for pedal input and LED output
 INPUT_PIN = 17
 INPUT_PIN_2 = 22
 OUTPUT_PIN = 27
 
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-
-# Setting the internal resistors on the given GPIO pins to pull low,
-# so that the program responds correctly when a high signal is emitted by a button press
-GPIO.setup(INPUT_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN) 
-GPIO.setup(INPUT_PIN_2, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-GPIO.setup(OUTPUT_PIN, GPIO.OUT)
-
-# Booleans to keep track of current and previous values of the button input,
-# to determine if there's been a button press or not.
-lastButtonState = False
-currentButtonState = False
-lastButtonState2 = False
-currentButtonState2 = False
-
-# Start Pyo server to open audio inputs and get ready to pass through Pyo classes
-s = Server()
-s.setInputDevice(1)
-s.setOutputDevice(1)
+# The footswitches are edge-triggered: the GPIO backend calls back on every pin change, and the Footswitch
+# debounces the buttons and queues up press events for the main loop. With --simulate, the backend is swapped for
+# footswitch.SimulatedGPIOBackend to run the pedal without the Raspberry Pi hardware.
+gpio = SimulatedGPIOBackend() if args.simulate else RPiGPIOBackend()
+gpio.setupOutput(OUTPUT_PIN)
+footswitch = Footswitch(gpio, [INPUT_PIN, INPUT_PIN_2])
+
+# Start Pyo server to open audio inputs and get ready to pass through Pyo classes. The sample rate, buffer size,
+# audio host and devices come from the server profile in pedal.json, or whichever file and settings were given on
+# the command line. With --autotune, the buffer size is first stepped down while playing the heaviest effect,
+# the Leslie speaker, until dropouts appear, and the pedal then runs one step above that.
+profile = profileFromArgs(args)
+if args.autotune:
+    if autoTune(profile, lambda: makeLeslie(Input(chnl=0)).out()) is None:
+        print("Every buffer size dropped out with the Leslie playing, expect dropouts with the heavier effects")
+s = createServer(profile)
 s.boot()
 s.start()
-
-# The class tutorial using the Flanger class as a representation of the structure used in a PyoObject. This was 
-# used as inspiration to creating the structure of the different effect classes to either override the original 
-# methods in the function, or act as getter, setter, or other methods to interact with the aspects of the 
-# audiowave, while the modulation effects created in the pedal were created from our custom combinations and 
-# implementations of the Pyo library.
-
-# Flanger class implementation adapted from here: http://ajaxsoundstudio.com/pyodoc/tutorials/pyoobject2.html
-class Flanger(PyoObject):
-    def __init__(self, input, depth=0.75, lfofreq=0.2, feedback=0.5, mul=1, add=0):
-        # Initialize PyoObject basic attributes
-        PyoObject.__init__(self)
-
-        # Keep references of arguments
-        self._input = input
-        self._depth = depth
-        self._lfofreq = lfofreq
-        self._feedback = feedback
-
-        # Using InputFader to create a fade between different effects when changing sources
-        self._in_fader = InputFader(input)
-
-        # Convert each var into lists
-        in_fader, depth, lfofreq, feedback, mul, add, lmax = convertArgsToLists(self._in_fader, depth, lfofreq, feedback, mul, add)
-
-        # In the heart of the class lies the guitar effects, which controls the modulation of the audio passed into the class.
-        # Each of the aspects of the Flanger effect are created here, with the sweeping delayed audio which follows the original guitar
-        # audio created from the signal, LFO, and Delay objects. The switching of each of the signal effects, created from switching 
-        # between audio signals using alternating Sine object loops. Finally, each of the audio signals are placed into a Mixer 
-        # object to allow for us to place multiple effects into the same audiostream, along with change the presence of each effect
-        # in the audio stream.
-        self._amplitudemodulation = Sig(depth, mul=0.005)
-        self._wavechange = LFO(freq=lfofreq * 2, sharp=0.3, type=7, add=0.005, mul=self._amplitudemodulation)
-        self._flangedelay = SDelay(in_fader, delay=self._wavechange, maxdelay=1.5, mul=1, add=0)
-        self._alternatewave = Sin(self._flangedelay, mul=1, add=0)
-        self._alternateinput = Sin(self._input, mul=-1, add=0)
-        self._flange = Mixer(outs=2, chnls=2, time=0.05, mul=1.02, add=0.01)
-        self._flange.addInput(voice=0, input=self._input)
-        self._flange.addInput(voice=1, input=self._flangedelay)
-
-        self._flange.setAmp(0, 1, 1)
-        self._flange.setAmp(1, 1, 0.9)
-        
-        # Exports each of the objects from the Flanger class to the created Flanger guitar effect object
-        self._base_objs = self._flange.getBaseObjects()
-
-    def setInput(self, x, fadetime=0.05):
-        # Replaces the input attribute, then returns the reference of the input object to the guitar audio to ensure the reference is 
-        # updated
-        self._input = x
-        self._in_fader.setInput(x, fadetime)
-
-    def setDepth(self, x):
-        # Replaces the depth attribute with the given value, then updates the value inside the guitar objects created
-        self._depth = x
-        self._amplitudemodulation.value = x
-
-    def setLfoFreq(self, x):
-        # Replaces the lfofreq attribute, then updates the value in the LFO oscilating object effect
-        self._lfofreq = x
-        self._wavechange.freq = x * 2
-
-    def setFeedback(self, x):
-        # Replaces feedback attribute, then updates the attribute in the flangedelay object
-        self._feedback = x
-        self._flangedelay.feedback = x
-
-    # Getter and Setter methods to allow users to interact with the different parameters of the object directly outside of the object
-    @property
-    def input(self):
-        return self._input
-    @input.setter
-    def input(self, x):
-        self.setInput(x)
-
-    @property
-    def depth(self):
-        return self._depth
-    @depth.setter
-    def depth(self, x):
-        self.setDepth(x)
-
-    @property
-    def lfofreq(self):
-        return self._lfofreq
-    @lfofreq.setter
-    def lfofreq(self, x):
-        self.setLfoFreq(x)
-
-    @property
-    def feedback(self):
-        return self._feedback
-    @feedback.setter
-    def feedback(self, x):
-        self.setFeedback(x)
-
-    # Overriding the methods from the base PyoObject to create the utilize the new flanger modulations
-    # This method makes sure controls work properly when used from the GUI, not relevant to headless usage sadly
-    def ctrl(self, map_list=None, title=None, wxnoserver=False):
-        self._map_list = []
-        PyoObject.ctrl(self, map_list, title, wxnoserver)
-
-    # The following three methods are responsible for starting and stopping audio output
-    # Play and Out methods are both methods that play all of the audio effects when called and returns the modulating 
-    # guitar effect object
-    def play(self, dur=0, delay=0):
-        self._amplitudemodulation.play(dur, delay)
-        self._wavechange.play(dur, delay)
-        self._flangedelay.play(dur, delay)
-        return PyoObject.play(self, dur, delay)
-
-    def out(self, chnl=0, inc=1, dur=0, delay=0):
-        self._amplitudemodulation.play(dur, delay)
-        self._wavechange.play(dur, delay)
-        self._flangedelay.play(dur, delay)
-        return PyoObject.out(self, chnl, inc, dur, delay)
-
-    # Stop method halts all audio effects of the current object and returns the object to the call
-    def stop(self, wait=0):
-        self._amplitudemodulation.stop(wait)
-        self._wavechange.stop(wait)
-        self._flangedelay.stop(wait)
-        return PyoObject.stop(self, wait)
-
-# The Vibrato object increases and decreases the pitch of the sound very quickly, creating a light wobbling effect on the Guitar or Bass pitch    
-class Vibrato(PyoObject):
-    def __init__(self, input, depth=0.5, mul=1, add=0):
-        # Initialize PyoObject basic attributes
-        PyoObject.__init__(self)
-
-        # The reference of the arguments are saved
-        self._input = input
-        self._depth = depth
-
-        # InputFader is applied to the input audio stream to allow for crossfading between internal input devices, such as when switching between 
-        # different guitar or bass effects, along with different guitars or basses
-        self._in_fader = InputFader(input)
-
-        in_fader, depth, mul, add, lmax = convertArgsToLists(self._in_fader, depth, mul, add)
-
-        # Here, the sound effects of the modulation are applied to the object. First, the Sine wave and Signal objects create an oscillating 
-        # signals at a frequency of the given depth. Then, the Frequency Shift object slightly oscillates the frequency over the course of the 
-        # object being active.
-        self._sinewave = Sine(freq=depth, mul=5, add=3)
-        self._wavesig = Sig(self._sinewave, mul=2)
-        self._vibrato = FreqShift(in_fader, self._wavesig, mul=mul, add=add).out()
-
-        # Set the effects to the given audio output
-        self._base_objs = self._vibrato.getBaseObjects()
-
-    def setInput(self, x, fadetime=0.05):
-        # Replaces the input attribute, then returns the reference of the input object to the guitar audio to ensure the reference is 
-        # updated
-        self._input = x
-        self._in_fader.setInput(x, fadetime)
-
-    def setDepth(self, x):
-        # Replaces the depth attribute with the given value, then updates the value inside the guitar objects created
-        self._depth = x
-        self._wavesig.value = x
-
-    # Getter and Setter methods to allow users to interact with the different parameters of the object outside of the object
-    @property
-    def input(self):
-        return self._input
-    @input.setter
-    def input(self, x):
-        self.setInput(x)
-
-    @property
-    def depth(self):
-        return self._depth
-    @depth.setter
-    def depth(self, x):
-        self.setDepth(x)
-
-    # Overriding the methods from the base PyoObject to create the utilize the new vibrato modulations
-    # This method makes sure controls work properly when used from the GUI, not relevant to headless usage sadly    
-    def ctrl(self, map_list=None, title=None, wxnoserver=False):
-        self._map_list = []
-        PyoObject.ctrl(self, map_list, title, wxnoserver)
-
-    # The following three methods are responsible for starting and stopping audio output
-    # Play and Out methods are both methods that play all of the audio effects when called and returns the modulating 
-    # guitar effect object
-    def play(self, dur=0, delay=0):
-        self._wavesig.play(dur, delay)
-        self._sinewave.play(dur, delay)
-        self._vibrato.play(dur, delay)
-        return PyoObject.play(self, dur, delay)
-
-    def out(self, chnl=0, inc=1, dur=0, delay=0):
-        self._wavesig.play(dur, delay)
-        self._sinewave.play(dur, delay)
-        self._vibrato.play(dur, delay)
-        return PyoObject.out(self, chnl, inc, dur, delay)
-
-    # Stop method halts all audio effects of the current object and returns the object to the call 
-    def stop(self, wait=0):
-        self._wavesig.stop(wait)
-        self._sinewave.stop(wait)
-        self._vibrato.stop(wait)
-        return PyoObject.stop(self, wait)
-        
-# The Tremolo effect acts similarly to Vibrato, with the volume of the guitar audio wobbling instead of the pitch
-class Tremolo(PyoObject):
-    def __init__(self, input, freq=6, mul=1, add=0):
-        # Initialize basic guitar object parameters, as well as the change in frequency from the Tremolo effect, as well as the 
-        # InputFader function applied to the imput signal for fading into different effects or devices, such as switching 
-        # between different guitar or bass effects or devices
-        PyoObject.__init__(self)
-        
-        self._input = input
-        self._freq = freq
-        
-        self._in_fader = InputFader(input)
-
-        in_fader, freq, mul, add, lmax = convertArgsToLists(self._in_fader, freq, mul, add)
-
-        # Sound effects are applied to the input guitar or bass audio. The given frequency of the tremolo is oscillated using the Sine 
-        # object, as well as the volume control in the Chorus object, while the delay of the chorus effect is nullified to solely utilize the 
-        # volume change of the Tremolo effect
-        self._tremosc = Sine(freq=self._freq, mul=mul)
-        self._tremolo = Chorus(input, depth=.1, feedback=0, bal=0.5, mul=self._tremosc, add=add)
-
-        self._base_objs = self._tremolo.getBaseObjects()
-
-    # Getter and Setter methods to allow users to interact with the different parameters of the object directly outside of the object
-    def setInput(self, x, fadetime=0.05):
-        # Replaces the input attribute, then returns the reference of the input object to the guitar audio to ensure the reference is 
-        # updated
-        self._input = x
-        self._in_fader.setInput(x, fadetime)
-
-    def setFreq(self, x):
-        # Replaces the frequency attribute of the function in the class, along with updating the frequency within the the Tremolo 
-        # oscillation object "tremosc" 
-        self._freq = x
-        self._tremosc.freq = x
-
-    # Getter and Setter methods to allow users to interact with the different parameters of the object outside of the object
-    @property
-    def input(self):
-        return self._input
-    @input.setter
-    def input(self, x):
-        self.setInput(x)
-
-    @property
-    def freq(self):
-        return self._freq
-    @freq.setter
-    def freq(self, x):
-        self.setFreq(x)
-
-    # Overriding the methods from the base PyoObject to create the utilize the new tremolo modulations
-    # This method makes sure controls work properly when used from the GUI, not relevant to headless usage sadly   
-    def ctrl(self, map_list=None, title=None, wxnoserver=False):
-        self._map_list = []
-        PyoObject.ctrl(self, map_list, title, wxnoserver)
-
-    # The following three methods are responsible for starting and stopping audio output
-    # Play and Out methods are both methods that play all of the audio effects when called and returns the modulating 
-    # guitar effect object
-    def play(self, dur=0, delay=0):
-        self._tremosc.play(dur, delay)
-        return PyoObject.play(self, dur, delay)
-
-    def out(self, chnl=0, inc=1, dur=0, delay=0):
-        self._tremosc.play(dur, delay)
-        return PyoObject.out(self, chnl, inc, dur, delay)
-
-    # Stop method halts all audio effects of the current object and returns the object to the call 
-    def stop(self, wait=0):
-        self._tremosc.stop(wait)
-        return PyoObject.stop(self, wait)
-
-# The Leslie Speaker guitar effect acts as a combination of multiple effects to create a sound similar to a fan in 
-# front of a speaker. 
-class Leslie(PyoObject):
-    def __init__(self, input, depth=1, pitdepth=3, mul=1, add=0):
-        # Each of the basic methods for the PyoObject are current method parameters, as well as the parameters of 
-        # the object being initialized into references which are converted into lists to contain either one or multiple 
-        # values from different modulation effects, such as Sine's frequency variable and Phaser's frequency variable. 
-        # Additionally, the guitar signal is converted through the InputFader function to allow for the signal to fade 
-        # in between the switching of effects or input devices, such as the guitar or the bass
-        PyoObject.__init__(self)
-
-        self._input = input
-        self._depth = depth
-
-        self._in_fader = InputFader(input)
-
-        in_fader, mul, add, lmax = convertArgsToLists(self._in_fader, mul, add)
-
-        # Now to the Key Guitar Effect of the project. The Leslie effect combines Tremolo, Phaser, and Vibrato sound effects 
-        # to create the sound of a Leslie speaker. First, the two sine waves of the Phaser effect are creating using the Sine 
-        # objects, which are imported into the initialized Phaser object. Second, the Tremolo effect created previously is 
-        # implemented using the given guitar audio. Thirdly, the Phaser effect is initialized, modulating the given guitar 
-        # audio along with the given oscillating frequency and spread values from the sine wave objects "lfofreq" and "lfospread."
-        # Fourthly, a Vibrato effect is created using the guitar audio and oscillating the pitch slightly by the given depth value
-        # Finally, each of the sound effects are inputted into the Mixer object to allow for future users to control which audio 
-        # devices each effect is sent through and the prominence of each effect in the signal. In our default settings for this 
-        # effect, the entire Leslie speaker effect outputs on a single speaker with each part of the effect outputted equally.
-        self._lfofreq = Sine(freq=[.2,.20],mul=70,add=200)
-        self._lfospread = Sine(freq=[.16 * self._depth, .13 * self._depth], mul=.6, add=1.5)
-        self._tremolo = Tremolo(input, freq=4).out()
-        self._phaser = Phaser(input, freq=self._lfofreq, spread=self._lfospread, q=1, feedback=.5, num=18, mul=.1).out()
-        self._vibrato = Vibrato(input, depth=6).out()
-        self._leslie = Mixer(outs=3, chnls=3, time=0.5, mul=mul, add=add).out()
-        self._leslie.addInput(voice=0, input=self._tremolo)
-        self._leslie.addInput(voice=1, input=self._phaser)
-        self._leslie.addInput(voice=2, input=self._vibrato)
-
-        self._leslie.setAmp(0, 1, 1)
-        self._leslie.setAmp(1, 1, 1)
-        self._leslie.setAmp(2, 1, 1)
-        
-        self._base_objs = self._leslie.getBaseObjects()
-
-    # Getter and Setter methods to allow users to interact with the different parameters of the object directly outside of the object
-    def setInput(self, x, fadetime=0.05):
-        # Replaces the input attribute, then returns the reference of the input object to the guitar audio to ensure the reference is 
-        # updated
-        self._input = x
-        self._in_fader.setInput(x, fadetime)
-
-    # Getter and Setter methods to allow users to interact with the different parameters of the object outside of the object    
-    @property
-    def input(self):
-        return self._input
-    @input.setter
-    def input(self, x):
-        self.setInput(x)
-        
-    @property
-    def depth(self):
-        return self._depth
-    @depth.setter
-    def depth(self, x):
-        self.setDepth(x)
-    
-    # Overriding the methods from the base PyoObject to create the utilize the new leslie modulation
-    # This method makes sure controls work properly when used from the GUI, not relevant to headless usage sadly  
-    def ctrl(self, map_list=None, title=None, wxnoserver=False):
-        self._map_list = []
-        PyoObject.ctrl(self, map_list, title, wxnoserver)
-
-    # The following three methods are responsible for starting and stopping audio output
-    # Play and Out methods are both methods that play all of the audio effects when called and returns the modulating 
-    # guitar effect object 
-    def play(self, dur=0, delay=0):
-        self._tremolo.play(dur, delay)
-        self._phaser.play(dur, delay)
-        self._vibrato.play(dur, delay)
-        return PyoObject.play(self, dur, delay)
-
-    def out(self, chnl=0, inc=1, dur=0, delay=0):
-        self._tremolo.play(dur, delay)
-        self._phaser.play(dur, delay)
-        self._vibrato.play(dur, delay)
-        return PyoObject.out(self, chnl, inc, dur, delay)
-
-    # Stop method halts all audio effects of the current object and returns the object to the call    
-    def stop(self, wait=0):
-        self._tremolo.stop(wait)
-        self._phaser.stop(wait)
-        self._vibrato.stop(wait)
-        return PyoObject.stop(self, wait)
-
-# To begin the loop, first each of the guitar effects are initialized with their fine-tuned parameters for each specific effects. This list 
-# includes of two input objects to act as the pure audio from the guitar and as the input audio for each of the guitar effects. Next, each of the 
-# special guitar effects are initialized. These effects include of fine-tuned classic effects created from PyoObjects such as Chorus, Delay, and 
-# Distortion, multilayered or multichained effects created from inputting value manipulation or audio modulations effects into other created 
-# guitar effect objects to create a single effect such as FrequencyShift, and each of the initialized custom class effects of Vibrato, Tremolo, 
-# and the Leslie speaker effect
-a = Input(chnl=0).out()
-b = Input(chnl=0)
-chorus = Chorus(b, depth=1.2, feedback=.6, bal=0.5).out()
-distr = Disto(b, slope=.3, mul=.65).out()
-reverb = STRev(b, revtime=1.8, roomSize=1.2).out()
-delay = Delay(b, delay=.6, feedback=.3, maxdelay=.8).out()
-freqShift = FreqShift(b, shift=200, mul=1).out()
-flanger = Flanger(b, depth=.875, lfofreq=.545).out()
-fol = Follower(b, freq=45, mul=4200, add=35)
-# Envelope / Autowah implementation adapted from here: https://www.matthieuamiguet.ch/blog/diy-guitar-effects-python
-envelope = Biquad(b, freq=fol, q=7, type=0).out()
-tremfreq = Sine(freq=6)
-tremolo = Chorus(b, depth=.1, feedback=.2, bal=0.5, mul=tremfreq).out()
-tremolo1 = Tremolo(b, freq=6, mul=1, add=0)
-freq = FreqShift(b, shift=fol, mul=1, add=0).out()
-vibrato = Vibrato(b, depth=10).out()
-lfo1 = Sine(freq=[.1,.15], mul=65, add=200)
-lfo2 = Sine(freq=[.18, .15], mul=.6, add=1.5)
-phaser = Phaser(b, freq=lfo1, spread=lfo2, q=1, feedback=.5, num=20).out()
-leslie = Leslie(b, mul=.7).out()
-
-# Stop all special guitar effects before outputting so that there are no issues playing standard guitar audio when 
-# program drops into the main loop
-a.out()
-chorus.stop()
-distr.stop()
-reverb.stop()
-delay.stop()
-freqShift.stop()
-flanger.stop()
-envelope.stop()
-tremolo.stop()
-freq.stop()
-vibrato.stop()
-phaser.stop()
-leslie.stop()
-
-# Throw all of the output effects into an array to index through and toggle the selected effect
-effectList = [chorus, distr, reverb, delay, flanger, envelope, tremolo1, vibrato, phaser, leslie, freq]
-effectNameList = ["Chorus", "Distortion", "Reverb", "Delay", "Flanger", "Envelope Filter", "Tremolo", "Vibrato", "Phaser", "Leslie Speaker", "FreqShift"]
-effectCtrl = [False, False, False, False, False, False, False, False, False, False, False, False]
+print(describeProfile(profile))
+
+# The guitar effects are built on demand by the effect registry from the factories in effects.py. A single input 
+# object reads the guitar from the sound card, and is shared by the clean channel and every guitar effect, with the 
+# clean channel being a light Sig tap on it so it can be stopped without cutting off the effects. The registry
+# only builds the selected effect and its neighbours in the cycle order, and tears down effects that haven't been
+# used for a while, unless the pedal was started with --eager to build every effect up front. Every effect is set
+# to the current preset of the preset bank as it is built, and recalling another preset later changes the
+# parameters of the built effects in place. Unless the pedal was started with --free-running, the time-based
+# effects are locked to a shared tempo clock, so they all follow the tapped tempo. With --workers, every effect is
+# built up front in a pool of worker processes instead, which spreads them over the cores of the Pi. With --numpy,
+# the Flanger, Tremolo, Vibrato and Leslie are built up front as NumPy kernels run by the server once per buffer.
+# With --baked-lfos, the Flanger reads its sweep from a table in the effect cache, and with --convolution-reverb
+# the Reverb convolves with a room response from the cache on the NumPy backend, the rooms of every preset being
+# loaded before the pedal starts.
+guitar = Input(chnl=0)
+if args.measure_latency:
+    latency = measureRoundTrip(s, guitar)
+    if latency is None:
+        print("No click came back, is the output patched into the input?")
+    else:
+        print("Measured input-to-output latency: %.1f ms" % (latency * 1000))
+
+# With --looper before, the looper records the guitar and plays the loop into the clean channel and the effects,
+# so the loop can be played through another effect than the one it was recorded with. With --looper after, it
+# records what the pedal puts out and plays the loop next to it. Either way its buffer is allocated here, once, for
+# the longest loop.
+looper = None
+if args.looper:
+    from looper import LOOP_TIME, STOPPED, Looper, loopPath
+    loopTime = args.loop_time or LOOP_TIME
+if args.looper == "before":
+    looper = Looper(guitar, maxTime=loopTime)
+    guitar = looper.output
+a = Sig(guitar)
+bpm = args.bpm or (state or {}).get("bpm") or REFERENCE_BPM
+clock = None if args.free_running else TempoClock(bpm)
+factories = EFFECTS
+if args.baked_lfos or args.convolution_reverb:
+    from effectCache import CACHE_DIR, CACHE_SIZE, ConvolutionReverbKernel, EffectCache, bakedFactories, \
+        prewarmReverbs
+    cache = EffectCache(args.cache_dir or CACHE_DIR,
+                        maxBytes=CACHE_SIZE if args.cache_size is None else int(args.cache_size * 1048576))
+    if args.baked_lfos:
+        factories = bakedFactories(cache)
+    if args.convolution_reverb:
+        prewarmReverbs(cache, presets, profile.sr, profile.buffersize)
+
+# The state the pedal saves on every change and restores at startup. Every parameter change and preset recall, and
+# every event of the main loop, flags it as changed, to be saved by the state store's thread.
+def pedalState():
+    return {
+        "effect": effectNameList[effectIndex],
+        "on": sfxOn,
+        "preset": presets.current,
+        "bpm": None if clock is None else clock.bpm,
+        "parameters": effectList.overrides(),
+    }
+
+
+store = StateStore(args.state, pedalState)
+if args.workers:
+    from multicore import WorkerPool
+    pool = WorkerPool(guitar, workers=args.workers, sr=profile.sr, buffersize=profile.buffersize, clock=clock).start(s)
+    effectList = EffectRegistry(guitar, factories=pool.factories(), lazy=False, presets=presets,
+                                onChange=store.changed)
+    print("Effects running in %d worker processes" % pool.workers)
+elif args.numpy or args.convolution_reverb:
+    from numpyEffects import NumpyBridge
+    kernels = []
+    if args.convolution_reverb:
+        kernels.append(ConvolutionReverbKernel(cache, blocksize=profile.buffersize, sr=profile.sr))
+    bridge = NumpyBridge(guitar, names=None if args.numpy else [], sr=profile.sr, buffersize=profile.buffersize,
+                         kernels=kernels).start(s)
+    effectList = EffectRegistry(guitar, factories=bridge.factories(factories), lazy=False, presets=presets,
+                                clock=clock, onChange=store.changed)
+    print("Running %s on the NumPy backend" % ", ".join(chain.name for chain in bridge.chains))
+else:
+    effectList = EffectRegistry(guitar, factories=factories, lazy=not args.eager, presets=presets, clock=clock,
+                                onChange=store.changed)
+effectNameList = effectList.names
+
+# With --chain, the pedal plays the named effects in series on a pedalboard instead of one effect of the registry,
+# every slot starting bypassed. The signal graph plays the board whenever a slot is on, and the clean channel
+# otherwise.
+board = None
+slotIndex = 0
+if args.chain:
+    from pedalboard import Pedalboard
+    board = Pedalboard(guitar, factories=factories, presets=presets, clock=clock)
+    for name in args.chain:
+        board.append(name, enabled=False)
+    board.stop()
+    print("Chain: " + " -> ".join(board.names))
 
 # Index for the currently selected effect
 effectIndex = 0 
 
 ledState = False
 sfxOn = False
-
-# Main loop
-while (True):
-    # Update button status variables
-    lastButtonState = currentButtonState
-    currentButtonState = GPIO.input(INPUT_PIN)
-    lastButtonState2 = currentButtonState2
-    currentButtonState2 = GPIO.input(INPUT_PIN_2)
-
-    #C heck for any changes in the button press state
-    if ((lastButtonState != currentButtonState) and lastButtonState == GPIO.HIGH):
-        #W hen the first button is pressed, toggle the effect on / off, depending upon previous state.
-        if (not sfxOn):
-            print("Toggle On")
-        if (sfxOn):
-            print("Toggle Off")
-        ledState = not ledState
-        sfxOn = not sfxOn
-        effectCtrl[effectIndex] = not effectCtrl[effectIndex]
-
-    if ((lastButtonState2 != currentButtonState2) and lastButtonState2 == GPIO.HIGH):
-        # When the second button is pressed, update the effect index
-        # If it goes past the bounds of the indexable list, it wraps back around to zero.
-        print("Changing Effect")
-        ledState = not ledState
-        effectIndex += 1
-        if (effectIndex > len(effectList) - 1):
-            effectIndex = 0
-        print("Current effect: " + effectNameList[effectIndex])
-        
-    # Update the state of the LED, to indicate button presses
-    if (ledState):
-        GPIO.output(OUTPUT_PIN, GPIO.HIGH)
-    else:
-        GPIO.output(OUTPUT_PIN, GPIO.LOW)
-
-    # If the effects were turned on, stop all of the PyoObjects from outputting, and play the currently
-    # selected effect at the given index
-    if (sfxOn):
-        a.stop()
-        distr.stop()
-        chorus.stop()
-        reverb.stop()
-        delay.stop()
-        freqShift.stop()
-        flanger.stop()
-        envelope.stop()
-        tremolo1.stop()
-        freq.stop()
-        vibrato.stop()
-        phaser.stop()
-        leslie.stop()
-        effectList[effectIndex].out()
-
-    # If the effects were turned off, play the clean channel and stop all of the special effects
-    else:
-        a.out()
-        distr.stop()
-        chorus.stop()
-        reverb.stop()
-        delay.stop()
-        freqShift.stop()
-        flanger.stop()
-        envelope.stop()
-        tremolo1.stop()
-        freq.stop()
-        vibrato.stop()
-        phaser.stop()
-        leslie.stop()
-        effectList[effectIndex].stop()
-
-    # Sleeps for a tenth of a second so there's less of a load on the CPU
-    # for polling the buttons
-    time.sleep(.100)
+if state is not None:
+    if state.get("effect") in effectNameList:
+        effectIndex = effectList.indexOf(state["effect"])
+        sfxOn = bool(state.get("on"))
+    # The live changes were made on top of the saved preset, and are dropped along with it
+    if state.get("preset") == presets.current:
+        restoreParameters(effectList, state.get("parameters", {}))
+
+# Build the selected effect and its neighbours right away, so the first stomp doesn't wait for a build, counting
+# them into the startup figures. A chain starts with every slot bypassed instead.
+if board is None:
+    effectList.start(effectIndex)
+    print(formatReport(effectList.report()))
+else:
+    sfxOn, effectIndex = False, 0
+print("Preset: %s" % presets.current)
+
+# Holding the second button down steps through the modes of the footswitches: changing effects, tapping the tempo
+# unless free-running, and looping with --looper. While tapping, the second button taps the tempo instead of
+# changing the effect, and while looping, the buttons work the looper.
+modes = ["effects"] + (["tapping"] if clock is not None else []) + (["looping"] if args.looper else [])
+mode = "effects"
+
+# The signal graph keeps track of which source is sounding, starting with the clean channel, and crossfades from
+# the old source to the new one on every switch instead of cutting between them
+graph = SignalGraph(a, effectList if board is None else [board], fadetime=args.crossfade)
+graph.start()
+graph.apply(sfxOn, effectIndex)
+if args.looper == "after":
+    looper = Looper(graph.output, maxTime=loopTime).out()
+if looper is not None:
+    print("Looper %s the effects, up to %.0f s" % (args.looper, loopTime))
+if state is not None and board is None:
+    print("Restored %s, %s" % (effectNameList[effectIndex], "on" if sfxOn else "off"))
+store.start()
+
+# Telemetry samples the process's CPU load and dropouts, and records how long every stomp takes to be heard, when
+# asked for
+telemetry = None
+if args.telemetry_port:
+    from telemetry import Telemetry, TelemetryServer
+    telemetry = Telemetry(s).start()
+    graph.onRamp = telemetry.switchAudible
+    TelemetryServer(telemetry, port=args.telemetry_port).start()
+    print("Telemetry served on http://127.0.0.1:%d/telemetry" % args.telemetry_port)
+
+# The control server takes OSC and MIDI messages on its own thread. Effect selections are put on the footswitch
+# queue and handled by the main loop just like button presses, while parameter changes are batched and applied by
+# the audio server once per buffer. With --expression, the expression pedal and knobs are sampled on a thread of
+# their own and feed the same batcher, from a simulated ADC that stays put with --simulate.
+if args.control_port or args.midi_port or args.expression:
+    batcher = ParameterBatcher(effectList).start(s)
+if args.expression:
+    from expression import ExpressionSampler, MCP3008Backend, SimulatedADCBackend
+    adc = SimulatedADCBackend() if args.simulate else MCP3008Backend()
+    expression = ExpressionSampler(adc, batcher, effectNameList).start()
+if args.control_port or args.midi_port:
+    control = ControlServer(footswitch, batcher, effectNameList, port=args.control_port or 0,
+                            host=args.control_host).start()
+    if args.control_port:
+        print("Listening for OSC on %s:%d" % (args.control_host, control.port))
+    if args.midi_port:
+        midi = RtMidiInput(args.midi_port, control.handleMidi).start()
+
+# systemd and pedalService.py stop the pedal with SIGTERM, which leaves through the finally below so the last
+# change is saved
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+print("Ready in %.2f s, %.2f s of it importing" % (time.perf_counter() - startTime, importTime))
+
+# Main loop, which sleeps until the Footswitch or the control server reports an event instead of polling the buttons
+try:
+    while (True):
+        event = footswitch.waitForEvent()
+        if (event.kind == SELECT):
+            # An effect picked directly from the control server is selected and turned on
+            effectIndex = event.value
+            sfxOn = True
+            print("Current effect: " + effectNameList[effectIndex])
+        elif (event.kind == BYPASS):
+            sfxOn = event.value
+            print("Toggle On" if sfxOn else "Toggle Off")
+        elif (event.kind == PRESET):
+            if event.value in presets:
+                effectList.recallPreset(event.value)
+                print("Preset: %s" % event.value)
+            else:
+                print("Unknown preset: %s" % event.value)
+        elif (event.kind == RELEASE and event.pin == INPUT_PIN_2):
+            # The second button acts when it is let go, so a long hold can be told apart from a stomp. Holding it down
+            # moves on to the next mode, every stomp while tapping is a tap, timed from when it went down, and a
+            # stomp while looping stops the loop, or clears it once stopped.
+            if (event.duration >= HOLD_TIME and len(modes) > 1):
+                if (mode == "tapping"):
+                    print("Tempo: %.1f BPM" % clock.bpm)
+                mode = modes[(modes.index(mode) + 1) % len(modes)]
+                if (mode == "tapping"):
+                    clock.resetTaps()
+                    print("Tap the tempo")
+                elif (mode == "looping"):
+                    print("Looper: %s" % looper.state)
+                elif (board is not None):
+                    print("Current slot: " + board.names[slotIndex])
+                else:
+                    print("Current effect: " + effectNameList[effectIndex])
+                ledState = not ledState
+            elif (mode == "tapping"):
+                bpm = clock.tap(event.timestamp - event.duration)
+                if bpm is not None:
+                    print("Tempo: %.1f BPM" % bpm)
+                ledState = not ledState
+            elif (mode == "looping"):
+                loopState = looper.stopOrClear()
+                print("Looper: %s" % loopState)
+                if (loopState == STOPPED and args.loop_dir):
+                    loopFile = loopPath(args.loop_dir)
+                    looper.export(loopFile)
+                    print("Exporting the loop to " + loopFile)
+                ledState = not ledState
+            elif (board is not None):
+                # With --chain, a stomp selects the next slot of the board
+                slotIndex = (slotIndex + 1) % len(board)
+                print("Current slot: " + board.names[slotIndex])
+                ledState = not ledState
+            else:
+                # When the second button is stomped, update the effect index
+                # If it goes past the bounds of the indexable list, it wraps back around to zero.
+                print("Changing Effect")
+                ledState = not ledState
+                effectIndex += 1
+                if (effectIndex > len(effectList) - 1):
+                    effectIndex = 0
+                print("Current effect: " + effectNameList[effectIndex])
+        elif (event.kind == PRESS and event.pin == INPUT_PIN and mode == "looping"):
+            # While looping, the first button records, plays and overdubs. It acts as soon as it goes down, so the
+            # loop starts and ends where it was stomped.
+            print("Looper: %s (%.2f s)" % (looper.cycle(), looper.seconds))
+            ledState = not ledState
+        elif (event.kind == PRESS and event.pin == INPUT_PIN and board is not None):
+            # With --chain, the first button turns the selected slot on or off, and the board is heard while any
+            # slot is on
+            print("%s %s" % (board.names[slotIndex], "on" if board.toggle(slotIndex) else "off"))
+            sfxOn = any(board.enabled())
+            ledState = not ledState
+        elif (event.kind == PRESS and event.pin == INPUT_PIN):
+            # When the first button is pressed, toggle the effect on / off, depending upon previous state.
+            if (not sfxOn):
+                print("Toggle On")
+            if (sfxOn):
+                print("Toggle Off")
+            ledState = not ledState
+            sfxOn = not sfxOn
+        else:
+            continue
+
+        # Update the state of the LED, to indicate button presses
+        gpio.write(OUTPUT_PIN, ledState)
+
+        # Let the signal graph switch between the clean channel and the currently selected effect. It only talks
+        # to the pyo server when the selection actually changed, so the running effect is never restarted. A stomp
+        # that asks for another source is timed by the telemetry until the graph ramps over to it, even when the
+        # graph queues it behind a running fade.
+        target = effectIndex if sfxOn else None
+        if (telemetry is not None and target != graph.requested):
+            telemetry.requestSwitch(target, (effectNameList[effectIndex] if board is None else "Chain") if sfxOn
+                                    else "Clean", event.timestamp)
+        graph.apply(sfxOn, effectIndex)
+
+        # While bypassed, the graph doesn't ask the registry for the selected effect, so it and its neighbours are
+        # built here instead, ready for the effect to be turned on
+        if (not sfxOn and board is None):
+            effectList.get(effectIndex)
+
+        # Record how long it took from the button press until the new effect state was applied, and save the state
+        footswitch.eventHandled(event)
+        store.changed()
+finally:
+    store.stop()
@@ -0,0 +1,439 @@
+# Headless control of the pedal over OSC and MIDI, so an effect can be picked directly instead of stomping through
+# the whole list, and effect parameters can be played from a controller. The control server listens for OSC on a
+# UDP port from its own thread, and MIDI messages arrive either from a MIDI input port (through the optional
+# python-rtmidi package) or wrapped in OSC:
+#
+#     /pedal/effect <index or name>        select an effect and turn it on
+#     /pedal/on <0 or 1>                   turn the selected effect on or off
+#     /pedal/preset <name>                 recall a preset
+#     /pedal/param <effect> <param> <val>  set a parameter, such as /pedal/param Flanger depth 1.2
+#     /pedal/midi <midi>                   a MIDI message: program change n selects effect n, and the control
+#                                          changes in CC_MAP move effect parameters
+#
+# Selections are handed to the main loop through the footswitch queue, so they're handled in order with the button
+# presses. Parameter changes go to a ParameterBatcher instead, which keeps only the latest value of every parameter
+# and is drained by the audio server once per buffer, so a burst of control changes from a fast knob costs at most
+# one update per parameter per buffer. The changes are queued without a lock, so the control thread and the audio
+# thread never wait on each other, and every value is clamped to the parameter's declared range as it is applied.
+#
+#     python buttonWithSFX.py --control-port 9000
+#     python controlServer.py send /pedal/effect FreqShift
+#     python controlServer.py check
+import argparse
+import collections
+import math
+import socket
+import struct
+import threading
+import time
+
+from effects import PARAMETER_RANGES
+
+# Kinds of events the control server puts on the footswitch queue
+SELECT = "select"
+BYPASS = "bypass"
+PRESET = "preset"
+
+# MIDI control changes mapped to effect parameters, the 0-127 controller value being spread over the parameter's
+# declared range
+CC_MAP = {
+    1: ("Flanger", "depth"),
+    2: ("Flanger", "lfofreq"),
+    3: ("Tremolo", "freq"),
+    4: ("Delay", "delay"),
+    5: ("Delay", "feedback"),
+    6: ("Chorus", "depth"),
+    7: ("Reverb", "bal"),
+    8: ("Leslie Speaker", "speed"),
+}
+
+# Messages the check sends before waiting for the control server to read them
+CHECK_PACE = 32
+
+# Size asked for the control socket's receive buffer, so a burst from a fast controller isn't dropped
+RECEIVE_BUFFER = 1024 * 1024
+
+# An OSC MIDI argument, four bytes: port id, status byte and two data bytes
+Midi = collections.namedtuple("Midi", "port status data1 data2")
+
+
+# An event from the control server, handled by the main loop like a footswitch press. Like FootswitchEvent, the
+# timestamp is taken when the message arrives so the handling latency can be recorded.
+class ControlEvent(object):
+    def __init__(self, kind, value, timestamp=None):
+        self.pin = None
+        self.kind = kind
+        self.value = value
+        self.timestamp = time.perf_counter() if timestamp is None else timestamp
+
+    def __repr__(self):
+        return "ControlEvent(kind=%s, value=%r)" % (self.kind, self.value)
+
+
+def _readString(data, offset):
+    end = data.index(b"\0", offset)
+    # Strings are null terminated and padded to a multiple of four bytes
+    return data[offset:end].decode("utf-8"), (end + 4) & ~3
+
+
+def parseOsc(data):
+    # Decodes an OSC packet, returning a list of (address, arguments), with the messages of bundles flattened
+    if data.startswith(b"#bundle\0"):
+        messages = []
+        offset = 16
+        while offset < len(data):
+            size = struct.unpack(">i", data[offset:offset + 4])[0]
+            messages.extend(parseOsc(data[offset + 4:offset + 4 + size]))
+            offset += 4 + size
+        return messages
+    address, offset = _readString(data, 0)
+    if offset >= len(data):
+        return [(address, [])]
+    tags, offset = _readString(data, offset)
+    args = []
+    for tag in tags[1:]:
+        if tag == "i":
+            args.append(struct.unpack(">i", data[offset:offset + 4])[0])
+            offset += 4
+        elif tag == "f":
+            args.append(struct.unpack(">f", data[offset:offset + 4])[0])
+            offset += 4
+        elif tag == "d":
+            args.append(struct.unpack(">d", data[offset:offset + 8])[0])
+            offset += 8
+        elif tag == "h":
+            args.append(struct.unpack(">q", data[offset:offset + 8])[0])
+            offset += 8
+        elif tag == "s":
+            value, offset = _readString(data, offset)
+            args.append(value)
+        elif tag == "b":
+            size = struct.unpack(">i", data[offset:offset + 4])[0]
+            args.append(data[offset + 4:offset + 4 + size])
+            offset += 4 + ((size + 3) & ~3)
+        elif tag == "m":
+            args.append(Midi(*struct.unpack(">4B", data[offset:offset + 4])))
+            offset += 4
+        elif tag in "TF":
+            args.append(tag == "T")
+        elif tag in "NI":
+            args.append(None)
+        else:
+            raise ValueError("Unsupported OSC type tag %r" % tag)
+    return [(address, args)]
+
+
+def _padString(value):
+    data = value.encode("utf-8") + b"\0"
+    return data + b"\0" * (-len(data) % 4)
+
+
+def encodeOsc(address, *args):
+    # Encodes an OSC message from ints, floats, strings, booleans and Midi tuples
+    tags = ","
+    payload = b""
+    for arg in args:
+        if isinstance(arg, bool):
+            tags += "T" if arg else "F"
+        elif isinstance(arg, int):
+            tags += "i"
+            payload += struct.pack(">i", arg)
+        elif isinstance(arg, float):
+            tags += "f"
+            payload += struct.pack(">f", arg)
+        elif isinstance(arg, Midi):
+            tags += "m"
+            payload += struct.pack(">4B", *arg)
+        else:
+            tags += "s"
+            payload += _padString(str(arg))
+    return _padString(address) + _padString(tags) + payload
+
+
+def sendOsc(address, *args, host="127.0.0.1", port=9000):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sender.sendto(encodeOsc(address, *args), (host, port))
+
+
+# Collects parameter changes from any thread and applies them to the effect registry once per audio buffer. Only the
+# latest value of every parameter is kept, so a burst of messages turns into one update. The registry is changed
+# under its lock, which the audio thread never waits for: if the main thread holds it while it builds or tears down
+# an effect, the updates are picked up on the next buffer.
+class ParameterBatcher(object):
+    def __init__(self, registry):
+        self._registry = registry
+        # Changes are appended by the control threads and popped by the audio thread. Appending to a deque and
+        # popping from it are atomic, so neither side ever takes a lock or waits on the other.
+        self._queue = collections.deque()
+        self._pattern = None
+        self.received = 0
+        self.applied = 0
+        self.rejected = 0
+        self.drains = 0
+
+    def set(self, index, param, value):
+        self._queue.append((index, param, value))
+        self.received += 1
+
+    def drain(self):
+        # Applies the changes queued since the last drain, returning how many updates that took. Only the latest
+        # value of every parameter is applied. Called by the audio server every buffer.
+        lock = getattr(self._registry, "lock", None)
+        if lock is not None and not lock.acquire(blocking=False):
+            # The main thread is building or tearing down effects, the changes stay queued for the next buffer
+            return 0
+        try:
+            pending = {}
+            # Only the changes already queued are taken, so a fast controller can't keep the audio thread here
+            for i in range(len(self._queue)):
+                index, param, value = self._queue.popleft()
+                pending[(index, param)] = value
+            for (index, param), value in pending.items():
+                try:
+                    self._registry.setParameter(index, param, value)
+                except ValueError:
+                    # An unknown parameter name, which mustn't raise on the audio thread
+                    self.rejected += 1
+        finally:
+            if lock is not None:
+                lock.release()
+        self.applied += len(pending)
+        self.drains += 1
+        return len(pending)
+
+    def start(self, server):
+        from pyo import Pattern
+        self._pattern = Pattern(self.drain, time=float(server.getBufferSize()) / server.getSamplingRate())
+        self._pattern.play()
+        return self
+
+    def stop(self):
+        if self._pattern is not None:
+            self._pattern.stop()
+        return self
+
+
+class ControlServer(object):
+    def __init__(self, events, batcher, names, port=9000, host="127.0.0.1", ccMap=CC_MAP):
+        # events is anything with a post() method taking a ControlEvent, normally the Footswitch
+        self._events = events
+        self._batcher = batcher
+        self._names = list(names)
+        self._ccMap = {}
+        for cc, (name, param) in ccMap.items():
+            if name not in self._names:
+                raise ValueError("CC %d is mapped to unknown effect %s" % (cc, name))
+            if param not in PARAMETER_RANGES.get(name, {}):
+                raise ValueError("CC %d is mapped to %s %s, which has no declared range" % (cc, name, param))
+            low, high = PARAMETER_RANGES[name][param]
+            self._ccMap[cc] = (self._names.index(name), param, low, high)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        self._socket.bind((host, port))
+        # The receive loop wakes up now and then to see whether it has been stopped
+        self._socket.settimeout(0.25)
+        self._thread = None
+        self._running = False
+        self.errors = 0
+
+    @property
+    def port(self):
+        return self._socket.getsockname()[1]
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._receiveLoop, name="control", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        self._socket.close()
+
+    def _receiveLoop(self):
+        while self._running:
+            try:
+                data = self._socket.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            try:
+                for address, args in parseOsc(data):
+                    self.handleOsc(address, args)
+            except (ValueError, IndexError, TypeError, AttributeError, struct.error):
+                # A malformed or unknown message, such as an argument of the wrong type, is dropped rather than
+                # taking down the control thread
+                self.errors += 1
+
+    def _effectIndex(self, value):
+        if isinstance(value, str) and not value.isdigit():
+            return self._names.index(value)
+        index = int(value)
+        if not 0 <= index < len(self._names):
+            raise ValueError("No effect number %d" % index)
+        return index
+
+    def handleOsc(self, address, args):
+        if address == "/pedal/effect":
+            self._events.post(ControlEvent(SELECT, self._effectIndex(args[0])))
+        elif address == "/pedal/on":
+            self._events.post(ControlEvent(BYPASS, bool(args[0])))
+        elif address == "/pedal/preset":
+            self._events.post(ControlEvent(PRESET, str(args[0])))
+        elif address == "/pedal/param":
+            value = float(args[2])
+            if not math.isfinite(value):
+                raise ValueError("%s isn't a parameter value" % value)
+            self._batcher.set(self._effectIndex(args[0]), str(args[1]), value)
+        elif address == "/pedal/midi":
+            for message in args:
+                self.handleMidi(message.status, message.data1, message.data2)
+        else:
+            raise ValueError("Unknown OSC address %s" % address)
+
+    def handleMidi(self, status, data1, data2=0):
+        # Handles a MIDI message on any channel
+        kind = status & 0xF0
+        if kind == 0xC0:
+            if data1 < len(self._names):
+                self._events.post(ControlEvent(SELECT, data1))
+        elif kind == 0xB0 and data1 in self._ccMap:
+            index, param, low, high = self._ccMap[data1]
+            self._batcher.set(index, param, low + (high - low) * data2 / 127.0)
+
+
+# MIDI input from a hardware port through python-rtmidi, which is only imported when this input is created, so the
+# control server runs without it. rtmidi calls back from its own thread with the raw message bytes.
+class RtMidiInput(object):
+    def __init__(self, port, handler):
+        import rtmidi
+        self._midi = rtmidi.MidiIn()
+        ports = self._midi.get_ports()
+        if isinstance(port, str) and not port.isdigit():
+            matches = [i for i, name in enumerate(ports) if port.lower() in name.lower()]
+            if not matches:
+                raise ValueError("No MIDI input matching %r, available ports: %s" % (port, ", ".join(ports)))
+            port = matches[0]
+        self._port = int(port)
+        self._handler = handler
+
+    def _onMessage(self, event, data=None):
+        message, delta = event
+        if len(message) >= 2:
+            self._handler(message[0], message[1], message[2] if len(message) > 2 else 0)
+
+    def start(self):
+        self._midi.open_port(self._port)
+        self._midi.set_callback(self._onMessage)
+        return self
+
+    def stop(self):
+        self._midi.close_port()
+
+
+def check(bursts=500):
+    # Runs the control server on a loopback port against an offline server and checks that program changes select
+    # effects, that a burst of control changes turns into a single parameter update, and that malformed messages are
+    # dropped without stopping the server
+    from pyo import Noise, Server
+    from effectRegistry import EffectRegistry
+    from footswitch import Footswitch, SimulatedGPIOBackend
+    server = Server(audio="offline")
+    server.setVerbosity(0)
+    server.boot()
+    registry = EffectRegistry(Noise(mul=.2), lazy=False)
+    footswitch = Footswitch(SimulatedGPIOBackend(), [])
+    batcher = ParameterBatcher(registry)
+    control = ControlServer(footswitch, batcher, registry.names, port=0).start()
+    failures = []
+
+    sendOsc("/pedal/midi", Midi(0, 0xC0, 10, 0), port=control.port)
+    event = footswitch.waitForEvent(timeout=2.0)
+    if event is None or event.kind != SELECT or event.value != 10:
+        failures.append("program change 10 didn't select %s, got %r" % (registry.names[10], event))
+
+    def waitFor(count):
+        # Waits until count messages have been handled, either passed to the batcher or counted as malformed
+        deadline = time.perf_counter() + 2.0
+        while batcher.received + control.errors < count and time.perf_counter() < deadline:
+            time.sleep(0.001)
+
+    # The burst is sent in paces, each waiting for the one before it to be read, so no packet is dropped by a full
+    # socket buffer and the check comes out the same on every run
+    start = time.perf_counter()
+    for i in range(bursts):
+        sendOsc("/pedal/midi", Midi(0, 0xB0, 1, i % 128), port=control.port)
+        if i % CHECK_PACE == CHECK_PACE - 1:
+            waitFor(i + 1)
+    sendOsc("/pedal/param", "Tremolo", "freq", 3.0, port=control.port)
+    sendOsc("/pedal/param", "Delay", "feedback", 5.0, port=control.port)
+    waitFor(bursts + 2)
+    elapsed = time.perf_counter() - start
+    if batcher.received != bursts + 2:
+        failures.append("only %d of %d messages reached the batcher" % (batcher.received, bursts + 2))
+
+    # Arguments of the wrong type and values that aren't numbers are counted as malformed, and the control thread
+    # keeps going
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sender.sendto(encodeOsc("/pedal/midi", "not midi"), ("127.0.0.1", control.port))
+        sender.sendto(_padString("/pedal/param") + _padString(",ssN") + _padString("Tremolo") + _padString("freq"),
+                      ("127.0.0.1", control.port))
+        sender.sendto(encodeOsc("/pedal/param", "Tremolo", "freq", float("nan")), ("127.0.0.1", control.port))
+    waitFor(bursts + 5)
+    if control.errors != 3:
+        failures.append("%d of the 3 malformed messages were counted as malformed" % control.errors)
+    sendOsc("/pedal/midi", Midi(0, 0xC0, 3, 0), port=control.port)
+    event = footswitch.waitForEvent(timeout=2.0)
+    if event is None or event.value != 3:
+        failures.append("the control server stopped handling messages after the malformed ones")
+
+    updates = batcher.drain()
+    if updates != 3:
+        failures.append("%d messages turned into %d updates instead of 3" % (batcher.received, updates))
+    flanger = registry[registry.indexOf("Flanger")].parameterValues()["depth"]
+    if abs(flanger - 2.0 * ((bursts - 1) % 128) / 127.0) > 1e-6:
+        failures.append("Flanger depth is %.3f, not the last value sent" % flanger)
+    if registry[registry.indexOf("Tremolo")].parameterValues()["freq"] != 3.0:
+        failures.append("Tremolo freq wasn't set")
+    feedback = registry[registry.indexOf("Delay")].parameterValues()["feedback"]
+    if feedback != PARAMETER_RANGES["Delay"]["feedback"][1]:
+        failures.append("Delay feedback was set to %g instead of being clamped to its range" % feedback)
+    control.stop()
+    server.shutdown()
+    return {"messages": batcher.received, "updates": updates, "seconds": elapsed, "errors": control.errors,
+            "failures": failures}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Control the pedal over OSC")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sendCommand = commands.add_parser("send", help="send an OSC message to the pedal")
+    sendCommand.add_argument("address")
+    sendCommand.add_argument("args", nargs="*")
+    sendCommand.add_argument("--host", default="127.0.0.1")
+    sendCommand.add_argument("--port", type=int, default=9000)
+    commands.add_parser("check", help="check the control server over a loopback port")
+    args = parser.parse_args()
+
+    if args.command == "send":
+        values = []
+        for arg in args.args:
+            try:
+                values.append(int(arg))
+            except ValueError:
+                try:
+                    values.append(float(arg))
+                except ValueError:
+                    values.append(arg)
+        sendOsc(args.address, *values, host=args.host, port=args.port)
+    else:
+        result = check()
+        print("%d control messages in %.1f ms turned into %d parameter updates, %d malformed" % (
+            result["messages"], result["seconds"] * 1000, result["updates"], result["errors"]))
+        for failure in result["failures"]:
+            print("FAIL: %s" % failure)
+        if result["failures"]:
+            raise SystemExit(1)
@@ -0,0 +1,116 @@
+# Per-effect CPU accounting for the pedal, rendered with pyo's offline server so it runs on any Linux machine.
+#
+# Every effect is built (like the --eager mode of the pedal) and rendered once with only that effect active,
+# and once with all of them bypassed. A bypassed effect has to cost nothing per block, so the "all bypassed"
+# render must cost the same as rendering the bare input signal, and every stopped effect chain is also checked
+# object by object, including its modulators and sub-effects, to make sure nothing inside it is still running.
+#
+#     python cpuReport.py [--dur 10] [--buffersize 256] [--sr 44100]
+import argparse
+import os
+import tempfile
+import time
+
+from pyo import Server, Noise, Sig
+
+from effectRegistry import EffectRegistry
+from effects import EFFECTS, isComputing
+from signalGraph import SignalGraph
+
+
+def findRunningObjects(chain, exclude=()):
+    # Returns the pyo objects inside an effect chain that are still computing audio
+    return [obj for obj in chain.objects(exclude) if isComputing(obj)]
+
+
+def _render(server, dur):
+    # Renders dur seconds on an offline server into a scratch file and returns the CPU time it took
+    handle, filename = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    try:
+        server.recordOptions(dur=dur, filename=filename)
+        start = time.process_time()
+        server.start()
+        return time.process_time() - start
+    finally:
+        os.remove(filename)
+
+
+def measureScenario(server, dur, repeats, build):
+    # Boots a fresh offline server for every render, so the objects of one render can't leak into the next, and
+    # keeps the fastest of the repeated renders since timing noise only ever adds time
+    times = []
+    for i in range(repeats):
+        server.boot()
+        keep = build()
+        times.append(_render(server, dur))
+        del keep
+        server.shutdown()
+    return min(times)
+
+
+def measure(dur=10.0, buffersize=256, sr=44100, repeats=3, makeSource=None):
+    # Returns the per-effect CPU report. The clean signal is a separate tap on the source, like the two Input
+    # objects of the pedal, so the source keeps feeding the effects while the clean signal is stopped.
+    if makeSource is None:
+        makeSource = lambda: Noise(mul=.2)
+    server = Server(sr=sr, buffersize=buffersize, audio="offline")
+    report = {"dur": dur, "buffersize": buffersize, "sr": sr, "effects": {}, "leaks": {}}
+
+    def buildInput():
+        return Sig(makeSource()).out()
+
+    def buildPedal(index=None):
+        source = makeSource()
+        registry = EffectRegistry(source, lazy=False)
+        graph = SignalGraph(Sig(source), registry)
+        graph.apply(index is not None, index)
+        if index is None:
+            for i, name in enumerate(registry.names):
+                running = findRunningObjects(registry[i], exclude=[source])
+                if running:
+                    report["leaks"][name] = [type(obj).__name__ for obj in running]
+        return source, registry, graph
+
+    # The first render of a process pays for warming up caches and the audio file writer, so it's thrown away
+    measureScenario(server, dur, 1, buildInput)
+    report["input"] = measureScenario(server, dur, repeats, buildInput)
+    # All effects built and bypassed, with only the clean signal playing
+    report["bypassed"] = measureScenario(server, dur, repeats, buildPedal)
+    for index, (name, factory) in enumerate(EFFECTS):
+        report["effects"][name] = measureScenario(server, dur, repeats, lambda: buildPedal(index))
+    return report
+
+
+def formatCpuReport(report):
+    lines = []
+    blocks = report["dur"] * report["sr"] / report["buffersize"]
+    lines.append("Rendered %.1f s at %d Hz, %d samples per buffer" % (report["dur"], report["sr"], report["buffersize"]))
+    lines.append("%-18s %10s %14s" % ("Effect", "CPU (s)", "us per buffer"))
+    lines.append("%-18s %10.3f %14.1f" % ("(input only)", report["input"], report["input"] / blocks * 1e6))
+    lines.append("%-18s %10.3f %14.1f" % ("(all bypassed)", report["bypassed"], report["bypassed"] / blocks * 1e6))
+    for name, cpu in report["effects"].items():
+        # The cost of the effect itself, on top of the bare input signal
+        own = max(cpu - report["input"], 0.0)
+        lines.append("%-18s %10.3f %14.1f" % (name, own, own / blocks * 1e6))
+    overhead = report["bypassed"] - report["input"]
+    lines.append("Bypass overhead of all effects: %.1f us per buffer" % (max(overhead, 0.0) / blocks * 1e6))
+    if report["leaks"]:
+        for name, objects in report["leaks"].items():
+            lines.append("LEAK: bypassed %s still computes %s" % (name, ", ".join(objects)))
+    else:
+        lines.append("No bypassed effect computes any audio")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-effect CPU accounting on the offline server")
+    parser.add_argument("--dur", type=float, default=10.0, help="seconds of audio to render per effect")
+    parser.add_argument("--buffersize", type=int, default=256)
+    parser.add_argument("--sr", type=int, default=44100)
+    parser.add_argument("--repeats", type=int, default=3, help="renders per measurement, the fastest one counts")
+    args = parser.parse_args()
+    report = measure(args.dur, args.buffersize, args.sr, args.repeats)
+    print(formatCpuReport(report))
+    if report["leaks"]:
+        raise SystemExit(1)
@@ -0,0 +1,426 @@
+# On-disk cache for the parts of the effects that never change while the pedal plays, so they are computed once
+# instead of on every start or on every audio buffer. Two kinds of item are cached:
+#
+# - The Flanger's sweep. pyo's LFO works out its modulated sine with a cosine and a sine on every sample; baked into
+#   a table, the same waveform is a single table read. The table holds whole turns of both the sine and its
+#   modulator, and the rate only sets how fast it is read, so one table serves the Flanger at every preset rate.
+#   Only the Flanger is baked: the modulators of the Vibrato, the Tremolo and the Leslie are plain Sines, which
+#   already read pyo's sine table once per sample, so baking them would save nothing.
+# - Impulse responses for a convolution reverb that can stand in for STRev. Every combination of reverb time and
+#   room size used by a preset gets a synthetic stereo room, stored already cut into the partitions and spectra the
+#   convolution works on, so nothing has to be transformed when it is loaded. The convolution is there for its
+#   sound, not to save CPU: it takes about 15 times as long as STRev, 0.54 s against 0.035 s for 5 s of audio.
+#
+# Every item is a .npy file named after a hash of the parameters that shape it, and is opened through mmap, which
+# leaves it to the kernel to page it in and costs next to nothing at startup. The cache directory is kept under a
+# size cap by deleting the least recently used items first; every hit touches the file's modification time, which
+# is what marks it as used.
+#
+#     python buttonWithSFX.py --baked-lfos --convolution-reverb
+#
+# Run on its own, this times a cold and a warm load of every preset's impulse response, checks the eviction order
+# under a small cap, and compares the baked Flanger and the convolution reverb against their pyo counterparts:
+#
+#     python effectCache.py
+import argparse
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy
+
+from effects import EFFECTS, PARAMETER_RANGES, RAMP_TIME, makeFlanger
+from numpyEffects import Kernel
+
+# Where the cache lives and how large it may grow
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cheesywaves")
+CACHE_SIZE = 64 * 1024 * 1024
+
+# Turns of the sine and of its modulator held by the Flanger's sweep table. pyo's modulator runs at 0.99 times the
+# sharpness times the rate of the sine, 297 turns to every 1000 for the Flanger's sharpness of 0.3.
+SWEEP_CYCLES = 1000
+SWEEP_POINTS = 128
+
+# Reverb times the convolution reverb accepts, the Reverb's declared range, and the most room the history of its
+# input is kept for
+MIN_REVTIME, MAX_REVTIME = PARAMETER_RANGES["Reverb"]["revtime"]
+
+# Bands of the synthetic rooms, with how long each rings for relative to the reverb time, so the highs die away
+# first like in STRev
+BANDS = [(0.0, 500.0, 1.0), (500.0, 4000.0, 0.75), (4000.0, None, 0.4)]
+EARLY_REFLECTIONS = 12
+
+# Level of the convolution reverb's wet signal, matched to STRev's on noise
+WET_GAIN = 0.45
+
+# Bumped whenever the way an item is built changes, so stale items are never loaded
+VERSION = 1
+
+
+class EffectCache(object):
+    def __init__(self, directory=CACHE_DIR, maxBytes=CACHE_SIZE):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, kind, params):
+        key = json.dumps(dict(params, version=VERSION), sort_keys=True)
+        return os.path.join(self.directory, "%s-%s.npy" % (kind, hashlib.sha1(key.encode()).hexdigest()[:16]))
+
+    def lookup(self, kind, params):
+        # The cached item for these parameters mapped into memory, or None if it isn't cached
+        path = self.path(kind, params)
+        try:
+            array = numpy.load(path, mmap_mode="r")
+            os.utime(path, None)
+        except (OSError, ValueError):
+            return None
+        self.hits += 1
+        return array
+
+    def get(self, kind, params, build):
+        # The cached item for these parameters, built by build() and stored first if it isn't cached
+        array = self.lookup(kind, params)
+        if array is None:
+            self.misses += 1
+            self.store(kind, params, build())
+            array = numpy.load(self.path(kind, params), mmap_mode="r")
+        return array
+
+    def store(self, kind, params, array):
+        # Written under a temporary name and renamed into place, so a half written item is never loaded
+        path = self.path(kind, params)
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as output:
+            numpy.save(output, numpy.ascontiguousarray(array))
+        os.replace(temporary, path)
+        self.evict(keep=path)
+
+    def entries(self):
+        # (last used, size, path) of every cached item, least recently used first
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy"):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self, keep=None):
+        # Deletes the least recently used items until the cache fits under its cap. Anything still mapped keeps
+        # working, the file only goes once it is unmapped.
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for mtime, size, path in entries)
+            for mtime, size, path in entries:
+                if total <= self.maxBytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+
+
+def modulatedSine(sharp=0.3, cycles=SWEEP_CYCLES, points=SWEEP_POINTS):
+    # pyo's LFO type 7, a sine whose level is swept by a slower cosine, over whole turns of both
+    ratio = sharp * 0.99
+    if abs(cycles * ratio - round(cycles * ratio)) > 1e-6:
+        raise ValueError("the modulator doesn't make whole turns over %d turns of the sine" % cycles)
+    turns = numpy.arange(cycles * points) / float(points)
+    level = sharp * 0.5 * numpy.cos(2 * numpy.pi * turns * ratio) + sharp * 0.5 + (1.0 - sharp)
+    return (level * numpy.sin(2 * numpy.pi * turns)).astype(numpy.float32)
+
+
+# A baked LFO waveform loaded into a pyo table, holding cycles turns of the LFO
+class BakedLfo(object):
+    def __init__(self, samples, cycles):
+        from pyo import DataTable
+        self.table = DataTable(len(samples))
+        numpy.asarray(self.table.getBuffer())[:] = samples
+        self.cycles = cycles
+
+
+def flangerSweep(cache, sharp=0.3):
+    params = {"shape": "modulated sine", "sharp": sharp, "cycles": SWEEP_CYCLES, "points": SWEEP_POINTS}
+    return BakedLfo(cache.get("lfo", params, lambda: modulatedSine(sharp)), SWEEP_CYCLES)
+
+
+def bakedFactories(cache, factories=EFFECTS):
+    # The pedal's factories with the Flanger reading its sweep from the cache. Needs a booted server.
+    sweep = flangerSweep(cache)
+    return [(name, (lambda input, clock=None: makeFlanger(input, clock, sweep)) if factory is makeFlanger else factory)
+            for name, factory in factories]
+
+
+def impulseResponse(revtime, roomSize, sr=44100, seed=1):
+    # A synthetic stereo room: a dozen early reflections spread over a time set by the room size, then a diffuse
+    # tail of noise that builds up and dies away 60 dB over the reverb time, the highs sooner than the lows
+    rng = numpy.random.RandomState(seed)
+    predelay = 0.005 * roomSize
+    length = int((predelay + revtime) * sr)
+    t = numpy.arange(length) / float(sr)
+    freqs = numpy.fft.rfftfreq(length, 1.0 / sr)
+    onset = numpy.clip((t - predelay) / (0.02 * roomSize), 0.0, 1.0)
+    ir = numpy.zeros((2, length))
+    for channel in range(2):
+        spectrum = numpy.fft.rfft(rng.standard_normal(length))
+        for low, high, share in BANDS:
+            band = (freqs >= low) & (freqs < (high if high is not None else sr))
+            ir[channel] += numpy.fft.irfft(numpy.where(band, spectrum, 0), length) * 10 ** (-3 * t / (revtime * share))
+        ir[channel] *= onset
+        for when in rng.uniform(predelay, predelay + 0.03 * roomSize, EARLY_REFLECTIONS):
+            ir[channel, int(when * sr)] += rng.choice([-3.0, 3.0]) * 10 ** (-3 * when / revtime)
+        ir[channel] /= numpy.sqrt(numpy.sum(ir[channel] ** 2))
+    return ir * WET_GAIN
+
+
+def partitionSpectra(ir, blocksize):
+    # Cuts an impulse response into partitions of blocksize samples and transforms them for overlap-save
+    partitions = -(-ir.shape[-1] // blocksize)
+    padded = numpy.zeros(ir.shape[:-1] + (partitions * blocksize,))
+    padded[..., :ir.shape[-1]] = ir
+    parts = padded.reshape(ir.shape[:-1] + (partitions, blocksize))
+    return numpy.fft.rfft(parts, 2 * blocksize).astype(numpy.complex64)
+
+
+def reverbSpectra(cache, revtime, roomSize, sr=44100, blocksize=256, seed=1, build=True):
+    # The partitioned spectra of a room from the cache, built if build is set and it isn't cached yet
+    revtime = max(MIN_REVTIME, min(MAX_REVTIME, float(revtime)))
+    params = {"revtime": revtime, "roomSize": float(roomSize), "sr": sr, "blocksize": blocksize, "seed": seed}
+    if not build:
+        return cache.lookup("ir", params)
+    return cache.get("ir", params, lambda: partitionSpectra(impulseResponse(revtime, roomSize, sr, seed), blocksize))
+
+
+def prewarmReverbs(cache, presets, sr=44100, blocksize=256):
+    # Makes sure the room of every preset is cached, returning how many were there
+    rooms = set()
+    for name in presets.names:
+        values = dict(presets.values(name).get("Reverb", ()))
+        rooms.add((values.get("revtime", 1.8), values.get("roomSize", 1.2)))
+    for revtime, roomSize in sorted(rooms):
+        reverbSpectra(cache, revtime, roomSize, sr, blocksize)
+    return len(rooms)
+
+
+# A stereo convolution reverb with the parameters of the pedal's Reverb. The input's spectra are kept for as long as
+# the longest room rings, and every buffer sums their products with the room's partitions. A change of reverb time
+# or room size loads the new room from the cache, or builds it on a thread of its own if it isn't cached, and the
+# output crossfades from the old room to the new one over a buffer.
+class ConvolutionReverbKernel(Kernel):
+    channels = 2
+
+    def __init__(self, cache, revtime=1.8, roomSize=1.2, bal=0.5, blocksize=256, sr=44100):
+        Kernel.__init__(self, "Reverb", blocksize, sr, [("bal", bal)])
+        self._cache = cache
+        self._settings = {"revtime": float(revtime), "roomSize": float(roomSize)}
+        self._spectra = reverbSpectra(cache, revtime, roomSize, sr, blocksize)
+        self._pending = None
+        slots = int(math.ceil((MAX_REVTIME + 0.005 * 4) * sr / blocksize)) + 1
+        self._history = numpy.zeros((slots, blocksize + 1), dtype=numpy.complex64)
+        self._write = 0
+        self._frame = numpy.zeros(2 * blocksize)
+        self._fadeIn = numpy.linspace(0.0, 1.0, blocksize, endpoint=False)
+        self._out = numpy.zeros((2, blocksize))
+
+    @property
+    def parameters(self):
+        return ["revtime", "roomSize"] + Kernel.parameters.fget(self)
+
+    def parameterValues(self):
+        values = dict(self._settings)
+        values.update(Kernel.parameterValues(self))
+        return values
+
+    def setParameter(self, name, value, time=RAMP_TIME):
+        if name not in self._settings:
+            return Kernel.setParameter(self, name, value, time)
+        if value == self._settings[name]:
+            return False
+        self._settings[name] = float(value)
+        settings = dict(self._settings)
+        spectra = reverbSpectra(self._cache, settings["revtime"], settings["roomSize"], self.sr, self.blocksize,
+                                build=False)
+        if spectra is not None:
+            self._pending = spectra
+        else:
+            threading.Thread(target=self._build, args=(settings,), daemon=True).start()
+        return True
+
+    def _build(self, settings):
+        spectra = reverbSpectra(self._cache, settings["revtime"], settings["roomSize"], self.sr, self.blocksize)
+        # Only swapped in if nothing else was asked for while it was built
+        if settings == self._settings:
+            self._pending = spectra
+
+    def _convolve(self, spectra):
+        partitions = spectra.shape[1]
+        first = min(partitions, len(self._history) - self._write)
+        acc = numpy.einsum("cpk,pk->ck", spectra[:, :first], self._history[self._write:self._write + first])
+        if partitions > first:
+            acc += numpy.einsum("cpk,pk->ck", spectra[:, first:], self._history[:partitions - first])
+        return numpy.fft.irfft(acc, 2 * self.blocksize)[:, self.blocksize:]
+
+    def process(self, block):
+        n = self.blocksize
+        self._frame[:n] = self._frame[n:]
+        self._frame[n:] = block
+        # The newest spectrum goes in front of the older ones, so partition p meets the input from p buffers ago
+        self._write = (self._write - 1) % len(self._history)
+        self._history[self._write] = numpy.fft.rfft(self._frame)
+        wet = self._convolve(self._spectra)
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            wet += (self._convolve(pending) - wet) * self._fadeIn
+            self._spectra = pending
+        bal = self._ramps["bal"].fill(n)
+        numpy.multiply(wet, bal, out=self._out)
+        self._out += block * (1.0 - bal)
+        return self._out
+
+
+def checkEviction(directory):
+    # Fills a cache with a small cap and checks that the least recently used items go first. Returns the failures.
+    cache = EffectCache(directory, maxBytes=3.5 * 1024 * 1024)
+    failures = []
+    for i in range(4):
+        cache.store("test", {"i": i}, numpy.zeros(256 * 1024, dtype=numpy.float32))
+        time.sleep(0.01)
+        if i == 2:
+            # Using the first item again makes the second one the least recently used
+            cache.lookup("test", {"i": 0})
+            time.sleep(0.01)
+    kept = [i for i in range(4) if os.path.exists(cache.path("test", {"i": i}))]
+    if cache.size() > cache.maxBytes:
+        failures.append("the cache is %d bytes, over its cap of %d" % (cache.size(), cache.maxBytes))
+    if kept != [0, 2, 3]:
+        failures.append("kept items %s instead of [0, 2, 3]" % kept)
+    return failures
+
+
+def compareFlanger(cache, dur=5.0, sr=44100, buffersize=256):
+    # Renders the Flanger's live LFO and its baked sweep at the Flanger's rate, returning the largest difference of
+    # each from the waveform worked out in double precision, and the CPU seconds of the Flanger with each on top of
+    # its input. The float build of pyo keeps the LFO's phase in single precision, so the live LFO drifts from it
+    # over the seconds where the baked sweep only carries the table's interpolation error.
+    from pyo import LFO, NewTable, Noise, Osc, Server, TableRec
+    from cpuReport import measureScenario
+    server = Server(sr=sr, buffersize=buffersize, audio="offline", nchnls=1)
+    server.setVerbosity(0)
+    server.boot()
+    handle, filename = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    server.recordOptions(dur=dur, filename=filename)
+    sweep = flangerSweep(cache)
+    lfos = [LFO(freq=.545 * 2, sharp=0.3, type=7), Osc(sweep.table, freq=.545 * 2 / sweep.cycles)]
+    tables = [NewTable(dur) for lfo in lfos]
+    recorders = [TableRec(lfo, table).play() for lfo, table in zip(lfos, tables)]
+    try:
+        server.start()
+    finally:
+        os.remove(filename)
+    live, baked = [numpy.asarray(table.getTable()) for table in tables]
+    # The LFO moves its modulator on before reading it
+    turns = numpy.arange(len(live)) * .545 * 2 / sr
+    level = 0.15 * numpy.cos(2 * numpy.pi * (turns + .545 * 2 / sr) * 0.3 * 0.99) + 0.15 + 0.7
+    exact = level * numpy.sin(2 * numpy.pi * turns)
+    del recorders, lfos
+    server.shutdown()
+    server = Server(sr=sr, buffersize=buffersize, audio="offline")
+    server.setVerbosity(0)
+    bare = measureScenario(server, dur, 3, lambda: Noise(mul=.3).out())
+    liveCpu = measureScenario(server, dur, 3, lambda: makeFlanger(Noise(mul=.3)).out()) - bare
+    bakedCpu = measureScenario(server, dur, 3, lambda: makeFlanger(Noise(mul=.3), sweep=flangerSweep(cache)).out()) - bare
+    return numpy.max(numpy.abs(live - exact)), numpy.max(numpy.abs(baked - exact)), liveCpu, bakedCpu
+
+
+def compareReverb(cache, dur=5.0, sr=44100, buffersize=256):
+    # CPU seconds of STRev and of the convolution reverb, and the level of each, fully wet, on the same noise
+    from pyo import NewTable, Noise, Server, STRev, TableRec
+    from cpuReport import measureScenario
+    server = Server(sr=sr, buffersize=buffersize, audio="offline")
+    server.setVerbosity(0)
+    bare = measureScenario(server, dur, 3, lambda: Noise(mul=.3).out())
+    strev = measureScenario(server, dur, 3, lambda: STRev(Noise(mul=.3), revtime=1.8, roomSize=1.2, bal=1).out()) - bare
+    server.boot()
+    handle, filename = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    server.recordOptions(dur=dur, filename=filename)
+    reverb = STRev(Noise(mul=.3), revtime=1.8, roomSize=1.2, bal=1)
+    table = NewTable(dur, chnls=2)
+    recorder = TableRec(reverb, table).play()
+    try:
+        server.start()
+    finally:
+        os.remove(filename)
+    strevLevel = numpy.sqrt(numpy.mean(numpy.asarray(table.getTable(all=True))[:, sr:] ** 2))
+    del recorder, reverb
+    server.shutdown()
+    noise = numpy.random.RandomState(1).uniform(-.3, .3, int(dur * sr))
+    kernel = ConvolutionReverbKernel(cache, bal=1.0, blocksize=buffersize, sr=sr)
+    out = numpy.empty((2, len(noise) // buffersize * buffersize))
+    start = time.process_time()
+    for i in range(0, out.shape[1], buffersize):
+        out[:, i:i + buffersize] = kernel.process(noise[i:i + buffersize])
+    convolution = time.process_time() - start
+    return strev, convolution, strevLevel, numpy.sqrt(numpy.mean(out[:, sr:] ** 2))
+
+
+def main():
+    from presets import PresetBank
+    parser = argparse.ArgumentParser(description="Check the effect cache and what it saves")
+    parser.add_argument("--presets", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "presets.json"))
+    parser.add_argument("--dur", type=float, default=5.0)
+    parser.add_argument("--buffersize", type=int, default=256)
+    parser.add_argument("--sr", type=int, default=44100)
+    args = parser.parse_args()
+    presets = PresetBank.load(args.presets)
+    directory = tempfile.mkdtemp()
+    failures = []
+    try:
+        cache = EffectCache(os.path.join(directory, "cache"))
+        for label in ("cold", "warm"):
+            start = time.perf_counter()
+            rooms = prewarmReverbs(cache, presets, args.sr, args.buffersize)
+            print("Loading the %d preset rooms %s: %.1f ms, %s in the cache" % (
+                rooms, label, (time.perf_counter() - start) * 1000, "%.1f MB" % (cache.size() / 1048576.0)))
+        failures += checkEviction(os.path.join(directory, "eviction"))
+        liveError, bakedError, live, baked = compareFlanger(cache, args.dur, args.sr, args.buffersize)
+        print("Flanger: %.3f s CPU with the live LFO, %.3f s with the baked sweep, %.1e and %.1e from the exact "
+              "waveform" % (live, baked, liveError, bakedError))
+        if bakedError > 5e-4:
+            failures.append("the baked sweep is %.1e from the exact waveform" % bakedError)
+        strev, convolution, strevLevel, level = compareReverb(cache, args.dur, args.sr, args.buffersize)
+        print("Reverb: STRev %.3f s CPU, convolution %.3f s CPU for %.0f s of audio, wet level %.3f against %.3f" % (
+            strev, convolution, args.dur, level, strevLevel))
+    finally:
+        shutil.rmtree(directory)
+    for failure in failures:
+        print(failure)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
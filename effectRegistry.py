@@ -0,0 +1,255 @@
+# Registry of the pedal's effects, built on demand from the factories in effects.py. Instead of building all
+# eleven effect chains at startup and stopping most of them straight away, the registry only builds an effect
+# when it is selected, along with its neighbours in the footswitch cycle order so the next stomp doesn't have
+# to wait for a build. Effects that haven't been used for a while are torn down again, and the number of
+# effects kept alive is capped, dropping the least recently used one first.
+#
+# The registry behaves like the old effectList, so registry[effectIndex] returns the EffectChain at that
+# position, building it first if needed. Passing lazy=False builds everything up front like before. When given a
+# preset bank, every effect is set to the current preset as it is built. Parameters changed live through
+# setParameter() are remembered on top of the preset, so an effect that gets torn down and built again keeps them
+# until the next preset is recalled. When given a tempo clock, every effect is built locked to it. When given an
+# onChange callback, it is called after every parameter change and preset recall, so the state can be saved.
+#
+# The signal graph pins the effects it is playing, the one sounding and the one fading out, so they are never torn
+# down under it, and a pinned effect counts as used for as long as it is pinned, however long it plays.
+#
+# Parameter changes arrive on the audio thread while the main thread builds and tears down effects, so every
+# method that touches the built effects holds the registry's lock. The audio thread only ever tries for it without
+# waiting, see ParameterBatcher in controlServer.py. Pins and unpins, which the signal graph sends from the audio
+# thread at the end of a fade, are queued in order and applied by whichever thread next gets the lock, at the
+# latest by the main thread before it tears anything down.
+import collections
+import threading
+import time
+
+from effects import EFFECTS
+from measurements import residentMemory, formatBytes
+
+
+class EffectRegistry(object):
+    def __init__(self, input, factories=EFFECTS, lazy=True, neighbours=1, maxLive=4, idleTimeout=300.0, presets=None,
+                 clock=None, onChange=None):
+        self._input = input
+        self._onChange = onChange
+        self._clock = clock
+        self._presets = presets
+        self._factories = list(factories)
+        self._lazy = lazy
+        self._neighbours = neighbours
+        # At least the selected effect and its neighbours have to fit
+        self._maxLive = max(maxLive, 1 + 2 * neighbours)
+        self._idleTimeout = idleTimeout
+
+        # Built effects by index, least recently used first
+        self._live = collections.OrderedDict()
+        self._lastUsed = {}
+        # Indexes of the effects the signal graph is playing, which are never torn down
+        self._pinned = set()
+        # (pin or unpin, index, time) waiting for the lock
+        self._pinRequests = collections.deque()
+        # Live parameter changes by effect index, {parameter: value}
+        self._overrides = {}
+        self.builds = 0
+        self.teardowns = 0
+        # Reentrant, as get() builds and tears down effects while holding it
+        self.lock = threading.RLock()
+
+        # The startup figures cover building every effect in eager mode, and the first effect and its neighbours,
+        # built by start(), in lazy mode
+        startMemory = residentMemory()
+        startTime = time.perf_counter()
+        if not lazy:
+            for index in range(len(self._factories)):
+                self._build(index)
+        self.startupTime = time.perf_counter() - startTime
+        self.startupMemory = residentMemory() - startMemory
+
+    def __len__(self):
+        return len(self._factories)
+
+    def __getitem__(self, index):
+        return self.get(index)
+
+    @property
+    def names(self):
+        return [name for name, factory in self._factories]
+
+    def isBuilt(self, index):
+        with self.lock:
+            return index in self._live
+
+    def built(self):
+        # The effect chains that are currently alive
+        with self.lock:
+            return list(self._live.values())
+
+    def indexOf(self, name):
+        return self.names.index(name)
+
+    def start(self, index):
+        # Builds the effect the pedal starts on, with its neighbours when lazy, counting it into the startup figures
+        startMemory = residentMemory()
+        startTime = time.perf_counter()
+        chain = self.get(index)
+        self.startupTime += time.perf_counter() - startTime
+        self.startupMemory += residentMemory() - startMemory
+        return chain
+
+    def pin(self, index):
+        # Keeps the effect at the given index alive while the signal graph plays it
+        self._pinRequests.append((True, index, time.monotonic()))
+        self._tryApplyPins()
+
+    def unpin(self, index):
+        # Lets the effect be torn down again once it has gone quiet, counting it as used until now
+        self._pinRequests.append((False, index, time.monotonic()))
+        self._tryApplyPins()
+
+    def _tryApplyPins(self):
+        # Never waits: when the main thread holds the lock, it applies the queued pins itself
+        if self.lock.acquire(blocking=False):
+            try:
+                self._applyPins()
+            finally:
+                self.lock.release()
+
+    def _applyPins(self):
+        # Called with the lock held. Appending to and popping from a deque are atomic, so no pin is lost.
+        while self._pinRequests:
+            pin, index, when = self._pinRequests.popleft()
+            if pin:
+                self._pinned.add(index)
+                self._lastUsed[index] = when
+            else:
+                self._pinned.discard(index)
+                if index in self._lastUsed:
+                    self._lastUsed[index] = when
+
+    def recallPreset(self, name):
+        # Switches the preset bank to the named preset and applies it to every built effect, dropping the live changes
+        with self.lock:
+            self._overrides = {}
+            changed = self._presets.recall(name, list(self._live.values()))
+        if self._onChange is not None:
+            self._onChange()
+        return changed
+
+    def setParameter(self, index, param, value):
+        # Changes a parameter of the effect at the given index, returning True if a built effect was changed.
+        # Effects that aren't built pick the value up when they are.
+        with self.lock:
+            chain = self._live.get(index)
+            changed = chain.setParameter(param, value) if chain is not None else False
+            self._overrides.setdefault(index, {})[param] = value
+        if self._onChange is not None:
+            self._onChange()
+        return changed
+
+    def overrides(self):
+        # The live parameter changes by effect name, {name: {parameter: value}}
+        with self.lock:
+            return dict((self._factories[index][0], dict(values)) for index, values in self._overrides.items())
+
+    def get(self, index):
+        # Returns the effect at the given index, building it if it isn't alive, and makes sure its neighbours
+        # are ready for the next stomp
+        with self.lock:
+            now = time.monotonic()
+            chain = self._live.get(index)
+            if chain is None:
+                chain = self._build(index)
+            self._live.move_to_end(index)
+            self._lastUsed[index] = now
+
+            if self._lazy:
+                protected = set([index])
+                for offset in range(1, self._neighbours + 1):
+                    for neighbour in ((index + offset) % len(self), (index - offset) % len(self)):
+                        protected.add(neighbour)
+                        if neighbour not in self._live:
+                            self._build(neighbour)
+                            # Prebuilt neighbours count as used now, but not more recently than the selected effect
+                            self._live.move_to_end(neighbour, last=False)
+                            self._lastUsed[neighbour] = now
+                self._evict(protected, now)
+            return chain
+
+    def _build(self, index):
+        name, factory = self._factories[index]
+        chain = factory(self._input) if self._clock is None else factory(self._input, clock=self._clock)
+        # pyo objects start playing as soon as they're created, so new effects are stopped until selected
+        chain.stop()
+        if self._presets is not None:
+            self._presets.applyTo(chain)
+        for param, value in self._overrides.get(index, {}).items():
+            chain.setParameter(param, value)
+        self._live[index] = chain
+        self._lastUsed[index] = time.monotonic()
+        self.builds += 1
+        return chain
+
+    def _teardown(self, index):
+        chain = self._live.pop(index)
+        del self._lastUsed[index]
+        chain.stop()
+        self.teardowns += 1
+
+    def _evict(self, protected, now):
+        # First tear down effects that have been idle for too long, then the least recently used ones until
+        # the live count fits under the cap again. The pinned effects are playing, so they count as used now.
+        self._applyPins()
+        for index in self._pinned:
+            if index in self._live:
+                self._lastUsed[index] = now
+        protected = protected | self._pinned
+        for index in list(self._live):
+            if index not in protected and now - self._lastUsed[index] > self._idleTimeout:
+                self._teardown(index)
+        for index in list(self._live):
+            if len(self._live) <= self._maxLive:
+                break
+            if index not in protected:
+                self._teardown(index)
+
+    def report(self):
+        return {
+            "mode": "lazy" if self._lazy else "eager",
+            "startupTime": self.startupTime,
+            "startupMemory": self.startupMemory,
+            "live": len(self._live),
+            "residentMemory": residentMemory(),
+        }
+
+
+def formatReport(report):
+    return "%s effect startup: %.3f s, %s, %d effects built, %s resident" % (
+        report["mode"].capitalize(), report["startupTime"], formatBytes(report["startupMemory"]),
+        report["live"], formatBytes(report["residentMemory"]))
+
+
+def _measureMode(lazy, results):
+    # Boots an offline server, builds the registry in the given mode and selects the first effect, like the
+    # pedal does when it's first switched on
+    from pyo import Server, Noise
+    server = Server(audio="offline")
+    server.boot()
+    source = Noise(mul=.1)
+    registry = EffectRegistry(source, lazy=lazy)
+    registry.start(0)
+    results.append(registry.report())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    # Compares eager and lazy startup, each in a fresh process so the memory figures don't influence each other
+    import multiprocessing
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        for lazy in (False, True):
+            results = manager.list()
+            process = context.Process(target=_measureMode, args=(lazy, results))
+            process.start()
+            process.join()
+            for report in results:
+                print(formatReport(report))
@@ -0,0 +1,767 @@
+# The guitar effects of the pedal. This module holds the custom effect classes along with a factory function
+# for every effect that can be selected on the pedal, so effects can be built on demand from any input signal.
+# Nothing in here touches the GPIO pins or the audio devices, a pyo Server just has to be booted before any
+# of the factories are called.
+import collections
+import math
+
+from pyo import *
+
+# The class tutorial using the Flanger class as a representation of the structure used in a PyoObject. This was 
+# used as inspiration to creating the structure of the different effect classes to either override the original 
+# methods in the function, or act as getter, setter, or other methods to interact with the aspects of the 
+# audiowave, while the modulation effects created in the pedal were created from our custom combinations and 
+# implementations of the Pyo library.
+
+# Flanger class implementation adapted from here: http://ajaxsoundstudio.com/pyodoc/tutorials/pyoobject2.html
+class Flanger(PyoObject):
+    def __init__(self, input, depth=0.75, lfofreq=0.2, feedback=0.5, lfo=None, lfotable=None, lfocycles=1, mul=1,
+                 add=0):
+        # Initialize PyoObject basic attributes
+        PyoObject.__init__(self)
+
+        # Keep references of arguments
+        self._input = input
+        self._depth = depth
+        self._lfofreq = lfofreq
+        self._feedback = feedback
+
+        # Using InputFader to create a fade between different effects when changing sources
+        self._in_fader = InputFader(input)
+
+        # Convert each var into lists
+        in_fader, depth, lfofreq, feedback, mul, add, lmax = convertArgsToLists(self._in_fader, depth, lfofreq, feedback, mul, add)
+
+        # In the heart of the class lies the guitar effects, which controls the modulation of the audio passed into the class.
+        # Each of the aspects of the Flanger effect are created here, with the sweeping delayed audio which follows the original guitar
+        # audio created from the signal, LFO, and Delay objects. Finally, each of the audio signals are placed into a Mixer 
+        # object to allow for us to place multiple effects into the same audiostream, along with change the presence of each effect
+        # in the audio stream. The sweep can also come from an lfo given from outside, such as one locked to the tempo
+        # clock, which then sets its own rate and is played and stopped by whoever made it. Or the sweep can be read
+        # from a table baked ahead of time holding lfocycles turns of the LFO's waveform, such as one from effectCache.py.
+        self._amplitudemodulation = Sig(depth, mul=0.005)
+        self._sharedLfo = lfo is not None
+        self._lfocycles = float(lfocycles)
+        if self._sharedLfo:
+            self._lfo = lfo
+            self._wavechange = Sig(lfo, add=0.005, mul=self._amplitudemodulation)
+        elif lfotable is not None:
+            self._wavechange = Osc(lfotable, freq=[x / self._lfocycles for x in lfofreq * 2], add=0.005,
+                                   mul=self._amplitudemodulation)
+        else:
+            self._wavechange = LFO(freq=lfofreq * 2, sharp=0.3, type=7, add=0.005, mul=self._amplitudemodulation)
+        self._flangedelay = SDelay(in_fader, delay=self._wavechange, maxdelay=1.5, mul=1, add=0)
+        self._flange = Mixer(outs=2, chnls=2, time=0.05, mul=1.02, add=0.01)
+        self._flange.addInput(voice=0, input=self._input)
+        self._flange.addInput(voice=1, input=self._flangedelay)
+
+        self._flange.setAmp(0, 1, 1)
+        self._flange.setAmp(1, 1, 0.9)
+        
+        # Exports each of the objects from the Flanger class to the created Flanger guitar effect object
+        self._base_objs = self._flange.getBaseObjects()
+
+    def setInput(self, x, fadetime=0.05):
+        # Replaces the input attribute, then returns the reference of the input object to the guitar audio to ensure the reference is 
+        # updated
+        self._input = x
+        self._in_fader.setInput(x, fadetime)
+
+    def setDepth(self, x):
+        # Replaces the depth attribute with the given value, then updates the value inside the guitar objects created
+        self._depth = x
+        self._amplitudemodulation.value = x
+
+    def setLfoFreq(self, x):
+        # Replaces the lfofreq attribute, then updates the value in the LFO oscilating object effect
+        self._lfofreq = x
+        if self._sharedLfo:
+            self._lfo.freq = x * 2
+        else:
+            self._wavechange.freq = x * 2 / self._lfocycles
+
+    def setFeedback(self, x):
+        # Replaces feedback attribute, then updates the attribute in the flangedelay object
+        self._feedback = x
+        self._flangedelay.feedback = x
+
+    # Getter and Setter methods to allow users to interact with the different parameters of the object directly outside of the object
+    @property
+    def input(self):
+        return self._input
+    @input.setter
+    def input(self, x):
+        self.setInput(x)
+
+    @property
+    def depth(self):
+        return self._depth
+    @depth.setter
+    def depth(self, x):
+        self.setDepth(x)
+
+    @property
+    def lfofreq(self):
+        return self._lfofreq
+    @lfofreq.setter
+    def lfofreq(self, x):
+        self.setLfoFreq(x)
+
+    @property
+    def feedback(self):
+        return self._feedback
+    @feedback.setter
+    def feedback(self, x):
+        self.setFeedback(x)
+
+    # Overriding the methods from the base PyoObject to create the utilize the new flanger modulations
+    # This method makes sure controls work properly when used from the GUI, not relevant to headless usage sadly
+    def ctrl(self, map_list=None, title=None, wxnoserver=False):
+        self._map_list = []
+        PyoObject.ctrl(self, map_list, title, wxnoserver)
+
+    # The following three methods are responsible for starting and stopping audio output
+    # Play and Out methods are both methods that play all of the audio effects when called and returns the modulating 
+    # guitar effect object
+    def play(self, dur=0, delay=0):
+        self._amplitudemodulation.play(dur, delay)
+        self._wavechange.play(dur, delay)
+        self._flangedelay.play(dur, delay)
+        self._flange.play(dur, delay)
+        return PyoObject.play(self, dur, delay)
+
+    def out(self, chnl=0, inc=1, dur=0, delay=0):
+        self._amplitudemodulation.play(dur, delay)
+        self._wavechange.play(dur, delay)
+        self._flangedelay.play(dur, delay)
+        self._flange.play(dur, delay)
+        return PyoObject.out(self, chnl, inc, dur, delay)
+
+    # Stop method halts all audio effects of the current object and returns the object to the call. The Mixer is stopped
+    # on its own, since only its voices are exported to the Flanger object and the mixing itself would keep running.
+    def stop(self, wait=0):
+        self._amplitudemodulation.stop(wait)
+        self._wavechange.stop(wait)
+        self._flangedelay.stop(wait)
+        self._flange.stop(wait)
+        return PyoObject.stop(self, wait)
+
+# The Vibrato object increases and decreases the pitch of the sound very quickly, creating a light wobbling effect on the Guitar or Bass pitch    
+class Vibrato(PyoObject):
+    def __init__(self, input, depth=0.5, lfo=None, mul=1, add=0):
+        # Initialize PyoObject basic attributes
+        PyoObject.__init__(self)
+
+        # The reference of the arguments are saved
+        self._input = input
+        self._depth = depth
+
+        # InputFader is applied to the input audio stream to allow for crossfading between internal input devices, such as when switching between 
+        # different guitar or bass effects, along with different guitars or basses
+        self._in_fader = InputFader(input)
+
+        in_fader, depth, mul, add, lmax = convertArgsToLists(self._in_fader, depth, mul, add)
+
+        # Here, the sound effects of the modulation are applied to the object. First, the Sine wave and Signal objects create an oscillating 
+        # signals at a frequency of the given depth. Then, the Frequency Shift object slightly oscillates the frequency over the course of the 
+        # object being active. A composite effect like the Leslie can pass in its own oscillator as lfo instead, so its
+        # sub-effects share one modulator, which is then scaled to the same range and played and stopped by its owner.
+        self._sharedLfo = lfo is not None
+        if self._sharedLfo:
+            self._sinewave = lfo
+            self._wavesig = Sig(self._sinewave, mul=10, add=6)
+        else:
+            self._sinewave = Sine(freq=depth, mul=5, add=3)
+            self._wavesig = Sig(self._sinewave, mul=2)
+        self._vibrato = FreqShift(in_fader, self._wavesig, mul=mul, add=add)
+
+        # Set the effects to the given audio output
+        self._base_objs = self._vibrato.getBaseObjects()
+
+    def setInput(self, x, fadetime=0.05):
+        # Replaces the input attribute, then returns the reference of the input object to the guitar audio to ensure the reference is 
+        # updated
+        self._input = x
+        self._in_fader.setInput(x, fadetime)
+
+    def setDepth(self, x):
+        # Replaces the depth attribute with the given value, then updates the speed of the sine wave wobbling the pitch,
+        # which is what the depth sets when the Vibrato is created
+        self._depth = x
+        self._sinewave.freq = x
+
+    # Getter and Setter methods to allow users to interact with the different parameters of the object outside of the object
+    @property
+    def input(self):
+        return self._input
+    @input.setter
+    def input(self, x):
+        self.setInput(x)
+
+    @property
+    def depth(self):
+        return self._depth
+    @depth.setter
+    def depth(self, x):
+        self.setDepth(x)
+
+    # Overriding the methods from the base PyoObject to create the utilize the new vibrato modulations
+    # This method makes sure controls work properly when used from the GUI, not relevant to headless usage sadly    
+    def ctrl(self, map_list=None, title=None, wxnoserver=False):
+        self._map_list = []
+        PyoObject.ctrl(self, map_list, title, wxnoserver)
+
+    # The following three methods are responsible for starting and stopping audio output
+    # Play and Out methods are both methods that play all of the audio effects when called and returns the modulating 
+    # guitar effect object
+    def play(self, dur=0, delay=0):
+        self._wavesig.play(dur, delay)
+        if not self._sharedLfo:
+            self._sinewave.play(dur, delay)
+        self._vibrato.play(dur, delay)
+        return PyoObject.play(self, dur, delay)
+
+    def out(self, chnl=0, inc=1, dur=0, delay=0):
+        self._wavesig.play(dur, delay)
+        if not self._sharedLfo:
+            self._sinewave.play(dur, delay)
+        self._vibrato.play(dur, delay)
+        return PyoObject.out(self, chnl, inc, dur, delay)
+
+    # Stop method halts all audio effects of the current object and returns the object to the call. A shared
+    # oscillator is left to the effect that owns it.
+    def stop(self, wait=0):
+        self._wavesig.stop(wait)
+        if not self._sharedLfo:
+            self._sinewave.stop(wait)
+        self._vibrato.stop(wait)
+        return PyoObject.stop(self, wait)
+        
+# The Tremolo effect acts similarly to Vibrato, with the volume of the guitar audio wobbling instead of the pitch
+class Tremolo(PyoObject):
+    def __init__(self, input, freq=6, lfo=None, mul=1, add=0):
+        # Initialize basic guitar object parameters, as well as the change in frequency from the Tremolo effect, as well as the 
+        # InputFader function applied to the imput signal for fading into different effects or devices, such as switching 
+        # between different guitar or bass effects or devices
+        PyoObject.__init__(self)
+        
+        self._input = input
+        self._freq = freq
+        
+        self._in_fader = InputFader(input)
+
+        in_fader, freq, mul, add, lmax = convertArgsToLists(self._in_fader, freq, mul, add)
+
+        # Sound effects are applied to the input guitar or bass audio. The given frequency of the tremolo is oscillated using the Sine 
+        # object, as well as the volume control in the Chorus object, while the delay of the chorus effect is nullified to solely utilize the 
+        # volume change of the Tremolo effect. Like the Vibrato, the Tremolo can be given a shared oscillator as lfo, which
+        # its owner plays and stops.
+        self._sharedLfo = lfo is not None
+        self._tremosc = lfo if self._sharedLfo else Sine(freq=self._freq, mul=mul)
+        self._tremolo = Chorus(in_fader, depth=.1, feedback=0, bal=0.5, mul=self._tremosc, add=add)
+
+        self._base_objs = self._tremolo.getBaseObjects()
+
+    # Getter and Setter methods to allow users to interact with the different parameters of the object directly outside of the object
+    def setInput(self, x, fadetime=0.05):
+        # Replaces the input attribute, then returns the reference of the input object to the guitar audio to ensure the reference is 
+        # updated
+        self._input = x
+        self._in_fader.setInput(x, fadetime)
+
+    def setFreq(self, x):
+        # Replaces the frequency attribute of the function in the class, along with updating the frequency within the the Tremolo 
+        # oscillation object "tremosc" 
+        self._freq = x
+        self._tremosc.freq = x
+
+    # Getter and Setter methods to allow users to interact with the different parameters of the object outside of the object
+    @property
+    def input(self):
+        return self._input
+    @input.setter
+    def input(self, x):
+        self.setInput(x)
+
+    @property
+    def freq(self):
+        return self._freq
+    @freq.setter
+    def freq(self, x):
+        self.setFreq(x)
+
+    # Overriding the methods from the base PyoObject to create the utilize the new tremolo modulations
+    # This method makes sure controls work properly when used from the GUI, not relevant to headless usage sadly   
+    def ctrl(self, map_list=None, title=None, wxnoserver=False):
+        self._map_list = []
+        PyoObject.ctrl(self, map_list, title, wxnoserver)
+
+    # The following three methods are responsible for starting and stopping audio output
+    # Play and Out methods are both methods that play all of the audio effects when called and returns the modulating 
+    # guitar effect object
+    def play(self, dur=0, delay=0):
+        if not self._sharedLfo:
+            self._tremosc.play(dur, delay)
+        self._tremolo.play(dur, delay)
+        return PyoObject.play(self, dur, delay)
+
+    def out(self, chnl=0, inc=1, dur=0, delay=0):
+        if not self._sharedLfo:
+            self._tremosc.play(dur, delay)
+        self._tremolo.play(dur, delay)
+        return PyoObject.out(self, chnl, inc, dur, delay)
+
+    # Stop method halts all audio effects of the current object and returns the object to the call. The Chorus is stopped
+    # on its own as well, so that its internal input fader doesn't keep running while the Tremolo is bypassed.
+    def stop(self, wait=0):
+        if not self._sharedLfo:
+            self._tremosc.stop(wait)
+        self._tremolo.stop(wait)
+        return PyoObject.stop(self, wait)
+
+# The Leslie Speaker guitar effect acts as a combination of multiple effects to create a sound similar to a fan in 
+# front of a speaker. It is a composite effect: its Tremolo, Phaser and Vibrato only play through its own Mixer,
+# and the Tremolo and Vibrato share a single rotor oscillator, since the volume and the pitch of a real rotating
+# speaker wobble at the same speed. The Phaser runs on a single sweep as well, where it used to run two identical
+# ones side by side, which halves the cost of its 18 stages.
+class Leslie(PyoObject):
+    def __init__(self, input, depth=1, pitdepth=3, speed=4, rotor=None, sweep=None, mul=1, add=0):
+        # Each of the basic methods for the PyoObject are current method parameters, as well as the parameters of 
+        # the object being initialized into references which are converted into lists to contain either one or multiple 
+        # values from different modulation effects, such as Sine's frequency variable and Phaser's frequency variable. 
+        # Additionally, the guitar signal is converted through the InputFader function to allow for the signal to fade 
+        # in between the switching of effects or input devices, such as the guitar or the bass
+        PyoObject.__init__(self)
+
+        self._input = input
+        self._depth = depth
+        self._speed = speed
+
+        self._in_fader = InputFader(input)
+
+        in_fader, mul, add, lmax = convertArgsToLists(self._in_fader, mul, add)
+
+        # Now to the Key Guitar Effect of the project. The Leslie effect combines Tremolo, Phaser, and Vibrato sound effects 
+        # to create the sound of a Leslie speaker. First, the two sine waves of the Phaser effect are creating using the Sine 
+        # objects, which are imported into the initialized Phaser object. The depth sets how fast the phaser's spread
+        # sweeps, and is kept in a Sig so it can be changed while the effect plays. Second, the rotor oscillator is created
+        # and handed to both the Tremolo and the Vibrato, which modulate the guitar audio coming through the input fader.
+        # Thirdly, the Phaser effect is initialized, modulating the guitar audio along with the given oscillating frequency
+        # and spread values from the sine wave objects "lfofreq" and "lfospread."
+        # Finally, each of the sound effects are inputted into the Mixer object to allow for future users to control which audio 
+        # devices each effect is sent through and the prominence of each effect in the signal. None of the sub-effects
+        # play out on their own, the Mixer is the only way out of the Leslie, and it mixes every part of the effect
+        # equally onto a single output. The rotor and the phaser's frequency sweep can be given from outside instead,
+        # such as oscillators locked to the tempo clock, in which case whoever made them plays and stops them.
+        self._sharedLfo = rotor is not None and sweep is not None
+        self._spreadrate = Sig(depth, mul=.16)
+        self._lfofreq = sweep if self._sharedLfo else Sine(freq=.2,mul=70,add=200)
+        self._lfospread = Sine(freq=self._spreadrate, mul=.6, add=1.5)
+        self._rotor = rotor if self._sharedLfo else Sine(freq=speed)
+        self._tremolo = Tremolo(self._in_fader, lfo=self._rotor)
+        self._phaser = Phaser(self._in_fader, freq=self._lfofreq, spread=self._lfospread, q=1, feedback=.5, num=18, mul=.1)
+        self._vibrato = Vibrato(self._in_fader, lfo=self._rotor)
+        self._leslie = Mixer(outs=1, chnls=1, time=0.5, mul=mul, add=add)
+        self._leslie.addInput(voice=0, input=self._tremolo)
+        self._leslie.addInput(voice=1, input=self._phaser)
+        self._leslie.addInput(voice=2, input=self._vibrato)
+
+        self._leslie.setAmp(0, 0, 1)
+        self._leslie.setAmp(1, 0, 1)
+        self._leslie.setAmp(2, 0, 1)
+        
+        self._base_objs = self._leslie.getBaseObjects()
+
+    # Getter and Setter methods to allow users to interact with the different parameters of the object directly outside of the object
+    def setInput(self, x, fadetime=0.05):
+        # Replaces the input attribute, then returns the reference of the input object to the guitar audio to ensure the reference is 
+        # updated
+        self._input = x
+        self._in_fader.setInput(x, fadetime)
+
+    def setDepth(self, x):
+        # Replaces the depth attribute, then updates the speed of the phaser's spread sweep
+        self._depth = x
+        self._spreadrate.value = x
+
+    def setSpeed(self, x):
+        # Replaces the speed attribute, then updates the rotor oscillator shared by the Tremolo and the Vibrato
+        self._speed = x
+        self._rotor.freq = x
+
+    # Getter and Setter methods to allow users to interact with the different parameters of the object outside of the object    
+    @property
+    def input(self):
+        return self._input
+    @input.setter
+    def input(self, x):
+        self.setInput(x)
+        
+    @property
+    def depth(self):
+        return self._depth
+    @depth.setter
+    def depth(self, x):
+        self.setDepth(x)
+
+    @property
+    def speed(self):
+        return self._speed
+    @speed.setter
+    def speed(self, x):
+        self.setSpeed(x)
+    
+    # Overriding the methods from the base PyoObject to create the utilize the new leslie modulation
+    # This method makes sure controls work properly when used from the GUI, not relevant to headless usage sadly  
+    def ctrl(self, map_list=None, title=None, wxnoserver=False):
+        self._map_list = []
+        PyoObject.ctrl(self, map_list, title, wxnoserver)
+
+    # The following three methods are responsible for starting and stopping audio output
+    # Play and Out methods are both methods that play all of the audio effects when called and returns the modulating 
+    # guitar effect object. The sub-effects are only played, never sent out, since they reach the output through the Mixer.
+    def play(self, dur=0, delay=0):
+        self._spreadrate.play(dur, delay)
+        self._lfospread.play(dur, delay)
+        if not self._sharedLfo:
+            self._lfofreq.play(dur, delay)
+            self._rotor.play(dur, delay)
+        self._tremolo.play(dur, delay)
+        self._phaser.play(dur, delay)
+        self._vibrato.play(dur, delay)
+        self._leslie.play(dur, delay)
+        return PyoObject.play(self, dur, delay)
+
+    def out(self, chnl=0, inc=1, dur=0, delay=0):
+        self._spreadrate.play(dur, delay)
+        self._lfospread.play(dur, delay)
+        if not self._sharedLfo:
+            self._lfofreq.play(dur, delay)
+            self._rotor.play(dur, delay)
+        self._tremolo.play(dur, delay)
+        self._phaser.play(dur, delay)
+        self._vibrato.play(dur, delay)
+        self._leslie.play(dur, delay)
+        return PyoObject.out(self, chnl, inc, dur, delay)
+
+    # Stop method halts all audio effects of the current object, including the phaser's sine wave modulators, the shared
+    # rotor and the mixer itself, and returns the object to the call    
+    def stop(self, wait=0):
+        self._spreadrate.stop(wait)
+        self._lfospread.stop(wait)
+        if not self._sharedLfo:
+            self._lfofreq.stop(wait)
+            self._rotor.stop(wait)
+        self._tremolo.stop(wait)
+        self._phaser.stop(wait)
+        self._vibrato.stop(wait)
+        self._leslie.stop(wait)
+        return PyoObject.stop(self, wait)
+
+# Returns every pyo object reachable from the given objects through their attributes, such as the oscillators,
+# delay lines and sub-effects inside a custom effect class. Objects in exclude, like the guitar input feeding an
+# effect, are skipped and not walked into.
+def internalObjects(roots, exclude=()):
+    found = []
+    seen = set(id(obj) for obj in exclude)
+    pending = list(roots)
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, (list, tuple)):
+            pending.extend(obj)
+        elif isinstance(obj, PyoObject):
+            found.append(obj)
+            for value in vars(obj).values():
+                if isinstance(value, (PyoObject, list, tuple)):
+                    pending.append(value)
+    return found
+
+# True if any of the audio streams behind a pyo object are still being computed
+def isComputing(obj):
+    streams = list(getattr(obj, "_base_objs", None) or [])
+    streams += list(getattr(obj, "_base_players", None) or [])
+    for stream in streams:
+        if stream._getStream().isPlaying():
+            return True
+    return False
+
+# Default time in seconds over which a parameter change is ramped, short enough to feel instant under the foot but
+# long enough that the jump doesn't click
+RAMP_TIME = 0.025
+
+# A live parameter of an effect chain, such as the Flanger's depth. The setter is the effect's own setter, like
+# Flanger.setDepth or Chorus.setFeedback, and value is the value currently set. Parameters that pyo accepts as an
+# audio signal are smoothed: the chain plugs a SigTo ramp into the setter when it is built, and every change only
+# moves the ramp's target, so nothing in the graph is rebuilt. Parameters that only take plain numbers, like the
+# Reverb's room size, are set directly.
+#
+# Every parameter has a range, which values are clamped to when set, so a controller or a preset can't push an effect
+# somewhere it doesn't work, like a Delay feeding back without end. NaN and infinite values are rejected. Unless given one of its own, a parameter takes the
+# range declared for it in PARAMETER_RANGES when its chain is built.
+class Parameter(object):
+    def __init__(self, name, setter, value, smooth=True, low=None, high=None):
+        self.name = name
+        self.setter = setter
+        self.value = value
+        self.smooth = smooth
+        self.low = low
+        self.high = high
+        self.ramp = None
+
+    def clamp(self, value):
+        # NaN would slip through the comparisons below, and an infinite value has no place in any range
+        if not math.isfinite(value):
+            raise ValueError("%s can't be set to %r" % (self.name, value))
+        if self.low is not None and value < self.low:
+            return self.low
+        if self.high is not None and value > self.high:
+            return self.high
+        return value
+
+    def scale(self, position):
+        # The value at a position from 0 to 1 along the range
+        return self.low + (self.high - self.low) * min(max(position, 0.0), 1.0)
+
+# The range of every parameter of the pedal's effects, by effect and parameter name. The NumPy kernels and the chains
+# run in worker processes take theirs from here too.
+PARAMETER_RANGES = {
+    "Chorus": {"depth": (0.0, 5.0), "feedback": (0.0, 1.0), "bal": (0.0, 1.0)},
+    "Distortion": {"drive": (0.0, 1.0), "slope": (0.0, 1.0)},
+    "Reverb": {"revtime": (0.1, 6.0), "roomSize": (0.25, 4.0), "bal": (0.0, 1.0)},
+    "Delay": {"delay": (0.05, 0.8), "feedback": (0.0, 0.9)},
+    "Flanger": {"depth": (0.0, 2.0), "lfofreq": (0.05, 2.0)},
+    "Envelope Filter": {"q": (0.5, 20.0), "range": (500.0, 8000.0)},
+    "Tremolo": {"freq": (0.5, 12.0)},
+    "Vibrato": {"depth": (0.0, 20.0)},
+    "Phaser": {"q": (0.5, 10.0), "feedback": (0.0, 0.95)},
+    "Leslie Speaker": {"depth": (0.0, 2.0), "speed": (0.5, 8.0)},
+    "FreqShift": {"range": (500.0, 8000.0)},
+}
+
+def declareRanges(effect, parameters):
+    # Gives every parameter without a range of its own the one declared for it in PARAMETER_RANGES
+    ranges = PARAMETER_RANGES.get(effect, {})
+    for param in parameters:
+        if param.low is None and param.high is None and param.name in ranges:
+            param.low, param.high = ranges[param.name]
+
+# An EffectChain bundles the object that produces an effect's sound with the helper objects it depends on,
+# such as the Follower driving the envelope filter or the Sine LFOs sweeping the phaser. Starting or stopping
+# the chain starts or stops all of them together, so a stopped effect doesn't leave its helpers running.
+#
+# Some pyo objects leave parts of themselves running when stopped, like the arithmetic inside FreqShift. The
+# first time the chain is stopped, it looks for any object inside it that is still computing and remembers it,
+# so these stragglers are stopped and restarted along with the rest of the chain from then on. A bypassed
+# effect therefore costs no CPU per audio block at all.
+#
+# The chain also holds the effect's live parameters, which setParameter() changes in place while it plays. An effect
+# locked to a tempo clock is given the clock too, since the clock's master phase is shared by every effect and must
+# never be stopped along with one of them.
+class EffectChain(object):
+    def __init__(self, name, output, helpers=None, input=None, parameters=None, clock=None):
+        self.name = name
+        self.output = output
+        self.helpers = list(helpers) if helpers else []
+        self.input = input
+        self.clock = clock
+        self.parameters = collections.OrderedDict((param.name, param) for param in (parameters or []))
+        declareRanges(name, self.parameters.values())
+        self._stragglers = None
+        # The ramps are plugged in while the effect is still being built, so they are stopped and started along
+        # with the rest of the chain, and changing a parameter later never adds objects to the graph
+        for param in self.parameters.values():
+            if param.smooth:
+                param.ramp = SigTo(param.value, time=RAMP_TIME, init=param.value)
+                param.setter(param.ramp)
+                self.helpers.append(param.ramp)
+
+    def _playStragglers(self, dur, delay):
+        if self._stragglers:
+            for obj in self._stragglers:
+                obj.play(dur, delay)
+
+    def play(self, dur=0, delay=0):
+        self._playStragglers(dur, delay)
+        for helper in self.helpers:
+            helper.play(dur, delay)
+        self.output.play(dur, delay)
+        return self
+
+    def out(self, chnl=0, inc=1, dur=0, delay=0):
+        self._playStragglers(dur, delay)
+        for helper in self.helpers:
+            helper.play(dur, delay)
+        self.output.out(chnl, inc, dur, delay)
+        return self
+
+    def stop(self, wait=0):
+        self.output.stop(wait)
+        for helper in self.helpers:
+            helper.stop(wait)
+        if self._stragglers is None:
+            exclude = self._shared()
+            if wait == 0:
+                self._stragglers = [obj for obj in self.objects(exclude) if isComputing(obj)]
+            else:
+                # Objects are still running during a delayed stop, so every internal object is remembered
+                self._stragglers = self.objects(exclude)
+        for obj in self._stragglers:
+            obj.stop(wait)
+        return self
+
+    def _shared(self):
+        # Objects the effect uses but doesn't own
+        shared = [self.input] if self.input is not None else []
+        if self.clock is not None:
+            shared += self.clock.objects()
+        return shared
+
+    def objects(self, exclude=()):
+        # All pyo objects making up this effect
+        return internalObjects([self.output] + self.helpers, exclude or self._shared())
+
+    def isPlaying(self):
+        return self.output.isPlaying()
+
+    def parameterValues(self):
+        return dict((name, param.value) for name, param in self.parameters.items())
+
+    def setParameter(self, name, value, time=RAMP_TIME):
+        # Moves a parameter to a new value inside its range, ramping it over the given time if it can be smoothed.
+        # Returns False if the parameter already had that value and nothing was sent to the server.
+        param = self.parameters.get(name)
+        if param is None:
+            raise ValueError("%s has no parameter %s" % (self.name, name))
+        value = param.clamp(value)
+        if value == param.value:
+            return False
+        if param.ramp is None:
+            param.setter(value)
+        else:
+            param.ramp.time = time
+            param.ramp.value = value
+        param.value = value
+        return True
+
+# Factory functions for each effect of the pedal, using the fine-tuned parameters for each specific effect.
+# These include fine-tuned classic effects created from PyoObjects such as Chorus, Delay, and Distortion,
+# multilayered or multichained effects created from inputting value manipulation or audio modulation effects
+# into other guitar effect objects, such as the Envelope Filter and FreqShift, and each of the custom class
+# effects of Flanger, Vibrato, Tremolo, and the Leslie speaker effect.
+#
+# Each factory also declares the effect's live parameters with their starting values, which the presets and other
+# controls change through EffectChain.setParameter().
+#
+# Every factory takes an optional tempo clock from tempo.py. Given one, the time-based effects read their LFOs off
+# the clock's master phase instead of running oscillators of their own, and the Delay's time follows the beat. Rates
+# and times are then the ones heard at the clock's reference tempo. A locked LFO only runs at whole steps of the
+# clock, so its rate is set directly instead of being ramped.
+def makeChorus(input, clock=None):
+    chorus = Chorus(input, depth=1.2, feedback=.6, bal=0.5)
+    return EffectChain("Chorus", chorus, input=input, parameters=[
+        Parameter("depth", chorus.setDepth, 1.2),
+        Parameter("feedback", chorus.setFeedback, .6),
+        Parameter("bal", chorus.setBal, 0.5)])
+
+def makeDistortion(input, clock=None):
+    disto = Disto(input, slope=.3, mul=.65)
+    return EffectChain("Distortion", disto, input=input, parameters=[
+        Parameter("drive", disto.setDrive, .75),
+        Parameter("slope", disto.setSlope, .3)])
+
+def makeReverb(input, clock=None):
+    reverb = STRev(input, revtime=1.8, roomSize=1.2)
+    return EffectChain("Reverb", reverb, input=input, parameters=[
+        Parameter("revtime", reverb.setRevtime, 1.8),
+        Parameter("roomSize", reverb.setRoomSize, 1.2, smooth=False),
+        Parameter("bal", reverb.setBal, 0.5)])
+
+def makeDelay(input, clock=None):
+    if clock is None:
+        delay = Delay(input, delay=.6, feedback=.3, maxdelay=.8)
+        return EffectChain("Delay", delay, input=input, parameters=[
+            Parameter("delay", delay.setDelay, .6),
+            Parameter("feedback", delay.setFeedback, .3)])
+    # The delay time is scaled by the length of a beat, which the clock ramps on a tempo change. The delay line is
+    # long enough for the longest delay at the slowest tempo.
+    beats = Sig(clock.beatTime, mul=.6 / clock.referenceBeat)
+    delay = Delay(input, delay=beats, feedback=.3, maxdelay=3)
+    return EffectChain("Delay", delay, [beats], input=input, clock=clock, parameters=[
+        Parameter("delay", lambda x: beats.setMul(x / clock.referenceBeat), .6),
+        Parameter("feedback", delay.setFeedback, .3)])
+
+def makeFlanger(input, clock=None, sweep=None):
+    # sweep is a baked LFO table from effectCache.py, only used when the Flanger runs free of the tempo clock
+    lfo = None if clock is None else clock.lfo(.545 * 2)
+    table, cycles = (None, 1) if sweep is None or lfo is not None else (sweep.table, sweep.cycles)
+    flanger = Flanger(input, depth=.875, lfofreq=.545, lfo=lfo, lfotable=table, lfocycles=cycles)
+    return EffectChain("Flanger", flanger, [] if lfo is None else [lfo], input=input, clock=clock, parameters=[
+        Parameter("depth", flanger.setDepth, .875),
+        Parameter("lfofreq", flanger.setLfoFreq, .545, smooth=clock is None)])
+
+def makeEnvelope(input, clock=None):
+    # Envelope / Autowah implementation adapted from here: https://www.matthieuamiguet.ch/blog/diy-guitar-effects-python
+    fol = Follower(input, freq=45, mul=4200, add=35)
+    envelope = Biquad(input, freq=fol, q=7, type=0)
+    return EffectChain("Envelope Filter", envelope, [fol], input=input, parameters=[
+        Parameter("q", envelope.setQ, 7),
+        Parameter("range", fol.setMul, 4200)])
+
+def makeTremolo(input, clock=None):
+    lfo = None if clock is None else clock.lfo(6)
+    tremolo = Tremolo(input, freq=6, lfo=lfo, mul=1, add=0)
+    return EffectChain("Tremolo", tremolo, [] if lfo is None else [lfo], input=input, clock=clock, parameters=[
+        Parameter("freq", tremolo.setFreq, 6, smooth=clock is None)])
+
+def makeVibrato(input, clock=None):
+    lfo = None if clock is None else clock.lfo(10)
+    vibrato = Vibrato(input, depth=10, lfo=lfo)
+    return EffectChain("Vibrato", vibrato, [] if lfo is None else [lfo], input=input, clock=clock, parameters=[
+        Parameter("depth", vibrato.setDepth, 10, smooth=clock is None)])
+
+def makePhaser(input, clock=None):
+    if clock is None:
+        lfo1 = Sine(freq=[.1,.15], mul=65, add=200)
+        lfo2 = Sine(freq=[.18, .15], mul=.6, add=1.5)
+    else:
+        lfo1 = clock.lfo([.1,.15], mul=65, add=200)
+        lfo2 = clock.lfo([.18, .15], mul=.6, add=1.5)
+    phaser = Phaser(input, freq=lfo1, spread=lfo2, q=1, feedback=.5, num=20)
+    return EffectChain("Phaser", phaser, [lfo1, lfo2], input=input, clock=clock, parameters=[
+        Parameter("q", phaser.setQ, 1),
+        Parameter("feedback", phaser.setFeedback, .5)])
+
+def makeLeslie(input, clock=None):
+    if clock is None:
+        leslie = Leslie(input, mul=.7)
+        lfos = []
+    else:
+        lfos = [clock.lfo(4), clock.lfo(.2, mul=70, add=200)]
+        leslie = Leslie(input, rotor=lfos[0], sweep=lfos[1], mul=.7)
+    return EffectChain("Leslie Speaker", leslie, lfos, input=input, clock=clock, parameters=[
+        Parameter("depth", leslie.setDepth, 1),
+        Parameter("speed", leslie.setSpeed, 4, smooth=clock is None)])
+
+def makeFreqShift(input, clock=None):
+    fol = Follower(input, freq=45, mul=4200, add=35)
+    freq = FreqShift(input, shift=fol, mul=1, add=0)
+    return EffectChain("FreqShift", freq, [fol], input=input, parameters=[
+        Parameter("range", fol.setMul, 4200)])
+
+# The effects selectable with the footswitch, in the order the second button cycles through them
+EFFECTS = [
+    ("Chorus", makeChorus),
+    ("Distortion", makeDistortion),
+    ("Reverb", makeReverb),
+    ("Delay", makeDelay),
+    ("Flanger", makeFlanger),
+    ("Envelope Filter", makeEnvelope),
+    ("Tremolo", makeTremolo),
+    ("Vibrato", makeVibrato),
+    ("Phaser", makePhaser),
+    ("Leslie Speaker", makeLeslie),
+    ("FreqShift", makeFreqShift),
+]
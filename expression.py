@@ -0,0 +1,301 @@
+# Continuous control of the pedal from an expression pedal or knobs, read through an SPI analog-to-digital converter
+# like the MCP3008. A sampler thread reads every mapped ADC channel at a fixed rate and cleans up the readings
+# before anything reaches the effects:
+#
+# - a median over the last few readings throws out the single-sample spikes a scratchy potentiometer makes
+# - an exponential moving average smooths the remaining noise
+# - deadbands at both ends of the travel make heel down and toe down land exactly on the ends of the range, as a
+#   pedal's potentiometer rarely reaches either end
+# - a change is only forwarded once the position has moved by more than a threshold since the last one, so a pedal
+#   resting on the floor sends nothing at all
+#
+# What is left goes to the ParameterBatcher of the control server, the same way OSC and MIDI changes do, mapped onto
+# the parameter's declared range. The batcher keeps only the latest value and applies it once per audio buffer, and
+# the parameter's SigTo ramp smooths the steps in between.
+#
+# Like the footswitches, the ADC is hidden behind a backend, so the sampler runs on the Pi (MCP3008Backend, through
+# the optional spidev package) and on a plain Linux machine (SimulatedADCBackend), where running this file measures
+# the CPU the sampler takes and how long a move of the pedal takes to reach the batcher.
+#
+#     python buttonWithSFX.py --expression
+#     python expression.py --rate 200
+import argparse
+import collections
+import math
+import random
+import threading
+import time
+
+from effects import PARAMETER_RANGES
+
+# ADC channels mapped to effect parameters. The expression pedal on channel 0 sweeps the Envelope Filter like a wah,
+# and the knob on channel 1 sets the Flanger's depth.
+ADC_MAP = {
+    0: ("Envelope Filter", "range"),
+    1: ("Flanger", "depth"),
+}
+
+# Readings per second of every channel
+SAMPLE_RATE = 200
+
+# Readings the median is taken over
+MEDIAN_SIZE = 5
+
+# Weight of every new reading in the moving average, from 0 to 1
+SMOOTHING = 0.5
+
+# Fraction of the travel at either end that reads as fully heel or toe down
+END_DEADBAND = 0.02
+
+# Fraction of the travel the position has to move by before the change is forwarded, a little over the 1/1024 steps
+# of a 10-bit ADC so its last bit flickering doesn't count
+THRESHOLD = 0.004
+
+
+# ADC backend for an MCP3008 on the Pi's SPI bus, wrapping the spidev library. The library is only imported when
+# this backend is created, like RPi.GPIO is by footswitch.RPiGPIOBackend.
+class MCP3008Backend(object):
+    resolution = 10
+
+    def __init__(self, bus=0, device=0, speed=1000000):
+        import spidev
+        self._spi = spidev.SpiDev()
+        self._spi.open(bus, device)
+        self._spi.max_speed_hz = speed
+
+    def read(self, channel):
+        # A single-ended conversion: a start bit, then the channel, then ten bits of result spread over two bytes
+        reply = self._spi.xfer2([1, (8 + channel) << 4, 0])
+        return ((reply[1] & 3) << 8) | reply[2]
+
+    def close(self):
+        self._spi.close()
+
+
+# Simulated ADC used to run the sampler without the hardware. The position of every channel is set from Python,
+# and every reading adds the noise of a real potentiometer and, now and then, a spike.
+class SimulatedADCBackend(object):
+    resolution = 10
+
+    def __init__(self, noise=1.5, spikeRate=0.01, seed=None):
+        self._positions = {}
+        self._noise = noise
+        self._spikeRate = spikeRate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def setPosition(self, channel, position):
+        # Moves a channel to a position from 0 to 1, returning when it was moved
+        with self._lock:
+            self._positions[channel] = position
+        return time.perf_counter()
+
+    def read(self, channel):
+        top = (1 << self.resolution) - 1
+        with self._lock:
+            position = self._positions.get(channel, 0.0)
+        if self._random.random() < self._spikeRate:
+            return self._random.randint(0, top)
+        value = position * top + self._random.gauss(0.0, self._noise)
+        return int(min(max(round(value), 0), top))
+
+    def close(self):
+        pass
+
+
+# The filters of one ADC channel, turning raw readings into a position from 0 to 1
+class ChannelFilter(object):
+    def __init__(self, resolution=10, medianSize=MEDIAN_SIZE, smoothing=SMOOTHING, endDeadband=END_DEADBAND):
+        self._top = float((1 << resolution) - 1)
+        self._readings = collections.deque(maxlen=medianSize)
+        self._smoothing = smoothing
+        self._endDeadband = endDeadband
+        self._average = None
+
+    def add(self, reading):
+        # Takes a raw reading and returns the filtered position
+        self._readings.append(reading)
+        median = sorted(self._readings)[len(self._readings) // 2] / self._top
+        if self._average is None:
+            self._average = median
+        else:
+            self._average += self._smoothing * (median - self._average)
+        # Stretch what is left between the deadbands over the whole range
+        position = (self._average - self._endDeadband) / (1.0 - 2 * self._endDeadband)
+        return min(max(position, 0.0), 1.0)
+
+
+class ExpressionSampler(object):
+    def __init__(self, backend, batcher, names, adcMap=ADC_MAP, rate=SAMPLE_RATE, threshold=THRESHOLD,
+                 filterOptions=None):
+        # names are the effect names in registry order, as the batcher takes effect indexes
+        self._backend = backend
+        self._batcher = batcher
+        self._period = 1.0 / rate
+        self._threshold = threshold
+        self._channels = []
+        for channel, (name, param) in sorted(adcMap.items()):
+            if name not in names:
+                raise ValueError("ADC channel %d is mapped to unknown effect %s" % (channel, name))
+            if param not in PARAMETER_RANGES.get(name, {}):
+                raise ValueError("ADC channel %d is mapped to %s %s, which has no declared range" % (
+                    channel, name, param))
+            low, high = PARAMETER_RANGES[name][param]
+            self._channels.append((channel, names.index(name), param, low, high,
+                                   ChannelFilter(backend.resolution, **(filterOptions or {}))))
+        self._sent = {}
+        self._running = False
+        self._thread = None
+        self.samples = 0
+        self.forwarded = 0
+        self.overruns = 0
+        self.cpuTime = 0.0
+        # Called with the channel and time of every forwarded change, for measuring latency
+        self.onForward = None
+
+    def lastSent(self, channel):
+        # The last position forwarded for a channel, or None before the first
+        return self._sent.get(channel)
+
+    def sample(self):
+        # Reads every channel once and forwards the changes past the threshold, returning how many there were
+        forwarded = 0
+        for channel, index, param, low, high, channelFilter in self._channels:
+            position = channelFilter.add(self._backend.read(channel))
+            last = self._sent.get(channel)
+            # The ends are always sent, so the parameter reaches them however slowly the pedal gets there
+            atEnd = position in (0.0, 1.0) and position != last
+            if last is None or abs(position - last) > self._threshold or atEnd:
+                self._sent[channel] = position
+                self._batcher.set(index, param, low + (high - low) * position)
+                forwarded += 1
+                if self.onForward is not None:
+                    self.onForward(channel, time.perf_counter())
+        self.samples += 1
+        self.forwarded += forwarded
+        return forwarded
+
+    def _run(self):
+        # Samples on a fixed schedule, so a late wake-up doesn't shift every later reading. After a long stall the
+        # schedule restarts from now instead of catching up in a burst.
+        start = time.thread_time()
+        deadline = time.perf_counter()
+        while self._running:
+            self.sample()
+            self.cpuTime = time.thread_time() - start
+            deadline += self._period
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.overruns += 1
+                if delay < -self._period:
+                    deadline = time.perf_counter()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="expression", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._backend.close()
+        return self
+
+
+class _CountingBatcher(object):
+    # Stands in for the ParameterBatcher, keeping the latest value and counting what it was sent
+    def __init__(self):
+        self.values = {}
+        self.received = 0
+
+    def set(self, index, param, value):
+        self.values[(index, param)] = value
+        self.received += 1
+
+
+def measure(rate=SAMPLE_RATE, seconds=3.0, steps=20, buffersize=256, sr=44100):
+    # Runs the sampler on a simulated expression pedal, returning its CPU use while the pedal sweeps and while it
+    # rests, and the latency from moving the pedal until the change reaches the batcher
+    names = [name for name, param in ADC_MAP.values()]
+    backend = SimulatedADCBackend(seed=1)
+    batcher = _CountingBatcher()
+    sampler = ExpressionSampler(backend, batcher, names, rate=rate)
+    results = {}
+
+    # Resting: after the filters settle, noise and spikes alone mustn't forward anything
+    sampler.start()
+    time.sleep(0.5)
+    before = batcher.received
+    wallStart, cpuStart, samplesStart = time.perf_counter(), sampler.cpuTime, sampler.samples
+    time.sleep(seconds)
+    results["restingForwarded"] = batcher.received - before
+    results["restingSamples"] = sampler.samples - samplesStart
+    results["restingCpu"] = (sampler.cpuTime - cpuStart) / (time.perf_counter() - wallStart)
+
+    # Sweeping: the pedal rocks back and forth once a second
+    before, samplesStart = batcher.received, sampler.samples
+    wallStart, cpuStart = time.perf_counter(), sampler.cpuTime
+    while time.perf_counter() - wallStart < seconds:
+        phase = (time.perf_counter() - wallStart) * 2 * math.pi
+        for channel in ADC_MAP:
+            backend.setPosition(channel, 0.5 - 0.5 * math.cos(phase))
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - wallStart
+    results["sweepForwarded"] = batcher.received - before
+    results["sweepSamples"] = sampler.samples - samplesStart
+    results["sweepCpu"] = (sampler.cpuTime - cpuStart) / elapsed
+
+    # Latency: the pedal is stomped from one end to the other, and the time until the first change is forwarded,
+    # and until the forwarded value has settled at the end, is taken
+    forwards = []
+    sampler.onForward = lambda channel, when: forwards.append(when) if channel == 0 else None
+    firsts, settles = [], []
+    for step in range(steps):
+        target = float((step + 1) % 2)
+        del forwards[:]
+        moved = backend.setPosition(0, target)
+        deadline = moved + 1.0
+        while time.perf_counter() < deadline and sampler.lastSent(0) != target:
+            time.sleep(0.0005)
+        if forwards:
+            firsts.append(forwards[0] - moved)
+            settles.append(forwards[-1] - moved)
+        time.sleep(0.05)
+    sampler.stop()
+    results["firstLatency"] = sum(firsts) / len(firsts)
+    results["settleLatency"] = sum(settles) / len(settles)
+    results["worstSettle"] = max(settles)
+    # The batcher applies a change at the start of the next buffer, up to one buffer later
+    results["bufferTime"] = buffersize / float(sr)
+    results["overruns"] = sampler.overruns
+    results["rate"] = rate
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the expression pedal sampler on a simulated ADC")
+    parser.add_argument("--rate", type=int, default=SAMPLE_RATE, help="readings per second of every channel")
+    parser.add_argument("--seconds", type=float, default=3.0, help="seconds to measure resting and sweeping for")
+    parser.add_argument("--buffersize", type=int, default=256)
+    args = parser.parse_args()
+    results = measure(args.rate, args.seconds, buffersize=args.buffersize)
+    print("Sampling %d channels at %d Hz, %d overruns" % (len(ADC_MAP), results["rate"], results["overruns"]))
+    print("Resting: %.2f%% of a core, %d changes forwarded from %d readings" % (
+        results["restingCpu"] * 100, results["restingForwarded"], results["restingSamples"] * len(ADC_MAP)))
+    print("Sweeping: %.2f%% of a core, %d changes forwarded from %d readings" % (
+        results["sweepCpu"] * 100, results["sweepForwarded"], results["sweepSamples"] * len(ADC_MAP)))
+    print("Heel to toe: first change forwarded after %.1f ms, settled after %.1f ms (worst %.1f ms), plus up to "
+          "%.1f ms until the next audio buffer" % (results["firstLatency"] * 1000, results["settleLatency"] * 1000,
+                                                    results["worstSettle"] * 1000, results["bufferTime"] * 1000))
+    if results["restingForwarded"]:
+        print("FAIL: a resting pedal forwarded %d changes" % results["restingForwarded"])
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+# Edge-triggered footswitch handling for the pedal. Instead of polling the buttons every 100 ms, each input pin
+# registers a callback with the GPIO library that fires the moment the pin changes. The callback debounces the
+# mechanical contacts in software and pushes a FootswitchEvent onto a queue, so the main loop can simply block
+# until someone actually stomps on the pedal.
+#
+# The GPIO library itself is hidden behind a small backend class, so the same Footswitch code runs on the Pi
+# (RPiGPIOBackend) and on a plain Linux machine (SimulatedGPIOBackend), where the simulated driver is used to
+# measure how long it takes from a press until the main loop has switched the effect.
+import queue
+import threading
+import time
+
+# Kinds of events put on the queue by the Footswitch
+PRESS = "press"
+RELEASE = "release"
+
+# Default time window in seconds during which further edges on a pin are treated as contact bounce
+DEBOUNCE_TIME = 0.02
+
+
+# GPIO backend for the Raspberry Pi, wrapping the RPi.GPIO library. The library is only imported when this
+# backend is created, so the rest of the pedal code can be loaded on machines without the Pi hardware.
+class RPiGPIOBackend(object):
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self._gpio = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+
+    def setupInput(self, pin):
+        # Setting the internal resistors on the given GPIO pins to pull low,
+        # so that the program responds correctly when a high signal is emitted by a button press
+        self._gpio.setup(pin, self._gpio.IN, pull_up_down=self._gpio.PUD_DOWN)
+
+    def setupOutput(self, pin):
+        self._gpio.setup(pin, self._gpio.OUT)
+
+    def read(self, pin):
+        return self._gpio.input(pin) == self._gpio.HIGH
+
+    def write(self, pin, value):
+        self._gpio.output(pin, self._gpio.HIGH if value else self._gpio.LOW)
+
+    def watch(self, pin, callback):
+        # RPi.GPIO calls the edge callback from its own thread with the channel number only, so the pin level
+        # is read back inside the callback to tell presses and releases apart
+        def onEdge(channel):
+            callback(channel, self.read(channel))
+        self._gpio.add_event_detect(pin, self._gpio.BOTH, callback=onEdge)
+
+    def cleanup(self):
+        self._gpio.cleanup()
+
+
+# Simulated GPIO backend used to run the pedal logic without a Raspberry Pi. Pin levels are set from Python,
+# and edge callbacks fire synchronously from the thread that changes the level, just like RPi.GPIO fires them
+# from its own event thread. Presses can include a burst of contact bounce to exercise the debouncing.
+class SimulatedGPIOBackend(object):
+    def __init__(self):
+        self._levels = {}
+        self._outputs = {}
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def setupInput(self, pin):
+        self._levels[pin] = False
+
+    def setupOutput(self, pin):
+        self._outputs[pin] = False
+
+    def read(self, pin):
+        return self._levels.get(pin, False)
+
+    def write(self, pin, value):
+        self._outputs[pin] = bool(value)
+
+    def output(self, pin):
+        # Returns the last value written to an output pin, such as the LED
+        return self._outputs.get(pin, False)
+
+    def watch(self, pin, callback):
+        self._callbacks[pin] = callback
+
+    def cleanup(self):
+        self._callbacks = {}
+
+    def setLevel(self, pin, level):
+        # Changes the level of an input pin and fires its edge callback if the level actually changed
+        with self._lock:
+            if self._levels.get(pin, False) == level:
+                return
+            self._levels[pin] = level
+            callback = self._callbacks.get(pin)
+        if callback is not None:
+            callback(pin, level)
+
+    def press(self, pin, bounces=0, bounceInterval=0.001):
+        # Simulates pushing a button down, optionally chattering a few times before settling high.
+        # Returns the time of the first edge, which is when the player actually pressed the button.
+        pressTime = time.perf_counter()
+        for i in range(bounces):
+            self.setLevel(pin, True)
+            time.sleep(bounceInterval)
+            self.setLevel(pin, False)
+            time.sleep(bounceInterval)
+        self.setLevel(pin, True)
+        return pressTime
+
+    def release(self, pin, bounces=0, bounceInterval=0.001):
+        releaseTime = time.perf_counter()
+        for i in range(bounces):
+            self.setLevel(pin, False)
+            time.sleep(bounceInterval)
+            self.setLevel(pin, True)
+            time.sleep(bounceInterval)
+        self.setLevel(pin, False)
+        return releaseTime
+
+
+# A debounced button event. The timestamp is taken inside the edge callback, so the time between it and the
+# moment the main loop finishes handling the event is the press-to-switch latency of the pedal.
+class FootswitchEvent(object):
+    def __init__(self, pin, kind, timestamp, duration=0.0):
+        self.pin = pin
+        self.kind = kind
+        self.timestamp = timestamp
+        # For releases, how long the button was held down
+        self.duration = duration
+
+    def __repr__(self):
+        return "FootswitchEvent(pin=%d, kind=%s, duration=%.3f)" % (self.pin, self.kind, self.duration)
+
+
+# The Footswitch watches a set of input pins through the given backend and turns their raw edges into
+# debounced press and release events on a queue. The main loop blocks in waitForEvent() until an event arrives,
+# so the Pi sleeps while nobody touches the pedal.
+class Footswitch(object):
+    def __init__(self, backend, pins, debounce=DEBOUNCE_TIME, maxLatencySamples=1000):
+        self._backend = backend
+        self._pins = list(pins)
+        self._debounce = debounce
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+        # Debounced state of each pin, along with when it last changed state
+        self._pressed = {}
+        self._lastEdge = {}
+        self._pressStart = {}
+        # Timers reading a pin again once the debounce window of its last accepted edge is over
+        self._resamplers = {}
+
+        # Press-to-switch latencies reported back by eventHandled(), in seconds
+        self._latencies = []
+        self._maxLatencySamples = maxLatencySamples
+
+        for pin in self._pins:
+            self._backend.setupInput(pin)
+            self._pressed[pin] = self._backend.read(pin)
+            self._lastEdge[pin] = 0.0
+            self._pressStart[pin] = 0.0
+            self._backend.watch(pin, self._onEdge)
+
+    def _onEdge(self, pin, level):
+        # Called from the GPIO event thread for every raw edge. Edges that arrive within the debounce window of
+        # the last accepted edge are contact bounce and get dropped, as do edges that don't change the state. The
+        # pin is read again once the window is over, so a tap shorter than the window still gets its release.
+        now = time.perf_counter()
+        with self._lock:
+            if level == self._pressed[pin]:
+                return
+            wait = self._lastEdge[pin] + self._debounce - now
+            if wait > 0:
+                if pin not in self._resamplers:
+                    timer = threading.Timer(wait, self._resample, args=(pin,))
+                    timer.daemon = True
+                    self._resamplers[pin] = timer
+                    timer.start()
+                return
+            event = self._accept(pin, level, now)
+        self._queue.put(event)
+
+    def _resample(self, pin):
+        # Called from a timer at the end of a debounce window in which edges were dropped, with the level the pin
+        # has settled on
+        with self._lock:
+            self._resamplers.pop(pin, None)
+            level = self._backend.read(pin)
+            if level == self._pressed[pin]:
+                return
+            event = self._accept(pin, level, time.perf_counter())
+        self._queue.put(event)
+
+    def _accept(self, pin, level, now):
+        # Moves a pin to a new debounced state, returning its event. Called with the lock held.
+        self._pressed[pin] = level
+        self._lastEdge[pin] = now
+        if level:
+            self._pressStart[pin] = now
+            return FootswitchEvent(pin, PRESS, now)
+        return FootswitchEvent(pin, RELEASE, now, now - self._pressStart[pin])
+
+    def waitForEvent(self, timeout=None):
+        # Blocks until the next debounced event arrives, returning None if the timeout runs out first
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def post(self, event):
+        # Puts an event from another control surface, like the control server, on the queue, so the main loop
+        # handles it in order with the button presses
+        self._queue.put(event)
+
+    def isPressed(self, pin):
+        return self._pressed[pin]
+
+    def eventHandled(self, event):
+        # Called by the main loop once it has acted upon an event, to record the press-to-switch latency
+        latency = time.perf_counter() - event.timestamp
+        with self._lock:
+            self._latencies.append(latency)
+            if len(self._latencies) > self._maxLatencySamples:
+                del self._latencies[0]
+        return latency
+
+    def latencyStats(self):
+        # Returns the minimum, mean and maximum press-to-switch latency in seconds, or None before any presses
+        with self._lock:
+            latencies = list(self._latencies)
+        if not latencies:
+            return None
+        return {"count": len(latencies), "min": min(latencies), "mean": sum(latencies) / len(latencies),
+                "max": max(latencies)}
+
+    def close(self):
+        with self._lock:
+            for timer in self._resamplers.values():
+                timer.cancel()
+            self._resamplers = {}
+        self._backend.cleanup()
+
+
+# Presses a simulated button a number of times while a handler thread drains the Footswitch queue like the
+# main loop does, and returns the press-to-switch latency statistics. The handler is called with every
+# event so a caller can plug in its own effect-switching code.
+def measureLatency(handler=None, presses=50, bounces=3, pin=17, interval=0.05):
+    backend = SimulatedGPIOBackend()
+    footswitch = Footswitch(backend, [pin])
+
+    def handleEvents():
+        while True:
+            event = footswitch.waitForEvent()
+            if event is None or event.pin < 0:
+                return
+            if event.kind == PRESS:
+                if handler is not None:
+                    handler(event)
+                footswitch.eventHandled(event)
+
+    handlerThread = threading.Thread(target=handleEvents, daemon=True)
+    handlerThread.start()
+    for i in range(presses):
+        backend.press(pin, bounces=bounces)
+        time.sleep(interval)
+        backend.release(pin, bounces=bounces)
+        time.sleep(interval)
+    # A negative pin number tells the handler thread to stop
+    footswitch.post(FootswitchEvent(-1, RELEASE, 0.0))
+    handlerThread.join()
+    return footswitch.latencyStats()
+
+
+def checkShortTap(pin=17, tap=0.005):
+    # Taps a simulated button for less than the debounce window and checks that both the press and the release
+    # come through, and that the next press isn't swallowed. Returns the failures.
+    backend = SimulatedGPIOBackend()
+    footswitch = Footswitch(backend, [pin])
+    failures = []
+    backend.press(pin)
+    time.sleep(tap)
+    backend.release(pin)
+    kinds = [getattr(footswitch.waitForEvent(timeout=1.0), "kind", None) for i in range(2)]
+    if kinds != [PRESS, RELEASE]:
+        failures.append("a %.0f ms tap gave %s instead of a press and a release" % (tap * 1000, kinds))
+    time.sleep(DEBOUNCE_TIME)
+    backend.press(pin)
+    event = footswitch.waitForEvent(timeout=1.0)
+    if event is None or event.kind != PRESS:
+        failures.append("the press after a short tap was swallowed")
+    footswitch.close()
+    return failures
+
+
+if __name__ == "__main__":
+    stats = measureLatency()
+    print("Press-to-switch latency over %d presses: min %.3f ms, mean %.3f ms, max %.3f ms"
+          % (stats["count"], stats["min"] * 1000, stats["mean"] * 1000, stats["max"] * 1000))
+    failures = checkShortTap()
+    for failure in failures:
+        print("FAIL: %s" % failure)
+    if failures:
+        raise SystemExit(1)
+    print("A tap shorter than the debounce window gives a press and a release")
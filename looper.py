@@ -0,0 +1,453 @@
+# A looper for the pedal, which records a phrase, plays it back over and over and lets more be overdubbed on top of
+# it. Its buffer is a single NewTable allocated for the longest loop when the looper is built, so recording,
+# overdubbing and playing never allocate memory, and a long gig doesn't fragment the Pi's.
+#
+# The position in the loop is a Count, an integer sample counter that wraps at the loop length, where a Phasor would
+# drift as the float build of pyo keeps its phase in single precision. The same position drives a TableIndex reading
+# the loop back and a TableWrite writing into it. The reader comes first in the server's processing order, so every
+# sample is read before it is written over, and the write mixes the input with what the table held, weighted by the
+# table's feedback: none for the first recording, which wipes out the loop before it, and all of it for an
+# overdub, which adds to the loop in place. While the first recording runs, the counter isn't wrapped yet and counts
+# on; writes past the end of the table are dropped by TableWrite, and the loop is closed as soon as the counter gets
+# there, so a recording that runs too long can't wrap around over its own start.
+#
+# The looper goes through these states, stepped by the footswitches of the pedal in its looper mode:
+#
+# - empty: nothing recorded, nothing computing
+# - recording: the first pass, which sets the length of the loop when it is closed
+# - playing: the loop plays, faded in so it starts without a click
+# - overdubbing: the loop plays and the input is added to it
+# - stopped: the loop is faded out and its reader stopped, but kept for playing again
+#
+# A loop can be exported to a WAV file on a thread of its own, which reads the table a second at a time and writes
+# it out as 16-bit PCM, so the export only holds on to a second of samples, and the audio thread, which needs the
+# GIL for the pedal's Python callbacks, is only ever kept waiting for one block. The audio thread notices the end of
+# the first recording and of a fade out, and it never waits for the lock the main thread holds while stepping the
+# looper: when the lock is taken, it tries again a buffer or a fade later, on CallAfters built with the looper.
+#
+# Running this file records, plays and overdubs a synthetic DI track on the offline server, checks the loop sample
+# for sample, and reports the memory the buffer takes and that none more is taken while looping.
+#
+#     python buttonWithSFX.py --looper after --loop-time 30 --loop-dir ~/loops
+#     python looper.py --max-time 60
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import wave
+
+from pyo import CallAfter, Count, NewTable, Select, Sig, SigTo, TableIndex, TableWrite, Trig, TrigFunc
+
+from measurements import formatBytes, peakMemory, residentMemory
+
+# Seconds of the longest loop, the length of the buffer allocated up front
+LOOP_TIME = 60.0
+
+# Seconds the loop fades in and out over when it starts and stops playing
+LOOP_FADE_TIME = 0.01
+
+# Share of the loop kept on every overdub, 1 keeping it all
+OVERDUB_FEEDBACK = 1.0
+
+# Samples exported per block
+EXPORT_BLOCK = 44100
+
+# Resident memory the check lets the process grow by between the first stomp and the last, for the pages Python and
+# pyo touch on their own
+MAX_GROWTH = 1024 * 1024
+
+# The loop position is a float stream, exact up to this many samples
+MAX_LOOP_SAMPLES = 2 ** 24
+
+EMPTY = "empty"
+RECORDING = "recording"
+PLAYING = "playing"
+OVERDUBBING = "overdubbing"
+STOPPED = "stopped"
+
+
+class Looper(object):
+    def __init__(self, input, maxTime=LOOP_TIME, fadetime=LOOP_FADE_TIME, feedback=OVERDUB_FEEDBACK):
+        # input is the signal recorded into the loop, maxTime the longest loop in seconds
+        self._input = input
+        self._fadetime = fadetime
+        self._feedback = feedback
+        self.table = NewTable(maxTime)
+        self.size = self.table.getSize()
+        self.sr = int(self.table.getServer().getSamplingRate())
+        if self.size >= MAX_LOOP_SAMPLES:
+            raise ValueError("loops longer than %.0f s can't be indexed exactly" % (MAX_LOOP_SAMPLES / float(self.sr)))
+
+        self._restart = Trig()
+        # A maximum of 0 leaves the counter unwrapped, as it is while the first recording runs
+        self._position = Count(self._restart, min=0, max=0)
+        self._gain = SigTo(0, time=fadetime)
+        self._reader = TableIndex(self.table, self._position, mul=self._gain)
+        self._writer = TableWrite(input, self._position, self.table, mode=1, maxwindow=1)
+        self._full = TrigFunc(Select(self._position, value=self.size), self._recordingFull)
+        self._output = None
+        self._outChnl = None
+        # Built once and started again on every stop, and on every retry of the end of the first recording
+        server = self.table.getServer()
+        self._fade = CallAfter(self._faded, time=fadetime + 0.01)
+        self._fullRetry = CallAfter(self._recordingFull, time=server.getBufferSize() / float(self.sr))
+        for obj in (self._restart, self._position, self._reader, self._writer, self._full, self._fade,
+                    self._fullRetry):
+            obj.stop()
+
+        self.state = EMPTY
+        self.length = 0
+        self._lock = threading.RLock()
+
+    @property
+    def playback(self):
+        # The loop alone, for sending out after the effects
+        return self._reader
+
+    @property
+    def output(self):
+        # The input with the loop played over it, for feeding the effects. Only built when asked for.
+        if self._output is None:
+            self._output = Sig(self._input, add=self._reader)
+        return self._output
+
+    def out(self, chnl=0):
+        # Sends the loop alone to the sound card while it plays, for a looper after the effects
+        self._outChnl = chnl
+        return self
+
+    @property
+    def seconds(self):
+        return self.length / float(self.sr)
+
+    def record(self):
+        # Starts a new loop, replacing the one before it
+        with self._lock:
+            self._cancelFade()
+            self._fullRetry.stop()
+            self._gain.setValue(0)
+            self.table.setFeedback(0)
+            self._position.setMax(0)
+            for obj in (self._position, self._writer, self._full, self._restart):
+                obj.play()
+            self.length = 0
+            self.state = RECORDING
+
+    def play(self):
+        # Closes the first recording, ends an overdub, or plays a stopped loop again from its start
+        with self._lock:
+            if self.state == RECORDING:
+                self._close()
+            elif self.state == OVERDUBBING:
+                self._writer.stop()
+            elif self.state == STOPPED:
+                self._cancelFade()
+                self._position.play()
+                self._startReader()
+                self._restart.play()
+            else:
+                return
+            if self.state != EMPTY:
+                self._gain.setValue(1)
+                self.state = PLAYING
+
+    def overdub(self):
+        # Adds the input to the playing loop
+        with self._lock:
+            if self.state == STOPPED:
+                self.play()
+            if self.state == PLAYING:
+                self.table.setFeedback(self._feedback)
+                self._writer.play()
+                self.state = OVERDUBBING
+
+    def stop(self):
+        # Fades the loop out and stops it, keeping it to play again
+        with self._lock:
+            if self.state == RECORDING:
+                self.play()
+            if self.state not in (PLAYING, OVERDUBBING):
+                return
+            self._writer.stop()
+            self._gain.setValue(0)
+            self._fade.play()
+            self.state = STOPPED
+
+    def clear(self):
+        # Forgets the loop. The table isn't wiped, as the next recording writes over it anyway.
+        with self._lock:
+            self._cancelFade()
+            self._gain.setValue(0)
+            for obj in (self._position, self._reader, self._writer, self._full, self._fullRetry):
+                obj.stop()
+            self.length = 0
+            self.state = EMPTY
+
+    def cycle(self):
+        # The record footswitch: record, then play, then overdub and play in turn, or play again once stopped
+        with self._lock:
+            if self.state == EMPTY:
+                self.record()
+            elif self.state == PLAYING:
+                self.overdub()
+            else:
+                self.play()
+            return self.state
+
+    def stopOrClear(self):
+        # The stop footswitch: stops the loop, or forgets it once stopped
+        with self._lock:
+            if self.state == STOPPED:
+                self.clear()
+            else:
+                self.stop()
+            return self.state
+
+    def _close(self):
+        # Sets the loop length to what the first recording wrote, up to the last sample of the last buffer
+        # computed, which is the one the counter reports, and restarts the counter from the top of the loop with
+        # the next buffer
+        self._full.stop()
+        self._fullRetry.stop()
+        self._writer.stop()
+        self.length = min(int(self._position.get()) + 1, self.size)
+        if self.length < 2:
+            self.clear()
+            return
+        self._position.setMax(self.length - 1)
+        self._restart.play()
+        self._startReader()
+
+    def _startReader(self):
+        if self._outChnl is None:
+            self._reader.play()
+        else:
+            self._reader.out(self._outChnl)
+
+    def _recordingFull(self):
+        # Called from the audio thread when the first recording reaches the end of the table. The main thread holds
+        # the lock across its pyo calls, so rather than wait for it, the audio thread tries again a buffer later.
+        if not self._lock.acquire(False):
+            self._fullRetry.play()
+            return
+        try:
+            if self.state == RECORDING:
+                self.play()
+        finally:
+            self._lock.release()
+
+    def _faded(self):
+        # Called from the audio thread once the loop has faded out, and again a fade later if the lock is taken.
+        # Playing, recording or clearing the loop in between cancels it.
+        if not self._lock.acquire(False):
+            self._fade.play()
+            return
+        try:
+            if self.state == STOPPED:
+                self._position.stop()
+                self._reader.stop()
+        finally:
+            self._lock.release()
+
+    def _cancelFade(self):
+        self._fade.stop()
+
+    def export(self, path):
+        # Writes the loop to a WAV file on a thread of its own, returning the thread. Exporting while overdubbing
+        # gets whatever the table holds as each block is written.
+        with self._lock:
+            length = self.length
+        thread = threading.Thread(target=exportTable, args=(self.table, length, path, self.sr), name="Loop export")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def exportTable(table, length, path, sr, block=EXPORT_BLOCK):
+    # Writes the first length samples of a table to path as a mono 16-bit WAV, a block at a time
+    import numpy
+    samples = numpy.asarray(table.getBuffer())
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with wave.open(path, "wb") as output:
+        output.setnchannels(1)
+        output.setsampwidth(2)
+        output.setframerate(sr)
+        for start in range(0, length, block):
+            chunk = numpy.clip(samples[start:min(start + block, length)], -1.0, 1.0)
+            output.writeframes((chunk * 32767).astype("<i2").tobytes())
+    return path
+
+
+def loopPath(directory):
+    # A file name for a new loop in directory, from the time it was exported
+    return os.path.join(directory, time.strftime("loop-%Y%m%d-%H%M%S.wav"))
+
+
+def _probeExport(looper, path, interval=0.001):
+    # Exports the loop while another thread wakes up every interval, returning the export time and the longest the
+    # waking thread was held off, which is how long a Python callback of the audio thread could have waited
+    late = [0.0]
+    done = threading.Event()
+
+    def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            time.sleep(interval)
+            late[0] = max(late[0], time.perf_counter() - start - interval)
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    start = time.perf_counter()
+    looper.export(path).join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    prober.join()
+    return elapsed, late[0]
+
+
+def _matchOffset(loop, recorded, near, window):
+    # The offset into recorded where loop starts, searched within window samples of near, or None
+    import numpy
+    for offset in range(max(near - window, 0), near + window + 1):
+        if numpy.array_equal(loop, recorded[offset:offset + len(loop)]):
+            return offset
+    return None
+
+
+def check(maxTime=LOOP_TIME, sr=44100, buffersize=256):
+    # Records a loop of a synthetic DI track on the offline server, plays and overdubs it and stops it, and fills a
+    # second, short looper to its end, returning the failures found and the measurements
+    import numpy
+    from pyo import Server, SfPlayer, TableRec
+    from benchmark import writeSyntheticDI
+    schedule = {"record": 0.5, "play": 2.5, "overdub": 4.5, "replay": 6.0, "stop": 7.0}
+    dur = 7.5
+    directory = tempfile.mkdtemp()
+    failures = []
+    results = {}
+    server = Server(sr=sr, buffersize=buffersize, audio="offline", nchnls=1)
+    server.setVerbosity(0)
+    server.boot()
+    try:
+        server.recordOptions(dur=dur, filename=os.path.join(directory, "render.wav"))
+        di = SfPlayer(writeSyntheticDI(os.path.join(directory, "di.wav"), dur=dur, sr=sr))
+        before = residentMemory()
+        looper = Looper(di, maxTime=maxTime)
+        results["buffer"] = residentMemory() - before
+        short = Looper(di, maxTime=1.0)
+        # The input, the loop position and the loop played back, recorded alongside for checking
+        tables = [NewTable(dur) for i in range(3)]
+        recorders = [TableRec(signal, table).play()
+                     for signal, table in zip((di, looper._position, looper.playback), tables)]
+        # Filled rather than zeroed, as zeroed pages only become resident once written, on the stomp
+        firstPass = numpy.full(looper.size, 0.0, dtype=numpy.float32)
+        memory = []
+
+        def stomp(action):
+            if action == "overdub":
+                firstPass[:] = numpy.asarray(looper.table.getBuffer())[:looper.size]
+            {"record": looper.record, "play": looper.play, "overdub": looper.overdub, "replay": looper.play,
+             "stop": looper.stop}[action]()
+            memory.append(residentMemory())
+
+        calls = [CallAfter(lambda action=action: stomp(action), time=at) for action, at in schedule.items()]
+        calls.append(CallAfter(short.record, time=schedule["record"]))
+        server.start()
+
+        recorded, position, played = [numpy.asarray(table.getTable(), dtype=numpy.float32) for table in tables]
+        loop = numpy.asarray(looper.table.getBuffer())[:looper.size]
+        length = looper.length
+        results["length"] = length
+        results["growth"] = max(memory) - memory[0]
+        results["peak"] = peakMemory()
+        block = int(schedule["record"] * sr)
+
+        if results["growth"] > MAX_GROWTH:
+            failures.append("%s more memory was taken while looping" % formatBytes(results["growth"]))
+
+        # The first pass holds the input from the stomp on, sample for sample
+        recordStart = _matchOffset(firstPass[:length], recorded, block, 2 * buffersize)
+        if abs(length - (schedule["play"] - schedule["record"]) * sr) > 2 * buffersize:
+            failures.append("the loop is %d samples long for a %.1f s recording" % (
+                length, schedule["play"] - schedule["record"]))
+        if recordStart is None:
+            failures.append("the recorded loop doesn't match the input")
+
+        # Once closed, the position runs round the loop without a gap
+        closed = int(schedule["play"] * sr) + 2 * buffersize
+        stopped = int(schedule["stop"] * sr)
+        steps = numpy.diff(position[closed:stopped].astype(numpy.int64)) % length
+        if numpy.any(steps != 1) or position[closed:stopped].max() != length - 1:
+            failures.append("the loop position doesn't wrap at the loop length")
+
+        # The overdub added the input into the loop in place, at the positions it was played at
+        dubStart = int(schedule["overdub"] * sr) // buffersize * buffersize
+        dubEnd = int(schedule["replay"] * sr) // buffersize * buffersize
+        window = 2 * buffersize
+        matched = False
+        for start in range(dubStart - window, dubStart + window + 1, buffersize):
+            for end in range(dubEnd - window, dubEnd + window + 1, buffersize):
+                expected = firstPass[:length].copy()
+                indexes = position[start:end].astype(numpy.int64)
+                expected[indexes] = recorded[start:end] + expected[indexes]
+                if numpy.allclose(expected, loop[:length], atol=1e-6, rtol=0):
+                    matched = True
+                    break
+            if matched:
+                break
+        if not matched:
+            failures.append("the overdub doesn't add the input into the loop in place")
+
+        # The loop is heard while playing and silent once it has faded out
+        if not numpy.any(played[closed:closed + length]):
+            failures.append("the loop didn't play back")
+        if numpy.any(played[stopped + int(0.05 * sr):]):
+            failures.append("the loop still plays after being stopped")
+
+        # A recording longer than the buffer is closed at its end, without writing over its start
+        if short.state != PLAYING or short.length != short.size:
+            failures.append("a recording running past the end of the buffer was left %s with %d of %d samples" % (
+                short.state, short.length, short.size))
+        shortStart = _matchOffset(numpy.asarray(short.table.getBuffer())[:short.size], recorded, block,
+                                  2 * buffersize)
+        if shortStart is None:
+            failures.append("the recording that filled the buffer wrote over its own start")
+
+        # The export, read back, holds the loop
+        path = os.path.join(directory, "loops", "loop.wav")
+        results["exportTime"], results["exportHold"] = _probeExport(looper, path)
+        with wave.open(path, "rb") as exported:
+            frames = numpy.frombuffer(exported.readframes(exported.getnframes()), dtype="<i2")
+        if len(frames) != length or numpy.max(numpy.abs(frames / 32767.0 - numpy.clip(loop[:length], -1, 1))) > 1e-4:
+            failures.append("the exported loop doesn't match the loop")
+        del recorders, calls
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory)
+    return failures, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the looper on the offline server")
+    parser.add_argument("--max-time", type=float, default=LOOP_TIME, help="seconds of the longest loop")
+    parser.add_argument("--buffersize", type=int, default=256)
+    parser.add_argument("--sr", type=int, default=44100)
+    args = parser.parse_args()
+    failures, results = check(args.max_time, args.sr, args.buffersize)
+    print("Buffer for %.0f s loops: %s, allocated up front" % (args.max_time, formatBytes(results["buffer"])))
+    print("Looped %.3f s: %s more resident memory from the first stomp to the last, %s peak" % (
+        results["length"] / float(args.sr), formatBytes(results["growth"]), formatBytes(results["peak"])))
+    print("Exported in %.1f ms, other threads held off for at most %.1f ms" % (
+        results["exportTime"] * 1000, results["exportHold"] * 1000))
+    for failure in failures:
+        print(failure)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# Small helpers for measuring the pedal's memory use, shared by the startup report and the benchmarks.
+# Resident memory is read from /proc on Linux (the Raspberry Pi included) and falls back to the peak
+# resident size reported by the resource module elsewhere.
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def residentMemory():
+    # Current resident set size of this process in bytes
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peakMemory()
+
+
+def peakMemory():
+    # Peak resident set size of this process in bytes, or 0 where it can't be measured
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+def formatBytes(count):
+    return "%.1f MB" % (count / (1024.0 * 1024.0))
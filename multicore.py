@@ -0,0 +1,501 @@
+# Multi-core execution for the pedal. The pyo server computes every object on a single audio thread, so a few heavy
+# effects like the Leslie speaker and the Reverb fill one core of the Pi while the other three sit idle. The
+# WorkerPool spreads the effect chains over worker processes instead, each running its own pyo server in manual
+# mode, and hands audio back and forth through ring buffers in shared memory.
+#
+# Once per buffer, the main server hands the input block it captured during the last buffer to every worker, then
+# waits for them to send back one block per effect chain, which it plays during this buffer. The workers compute
+# their chains side by side on separate cores while the main server waits, and an effect is heard exactly one buffer
+# later than it would be in the main server. A worker that misses its deadline is counted as late and its chains
+# play silence for that buffer, so a slow worker can't stall the main server.
+#
+# In the pedal, every chain of the pool stands in for an EffectChain, with its parameters set through the pool, so
+# the registry, the presets and the signal graph work the same either way:
+#
+#     python buttonWithSFX.py --workers 3
+#
+# Run on its own, this checks that the pool gives the same output as the main server one buffer later, and then
+# compares how many effects can play at once before dropouts with and without worker processes:
+#
+#     python multicore.py [--workers 3] [--dur 2] [--buffersize 256]
+import argparse
+import collections
+import contextlib
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy
+
+from effects import EFFECTS, RAMP_TIME, Parameter, declareRanges
+
+# Frames a ring buffer holds
+RING_BLOCKS = 4
+
+# Share of a buffer the main server waits for the workers, leaving the rest for its own processing
+DEADLINE = 0.75
+
+# How long an idle worker waits for an input block before checking whether it should quit
+IDLE_TIMEOUT = 0.25
+
+# How long the workers get to build their effects and report back
+STARTUP_TIMEOUT = 60.0
+
+# The heavy effects the benchmark stacks up, in turn
+BENCHMARK_EFFECTS = ["Leslie Speaker", "Reverb"]
+
+
+# A single-producer, single-consumer ring of audio frames in shared memory. Each frame holds a sequence number, a
+# count of the commands sent before it, and lanes blocks of float32 samples. Two semaphores count the filled and the
+# free slots, so the consumer can sleep until a frame comes in, while the producer never blocks: pushing into a full
+# ring drops the frame.
+class RingBuffer(object):
+    def __init__(self, lanes, buffersize, slots=RING_BLOCKS, context=None):
+        context = context or multiprocessing.get_context("spawn")
+        self.lanes = lanes
+        self.buffersize = buffersize
+        self.slots = slots
+        self._owner = True
+        self._memory = shared_memory.SharedMemory(create=True, size=slots * (16 + 4 * lanes * buffersize))
+        self._filled = context.Semaphore(0)
+        self._free = context.Semaphore(slots)
+        self._map()
+
+    def _map(self):
+        self._seq = numpy.ndarray((self.slots, 2), dtype=numpy.int64, buffer=self._memory.buf)
+        self._data = numpy.ndarray((self.slots, self.lanes, self.buffersize), dtype=numpy.float32,
+                                   buffer=self._memory.buf, offset=16 * self.slots)
+        # Command count of the last frame popped
+        self.commands = 0
+        # Each side only ever moves its own end of the ring
+        self._head = 0
+        self._tail = 0
+
+    def __getstate__(self):
+        return (self._memory.name, self.lanes, self.buffersize, self.slots, self._filled, self._free)
+
+    def __setstate__(self, state):
+        name, self.lanes, self.buffersize, self.slots, self._filled, self._free = state
+        self._owner = False
+        self._memory = shared_memory.SharedMemory(name=name)
+        self._map()
+
+    def push(self, lanes, seq, commands=0):
+        # Copies one block per lane into the next free slot, returning False if the ring was full
+        if not self._free.acquire(False):
+            return False
+        slot = self._data[self._head]
+        for index, lane in enumerate(lanes):
+            slot[index] = lane
+        self._seq[self._head] = (seq, commands)
+        self._head = (self._head + 1) % self.slots
+        self._filled.release()
+        return True
+
+    def pop(self, out, timeout=None):
+        # Copies the oldest frame into out, returning its sequence number, or None if nothing came in time
+        if not self._filled.acquire(timeout=timeout):
+            return None
+        out[...] = self._data[self._tail].reshape(out.shape)
+        seq, self.commands = (int(value) for value in self._seq[self._tail])
+        self._tail = (self._tail + 1) % self.slots
+        self._free.release()
+        return seq
+
+    def close(self):
+        # Drops this side's view of the shared memory, which the side that made the ring also frees
+        self._seq = self._data = None
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
+
+
+# Reads a DataTable back one buffer at a time, so whatever was copied into the table before a buffer is played
+# sample for sample during it
+def _blockReader(table, sr, buffersize):
+    from pyo import Osc
+    return Osc(table, freq=float(sr) / buffersize, phase=(buffersize - 1.0) / buffersize, interp=1)
+
+
+def _runWorker(names, sr, buffersize, bpm, inbox, outbox, commands, ready, stopping):
+    # Body of a worker process: builds the effects it was given on a manual pyo server, and computes one buffer
+    # of them for every input block that comes in
+    from pyo import DataTable, Mix, Server, TableFill
+    server = Server(sr=sr, buffersize=buffersize, audio="manual", nchnls=1, ichnls=1)
+    server.setVerbosity(0)
+    server.boot()
+    server.start()
+    inTable = DataTable(buffersize)
+    inBuffer = numpy.asarray(inTable.getBuffer())
+    source = _blockReader(inTable, sr, buffersize)
+    clock = None
+    if bpm is not None:
+        from tempo import TempoClock
+        clock = TempoClock(bpm)
+    factories = dict(EFFECTS)
+    chains, mixes, fills, lanes = [], [], [], []
+    for name in names:
+        chain = factories[name](source) if clock is None else factories[name](source, clock=clock)
+        chain.stop()
+        table = DataTable(buffersize)
+        mix = Mix(chain.output, voices=1).stop()
+        chains.append(chain)
+        mixes.append(mix)
+        fills.append(TableFill(mix, table).stop())
+        lanes.append(numpy.asarray(table.getBuffer()))
+    ready.put([chain.parameterValues() for chain in chains])
+
+    applied = 0
+    while not stopping.is_set():
+        seq = inbox.pop(inBuffer, IDLE_TIMEOUT)
+        if seq is None:
+            continue
+        # Every block says how many commands were sent before it, and those are applied before it is computed, so
+        # a chain starts playing on the very block it was started for
+        while applied < inbox.commands and not stopping.is_set():
+            try:
+                command = commands.get(timeout=IDLE_TIMEOUT)
+            except queue.Empty:
+                continue
+            applied += 1
+            kind, args = command[0], command[1:]
+            if kind == "play":
+                for obj in (chains[args[0]], mixes[args[0]], fills[args[0]]):
+                    obj.play()
+            elif kind == "stop":
+                for obj in (fills[args[0]], mixes[args[0]], chains[args[0]]):
+                    obj.stop()
+                lanes[args[0]][:] = 0
+            elif kind == "param":
+                chains[args[0]].setParameter(*args[1:])
+            elif kind == "bpm" and clock is not None:
+                clock.setBpm(args[0])
+        server.process()
+        outbox.push(lanes, seq)
+    server.stop()
+    server.shutdown()
+    inbox.close()
+    outbox.close()
+
+
+@contextlib.contextmanager
+def _hiddenMain():
+    # The pedal script has no __main__ guard, and a spawned process would run it all over again while importing
+    # it, so the script is hidden from multiprocessing while the workers start. The workers only need this module.
+    main = sys.modules["__main__"]
+    path = getattr(main, "__file__", None)
+    if path is not None:
+        del main.__file__
+    try:
+        yield
+    finally:
+        if path is not None:
+            main.__file__ = path
+
+
+# Stands in for an EffectChain built in a worker process. Playing, stopping and parameter changes are sent to the
+# worker, and output is the stream the main server plays the chain's blocks back from.
+class RemoteChain(object):
+    def __init__(self, pool, name, worker, lane, output, values):
+        self.name = name
+        self.output = output
+        self.input = None
+        self.parameters = collections.OrderedDict(
+            (param, Parameter(param, None, value, smooth=False)) for param, value in values.items())
+        declareRanges(name, self.parameters.values())
+        self._pool = pool
+        self._worker = worker
+        self._lane = lane
+        self._playing = False
+
+    def play(self, dur=0, delay=0):
+        self._pool._send(self._worker, ("play", self._lane))
+        self.output.play(dur, delay)
+        self._playing = True
+        return self
+
+    def out(self, chnl=0, inc=1, dur=0, delay=0):
+        self._pool._send(self._worker, ("play", self._lane))
+        self.output.out(chnl, inc, dur, delay)
+        self._playing = True
+        return self
+
+    def stop(self, wait=0):
+        self.output.stop(wait)
+        self._pool._send(self._worker, ("stop", self._lane))
+        self._playing = False
+        return self
+
+    def objects(self, exclude=()):
+        return [self.output]
+
+    def isPlaying(self):
+        return self._playing
+
+    def parameterValues(self):
+        return dict((name, param.value) for name, param in self.parameters.items())
+
+    def setParameter(self, name, value, time=RAMP_TIME):
+        # Same contract as EffectChain.setParameter(), with the ramp running in the worker
+        param = self.parameters.get(name)
+        if param is None:
+            raise ValueError("%s has no parameter %s" % (self.name, name))
+        value = param.clamp(value)
+        if value == param.value:
+            return False
+        self._pool._send(self._worker, ("param", self._lane, name, value, time))
+        param.value = value
+        return True
+
+
+class WorkerPool(object):
+    def __init__(self, input, names=None, workers=None, sr=44100, buffersize=256, clock=None, deadline=DEADLINE):
+        # input is the guitar signal in the main server, names the effects to build, one chain each, dealt out to
+        # the workers in turn. Given a tempo clock, the workers run clocks of their own that follow it. deadline is
+        # the share of a buffer the main server waits for the workers.
+        from pyo import DataTable, Mix, TableFill
+        names = list(names) if names is not None else [name for name, factory in EFFECTS]
+        workers = min(workers or max(1, (os.cpu_count() or 1) - 1), len(names))
+        context = multiprocessing.get_context("spawn")
+        self._buffersize = buffersize
+        self._timeout = deadline * buffersize / float(sr)
+        self._sendLock = threading.Lock()
+        self._clock = clock
+        self._bpm = clock.bpm if clock is not None else None
+
+        # The input is captured into a table during every buffer, and handed to the workers at the next one
+        self._inTable = DataTable(buffersize)
+        self._inMix = Mix(input, voices=1)
+        self._inFill = TableFill(self._inMix, self._inTable)
+        self._inBuffer = numpy.asarray(self._inTable.getBuffer())
+
+        self._stopping = context.Event()
+        self._workers = []
+        for index in range(workers):
+            assigned = list(range(index, len(names), workers))
+            worker = {
+                "chains": assigned,
+                "inbox": RingBuffer(1, buffersize, context=context),
+                "outbox": RingBuffer(len(assigned), buffersize, context=context),
+                "commands": context.Queue(),
+                "sent": 0,
+                "result": numpy.zeros((len(assigned), buffersize), dtype=numpy.float32),
+                "ready": context.Queue(),
+            }
+            worker["process"] = context.Process(
+                target=_runWorker, daemon=True,
+                args=([names[chain] for chain in assigned], sr, buffersize, self._bpm, worker["inbox"],
+                      worker["outbox"], worker["commands"], worker["ready"], self._stopping))
+            self._workers.append(worker)
+        with _hiddenMain():
+            for worker in self._workers:
+                worker["process"].start()
+
+        self.chains = [None] * len(names)
+        self._tables = []
+        for index, worker in enumerate(self._workers):
+            values = worker["ready"].get(timeout=STARTUP_TIMEOUT)
+            worker["tables"] = []
+            for lane, chain in enumerate(worker["chains"]):
+                table = DataTable(buffersize)
+                output = _blockReader(table, sr, buffersize).stop()
+                worker["tables"].append(numpy.asarray(table.getBuffer()))
+                self._tables.append(table)
+                self.chains[chain] = RemoteChain(self, names[chain], index, lane, output, values[lane])
+
+        self.blocks = 0
+        self.lateBlocks = 0
+        self.blockTimes = collections.deque(maxlen=100000)
+        self._lastBlock = None
+
+    def __len__(self):
+        return len(self.chains)
+
+    @property
+    def workers(self):
+        return len(self._workers)
+
+    def factories(self):
+        # Factories handing out the pool's chains, for an EffectRegistry built with lazy=False
+        return [(chain.name, lambda input, clock=None, chain=chain: chain) for chain in self.chains]
+
+    def start(self, server):
+        # Has the server exchange blocks with the workers at the start of every buffer
+        server.setCallback(self._process)
+        return self
+
+    def _send(self, worker, command):
+        # Commands come from the main and the audio thread, and are counted once queued, so the next block sent
+        # to the worker carries it along
+        with self._sendLock:
+            self._workers[worker]["commands"].put(command)
+            self._workers[worker]["sent"] += 1
+
+    def _process(self):
+        # Called by the main server at the start of every buffer
+        now = time.perf_counter()
+        if self._lastBlock is not None:
+            self.blockTimes.append(now - self._lastBlock)
+        self._lastBlock = now
+        if self._clock is not None and self._clock.bpm != self._bpm:
+            self._bpm = self._clock.bpm
+            for index in range(len(self._workers)):
+                self._send(index, ("bpm", self._bpm))
+
+        seq = self.blocks
+        self.blocks += 1
+        for worker in self._workers:
+            worker["inbox"].push([self._inBuffer], seq, worker["sent"])
+        deadline = now + self._timeout
+        for worker in self._workers:
+            result = worker["result"]
+            got = worker["outbox"].pop(result, max(deadline - time.perf_counter(), 0))
+            # Frames a worker sent after an earlier deadline are stale by now
+            while got is not None and got < seq:
+                got = worker["outbox"].pop(result, max(deadline - time.perf_counter(), 0))
+            if got != seq:
+                self.lateBlocks += 1
+                result[:] = 0
+            for lane, table in enumerate(worker["tables"]):
+                table[:] = result[lane]
+
+    def stop(self):
+        self._stopping.set()
+        for worker in self._workers:
+            worker["process"].join(timeout=5)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+            worker["inbox"].close()
+            worker["outbox"].close()
+        self._workers = []
+
+
+def _offlineServer(sr, buffersize):
+    from pyo import Server
+    server = Server(sr=sr, buffersize=buffersize, audio="offline", nchnls=1)
+    server.setVerbosity(0)
+    server.boot()
+    return server
+
+
+def _renderOffline(server, dur):
+    handle, filename = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    server.recordOptions(dur=dur, filename=filename)
+    try:
+        server.start()
+    finally:
+        os.remove(filename)
+
+
+def compareOutput(name="Distortion", dur=1.0, sr=44100, buffersize=256):
+    # Renders an effect in the main server and through a worker side by side, returning the largest difference
+    # between the two once the worker's output is moved back by one buffer
+    from pyo import Mix, NewTable, Noise, TableRec
+    server = _offlineServer(sr, buffersize)
+    source = Noise(mul=.3)
+    local = dict(EFFECTS)[name](source)
+    # Offline rendering isn't held to real time, so the main server waits for every block instead of counting
+    # a worker that the scheduler put off as late
+    pool = WorkerPool(source, [name], workers=1, sr=sr, buffersize=buffersize,
+                      deadline=STARTUP_TIMEOUT * sr / buffersize).start(server)
+    pool.chains[0].play()
+    tables = [NewTable(dur), NewTable(dur)]
+    recorders = [TableRec(Mix(local.output, voices=1), tables[0]).play(),
+                 TableRec(pool.chains[0].output, tables[1]).play()]
+    try:
+        _renderOffline(server, dur)
+    finally:
+        pool.stop()
+    direct, remote = [numpy.asarray(table.getTable()) for table in tables]
+    del recorders
+    server.shutdown()
+    return float(numpy.max(numpy.abs(direct[:-buffersize] - remote[buffersize:])))
+
+
+def _keepsUp(blockTimes, late, period, tolerance):
+    # A run keeps up if no more than the tolerated share of buffers took longer than real time or came back late
+    blockTimes = list(blockTimes)[10:]
+    overruns = sum(1 for t in blockTimes if t > period) + late
+    return overruns <= tolerance * max(len(blockTimes), 1)
+
+
+def runsInRealTime(count, workers, dur=2.0, sr=44100, buffersize=256, tolerance=0.01):
+    # Renders count heavy effects at once, in the main server or spread over the given number of workers, and
+    # tells whether every buffer would have been ready in time
+    from pyo import Mix, Noise
+    server = _offlineServer(sr, buffersize)
+    source = Noise(mul=.3)
+    names = [BENCHMARK_EFFECTS[index % len(BENCHMARK_EFFECTS)] for index in range(count)]
+    pool = None
+    if workers:
+        pool = WorkerPool(source, names, workers=workers, sr=sr, buffersize=buffersize).start(server)
+        outputs = [chain.play().output for chain in pool.chains]
+        blockTimes = pool.blockTimes
+    else:
+        factories = dict(EFFECTS)
+        outputs = [factories[name](source).output for name in names]
+        blockTimes = collections.deque()
+        last = []
+
+        def timeBlock():
+            now = time.perf_counter()
+            if last:
+                blockTimes.append(now - last[0])
+            last[:] = [now]
+        server.setCallback(timeBlock)
+    mix = Mix(outputs, voices=1, mul=1.0 / count).out()
+    try:
+        _renderOffline(server, dur)
+    finally:
+        if pool is not None:
+            pool.stop()
+    late = pool.lateBlocks if pool is not None else 0
+    del mix, outputs
+    server.shutdown()
+    return _keepsUp(blockTimes, late, buffersize / float(sr), tolerance)
+
+
+def maxEffects(workers, limit=256, **options):
+    # The largest number of heavy effects that still runs in real time, doubling up and then narrowing down
+    low, high = 0, 1
+    while high <= limit and runsInRealTime(high, workers, **options):
+        low, high = high, high * 2
+    high = min(high, limit + 1)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if runsInRealTime(middle, workers, **options):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare running the effects in one process and in worker processes")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) - 1))
+    parser.add_argument("--dur", type=float, default=2.0, help="seconds rendered for every trial")
+    parser.add_argument("--buffersize", type=int, default=256)
+    parser.add_argument("--sr", type=int, default=44100)
+    parser.add_argument("--limit", type=int, default=256, help="most effects to try at once")
+    args = parser.parse_args()
+    error = compareOutput(sr=args.sr, buffersize=args.buffersize)
+    print("Largest difference through a worker, one buffer later: %.2e" % error)
+    options = dict(dur=args.dur, sr=args.sr, buffersize=args.buffersize)
+    single = maxEffects(0, args.limit, **options)
+    multi = maxEffects(args.workers, args.limit, **options)
+    print("Effects at once before dropouts (%s): %d in one process, %d over %d workers, on %d cores" % (
+        " and ".join(BENCHMARK_EFFECTS), single, multi, args.workers, os.cpu_count() or 1))
+    if error > 1e-4:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    # The workers are started from this module under its own name, which they can import
+    import multicore
+    multicore.main()
@@ -0,0 +1,895 @@
+# NumPy backend for the custom effects of the pedal. The Flanger, Vibrato, Tremolo and Leslie speaker in effects.py
+# are wired from many small pyo objects, and every audio buffer passes through each of them in turn, with the
+# Mixers walking Python dicts on every buffer. Here each of the four effects is a single kernel that works on a whole
+# buffer at a time with NumPy, following the same DSP as the pyo objects it replaces, down to pyo's 512 point sine
+# table and the quirks of its Phaser, so the two backends sound the same.
+#
+# The kernels keep all their state between buffers and work on arrays allocated when they are made. The recursive
+# filters, the Hilbert transform inside the Vibrato and the Leslie's Phaser, can't be computed sample by sample in
+# NumPy, so they are solved a piece of SUBBLOCK samples at a time with matrix products, which is exact for a filter
+# whose coefficients hold still over the piece. The Phaser's coefficients follow its slow sweep every PHASER_STEP
+# samples, where pyo moves them on every sample.
+#
+# A kernel runs standalone on NumPy arrays, for processing recordings offline, or inside the pyo graph through a
+# NumpyBridge, which hands it every buffer of the input and plays its output one buffer later:
+#
+#     python buttonWithSFX.py --numpy
+#
+# Run on its own, this renders each effect with both backends, fails if they differ by more than the tolerance, and
+# compares their throughput. The kernels compute in double precision, so they are checked against the double
+# precision build of pyo, pyo64; the difference from the single precision build the pedal runs is printed as well.
+# It is mostly rounding, except for the Flanger, whose whole-sample delay can land on a neighbouring sample.
+#
+#     python numpyEffects.py [--dur 5] [--buffersize 256]
+import abc
+import argparse
+import collections
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy
+
+from effects import EFFECTS, RAMP_TIME, Parameter, declareRanges
+
+# pyo's oscillators read a 512 point sine table with linear interpolation, and so do the kernels
+TABLE_SIZE = 512
+SINE_TABLE = numpy.sin(2 * numpy.pi * numpy.arange(TABLE_SIZE + 1) / TABLE_SIZE)
+SINE_TABLE[-1] = 0.0
+SINE_SLOPE = numpy.diff(SINE_TABLE)
+
+# The start of pyo's half cosine table. pyo's Phaser reads it at the number of the stage rather than at the angle
+# of the stage, and the kernel does the same so the two sound alike.
+HALF_COS_HEAD = numpy.array([
+    1.0, 0.99998110153278696, 0.99992440684545181, 0.99982991808087995, 0.99969763881045715, 0.99952757403393411,
+    0.99931973017923825, 0.99907411510222999, 0.99879073808640628, 0.99846960984254973, 0.99811074250832332,
+    0.99771414964781235, 0.99727984625101107, 0.99680784873325645, 0.99629817493460782, 0.99575084411917214,
+    0.99516587697437664, 0.99454329561018584, 0.99388312355826691, 0.9931853857710996])
+HALF_COS_HEAD_SLOPE = numpy.diff(HALF_COS_HEAD)
+
+# Length of the pieces the recursive filters are solved in
+SUBBLOCK = 32
+
+# Number of samples the Phaser holds its coefficients for. Holding them for a whole buffer of 256 samples puts the
+# Leslie 7e-3 away from pyo, 128 samples 4e-3 and 64 samples 2e-3.
+PHASER_STEP = 64
+
+# Delays and rates of the eight voices of pyo's Chorus at 44100 Hz: centre delay and deviation in samples, and
+# rate in Hz
+CHORUS_VOICES = numpy.array([
+    [384.0, 44.0, 1.879], [450.0, 53.0, 1.654], [489.0, 57.0, 1.342], [553.0, 62.0, 1.231],
+    [591.0, 66.0, 0.879], [662.0, 71.0, 0.657], [753.0, 88.0, 0.465], [785.0, 101.0, 0.254]])
+
+# Poles of the two sixth order allpass chains of pyo's Hilbert transform
+HILBERT_POLES = numpy.array([.3609, 2.7412, 11.1573, 44.7581, 179.6242, 798.4578,
+                             1.2524, 5.5671, 22.3423, 89.6271, 364.7914, 2770.1114])
+
+# Largest difference from the pyo effects the self-check accepts, 46 dB below full scale. Only the Leslie's Phaser,
+# with its coefficients moving every PHASER_STEP samples, differs by more than rounding, by about 2e-3.
+TOLERANCE = 5e-3
+
+
+def _pieceLength(blocksize):
+    piece = SUBBLOCK
+    while blocksize % piece:
+        piece //= 2
+    return piece
+
+
+# A parameter that moves linearly to a new value over a ramp time, like the SigTo ramps of the pyo effects. fill()
+# returns its value for every sample of the next buffer.
+class _Ramp(object):
+    def __init__(self, value, blocksize, sr):
+        self.value = float(value)
+        self._sr = sr
+        self._target = self.value
+        self._step = 0.0
+        self._left = 0
+        self._block = numpy.full(blocksize, self.value)
+        self._counts = numpy.arange(1, blocksize + 1, dtype=numpy.float64)
+        self._flat = True
+
+    def set(self, value, time=RAMP_TIME):
+        samples = max(1, int(time * self._sr))
+        self._target = float(value)
+        self._step = (self._target - self.value) / samples
+        self._left = samples
+
+    def fill(self, n):
+        block = self._block[:n]
+        if self._left == 0:
+            if not self._flat:
+                block.fill(self.value)
+                self._flat = True
+            return block
+        moving = min(n, self._left)
+        numpy.multiply(self._counts[:moving], self._step, out=block[:moving])
+        block[:moving] += self.value
+        self._left -= moving
+        self.value = self._target if self._left == 0 else self.value + self._step * moving
+        block[moving:] = self.value
+        self._flat = False
+        return block
+
+
+# Linear interpolation into a table, reusing the caller's index and fraction arrays. The indexes are always in
+# range, and reading with mode="clip" keeps numpy.take from copying the output to check them.
+def _lookup(table, slope, pos, out, index, frac):
+    numpy.floor(pos, out=frac)
+    numpy.copyto(index, frac, casting="unsafe")
+    numpy.subtract(pos, frac, out=frac)
+    numpy.take(table, index, out=out, mode="clip")
+    numpy.take(slope, index, out=pos, mode="clip")
+    pos *= frac
+    out += pos
+
+
+# pyo's Sine: reads the sine table at a pointer that moves by the frequency of each sample
+class _Sine(object):
+    def __init__(self, blocksize, sr, phase=0.0):
+        self._scale = TABLE_SIZE / float(sr)
+        self._phase = phase * TABLE_SIZE
+        self._pointer = 0.0
+        self._pos = numpy.empty(blocksize)
+        self._inc = numpy.empty(blocksize)
+        self._frac = numpy.empty(blocksize)
+        self._index = numpy.empty(blocksize, dtype=numpy.intp)
+
+    def process(self, freq, out):
+        n = len(out)
+        inc, pos = self._inc[:n], self._pos[:n]
+        numpy.multiply(freq, self._scale, out=inc)
+        # Every sample is read at the pointer before it moves on
+        numpy.cumsum(inc, out=pos)
+        advance = pos[-1]
+        pos -= inc
+        pos += self._pointer + self._phase
+        numpy.mod(pos, TABLE_SIZE, out=pos)
+        self._pointer = (self._pointer + advance) % TABLE_SIZE
+        _lookup(SINE_TABLE, SINE_SLOPE, pos, out, self._index[:n], self._frac[:n])
+        return out
+
+
+# pyo's LFO with its modulated sine wave, the Flanger's sweep
+class _SineModLfo(object):
+    def __init__(self, blocksize, sr, sharp=0.3):
+        self._sr = float(sr)
+        self._sharp = sharp
+        self._pointer = 0.0
+        self._modPointer = 0.0
+        self._pos = numpy.empty(blocksize)
+        self._mod = numpy.empty(blocksize)
+
+    def process(self, freq, out):
+        n = len(out)
+        pos, mod = self._pos[:n], self._mod[:n]
+        numpy.clip(freq, 0.00001, self._sr / 4, out=pos)
+        pos /= self._sr
+        # The modulator moves on before it is read, the sine after
+        numpy.multiply(pos, self._sharp * 0.99, out=mod)
+        numpy.cumsum(mod, out=mod)
+        mod += self._modPointer
+        self._modPointer = mod[-1] % 1.0
+        numpy.cumsum(pos, out=out)
+        advance = out[-1]
+        out -= pos
+        numpy.add(out, self._pointer, out=pos)
+        self._pointer = (self._pointer + advance) % 1.0
+        numpy.multiply(mod, 2 * numpy.pi, out=mod)
+        numpy.cos(mod, out=mod)
+        mod *= self._sharp * 0.5
+        mod += self._sharp * 0.5 + 1.0 - self._sharp
+        numpy.multiply(pos, 2 * numpy.pi, out=pos)
+        numpy.sin(pos, out=out)
+        out *= mod
+        return out
+
+
+# The input history the delay lines read from, a ring whose length is a power of two so positions wrap with a mask
+class _History(object):
+    def __init__(self, length, blocksize):
+        size = 1
+        while size < length + blocksize + 2:
+            size *= 2
+        self._ring = numpy.zeros(size)
+        self._mask = size - 1
+        self._write = 0
+        self._offsets = numpy.arange(blocksize, dtype=numpy.int64)
+        self._slots = numpy.empty(blocksize, dtype=numpy.int64)
+
+    def write(self, block):
+        # Stores a buffer of input, returning where its first sample went
+        n = len(block)
+        slots = self._slots[:n]
+        numpy.add(self._offsets[:n], self._write, out=slots)
+        slots &= self._mask
+        self._ring[slots] = block
+        start = self._write
+        self._write += n
+        return start
+
+    def readWhole(self, start, delays, out, index):
+        # Reads the samples a whole number of samples before each sample of the last buffer
+        n = len(out)
+        numpy.add(self._offsets[:n], start, out=index)
+        index -= delays
+        index &= self._mask
+        return numpy.take(self._ring, index, out=out, mode="clip")
+
+    def readFractional(self, start, delays, out, index, frac, scratch):
+        # Reads between samples, with linear interpolation, like pyo's Chorus. delays and out may have a row per
+        # voice, all reading the same buffer.
+        numpy.add(self._offsets[:delays.shape[-1]], float(start), out=scratch)
+        numpy.subtract(scratch, delays, out=scratch)
+        numpy.floor(scratch, out=frac)
+        numpy.copyto(index, frac, casting="unsafe")
+        numpy.subtract(scratch, frac, out=frac)
+        index &= self._mask
+        numpy.take(self._ring, index, out=out, mode="clip")
+        index += 1
+        index &= self._mask
+        numpy.take(self._ring, index, out=scratch, mode="clip")
+        scratch -= out
+        scratch *= frac
+        out += scratch
+        return out
+
+
+# A linear filter written as a state update, s' = A s + B u and y = C s + D u, solved a piece of samples at a time.
+# Over a piece of M samples the outputs are Y = O s + T U and the state at its end A^M s + G U, with O, T and G
+# built from powers of A, so a whole piece costs a few matrix products. Everything is computed into arrays allocated
+# up front, so a filter whose coefficients move can be prepared again on the audio thread.
+class _StateSpace(object):
+    def __init__(self, states, blocksize):
+        m = self._piece = _pieceLength(blocksize)
+        pieces = blocksize // m
+        self._state = numpy.zeros(states)
+        self._states = numpy.empty((pieces + 1, states))
+        self._gathered = numpy.empty((pieces, states))
+        self._observed = numpy.empty((pieces, m))
+        self._observe = numpy.empty((m, states))
+        self._gather = numpy.empty((m, states))
+        self._powers = [numpy.empty((states, states)), numpy.empty((states, states))]
+        self._advance = self._powers[0]
+        self._impulse = numpy.empty(m)
+        self._toeplitz = numpy.empty((m, m))
+        steps = numpy.arange(m)
+        lags = steps[:, None] - steps[None, :]
+        self._causal = (lags >= 0).astype(numpy.float64)
+        self._lags = numpy.where(lags >= 0, lags, 0)
+
+    def prepare(self, A, B, C, D):
+        # Builds the piece matrices from the state update. The piece length is a power of two, so the powers of A
+        # are built by squaring.
+        m = self._piece
+        rows, cols = self._observe, self._gather
+        power, spare = self._powers
+        rows[0] = C
+        cols[m - 1] = B
+        numpy.copyto(power, A)
+        k = 1
+        while k < m:
+            numpy.matmul(rows[:k], power, out=rows[k:2 * k])
+            numpy.matmul(cols[m - k:], power.T, out=cols[m - 2 * k:m - k])
+            numpy.matmul(power, power, out=spare)
+            power, spare = spare, power
+            k *= 2
+        # rows[k] = C A^k, cols[k] = (A^(M-1-k) B)^T, the impulse response h[0] = D and h[k] = C A^(k-1) B
+        self._advance = power
+        self._impulse[0] = D
+        numpy.matmul(rows[:m - 1], B, out=self._impulse[1:])
+        numpy.take(self._impulse, self._lags, out=self._toeplitz, mode="clip")
+        self._toeplitz *= self._causal
+
+    def process(self, u, out):
+        m = self._piece
+        pieces = len(u) // m
+        inputs = u.reshape(pieces, m)
+        outputs = out.reshape(pieces, m)
+        # Only the state has to be carried from piece to piece, the rest is a product over the whole buffer
+        numpy.matmul(inputs, self._toeplitz.T, out=outputs)
+        gathered = numpy.matmul(inputs, self._gather, out=self._gathered[:pieces])
+        states = self._states[:pieces + 1]
+        states[0] = self._state
+        for k in range(pieces):
+            numpy.matmul(self._advance, states[k], out=states[k + 1])
+            states[k + 1] += gathered[k]
+        observed = numpy.matmul(states[:pieces], self._observe.T, out=self._observed[:pieces])
+        outputs += observed
+        self._state[:] = states[pieces]
+        return out
+
+
+def _linearize(step, states):
+    # Builds the state update matrices of a filter by running one sample of it on every unit state and on a unit
+    # input. step(state, input) works on (probes, states) arrays and returns the new state and the output.
+    probes = numpy.eye(states + 1, states)
+    inputs = numpy.zeros(states + 1)
+    inputs[states] = 1.0
+    state, output = step(probes, inputs)
+    return state[:states].T, state[states], output[:states], output[states]
+
+
+# pyo's Hilbert transform: two chains of six first order allpass filters whose outputs are a quarter turn apart
+class _Hilbert(object):
+    def __init__(self, blocksize, sr):
+        polefreq = HILBERT_POLES * 15.0
+        alpha = 2 * numpy.pi * polefreq
+        coefs = -(1.0 - alpha / (2.0 * sr)) / (1.0 + alpha / (2.0 * sr))
+        self._chains = []
+        for chain in (coefs[:6], coefs[6:]):
+            def step(state, u, chain=chain):
+                # The state holds the last input and the last output of every section
+                new = numpy.empty_like(state)
+                x = u
+                for j, coef in enumerate(chain):
+                    y = coef * (x - state[..., 6 + j]) + state[..., j]
+                    new[..., j] = x
+                    new[..., 6 + j] = y
+                    x = y
+                return new, x
+            filt = _StateSpace(12, blocksize)
+            filt.prepare(*_linearize(step, 12))
+            self._chains.append(filt)
+
+    def process(self, block, real, imag):
+        self._chains[0].process(block, real)
+        self._chains[1].process(block, imag)
+
+
+# pyo's Phaser: a chain of second order allpass filters spread over the spectrum, with the output fed back to the
+# input. pyo moves its coefficients on every sample, the kernel every PHASER_STEP samples from the sweep at the
+# middle of the step, and like pyo it keeps every stage below 0.49 times the sample rate. The state update of the
+# chain is written out directly from the coefficients, into arrays allocated up front.
+class _Phaser(object):
+    def __init__(self, blocksize, sr, stages=18, q=1.0, feedback=0.5):
+        self._sr = float(sr)
+        self._stages = stages
+        self._q = q
+        self._feedback = max(-1.0, min(1.0, feedback))
+        self._step = PHASER_STEP
+        while blocksize % self._step:
+            self._step //= 2
+        self._filter = _StateSpace(2 * stages + 1, self._step)
+        self._sweep = None
+        self._exponents = numpy.arange(stages, dtype=numpy.float64)
+        self._freqs = numpy.empty(stages)
+        self._pos = numpy.empty(stages)
+        self._alpha = numpy.empty(stages)
+        self._beta = numpy.empty(stages)
+        self._through = numpy.empty(stages)
+        self._logs = numpy.zeros(stages + 1)
+        self._products = numpy.empty(stages + 1)
+        self._gains = numpy.empty((stages + 1, stages))
+        self._earlier = numpy.tri(stages + 1, stages, -1)
+        self._spans = numpy.empty((stages + 1, 2 * stages))
+        # A stage's state is the last two values inside it, the chain's also holds its last output. The second
+        # value of every stage is the first one of the sample before, which never changes with the coefficients.
+        states = 2 * stages + 1
+        self._A = numpy.zeros((states, states))
+        self._A[stages:2 * stages, :stages] = numpy.eye(stages)
+        self._B = numpy.zeros(states)
+        self._C = numpy.zeros(states)
+        self._diagonal = numpy.arange(stages) * (states + 1)
+
+    def _coefficients(self, freq, spread):
+        # alpha and beta of every stage. pyo clamps each stage's frequency before spreading it to the next, which
+        # comes down to clamping the start and then only the bound the spread heads for.
+        freqs, pos = self._freqs, self._pos
+        numpy.power(spread, self._exponents, out=freqs)
+        freqs *= min(max(freq, 20.0), self._sr * 0.49)
+        if spread >= 1.0:
+            numpy.minimum(freqs, self._sr * 0.49, out=freqs)
+        else:
+            numpy.maximum(freqs, 20.0, out=freqs)
+        # alpha is the square of the pole radius
+        numpy.multiply(freqs, -2 * math.pi / self._sr / self._q, out=self._alpha)
+        numpy.exp(self._alpha, out=self._alpha)
+        numpy.multiply(freqs, 2 * TABLE_SIZE / self._sr, out=pos)
+        numpy.modf(pos, out=(pos, freqs))
+        numpy.multiply(HALF_COS_HEAD_SLOPE[:self._stages], pos, out=self._beta)
+        self._beta += HALF_COS_HEAD[:self._stages]
+        numpy.sqrt(self._alpha, out=pos)
+        pos *= -2.0
+        self._beta *= pos
+
+    def _update(self):
+        # Writes out the state update. The value t_j entering stage j is alpha_j t_(j-1) plus a part of the stage's
+        # own state, so the input and every stage before it reach it through a product of alphas.
+        n = self._stages
+        alpha, beta, logs, gains = self._alpha, self._beta, self._logs, self._gains
+        numpy.log(alpha, out=logs[1:])
+        numpy.cumsum(logs[1:], out=logs[1:])
+        numpy.subtract(logs[:, None], logs[None, 1:], out=gains)
+        numpy.exp(gains, out=gains)
+        gains *= self._earlier
+        cum = numpy.exp(logs, out=self._products)
+        spans = self._spans
+        numpy.subtract(1.0, alpha, out=self._through)
+        self._through *= beta
+        numpy.multiply(gains, self._through, out=spans[:, :n])
+        numpy.multiply(alpha, alpha, out=self._through)
+        numpy.subtract(1.0, self._through, out=self._through)
+        numpy.multiply(gains, self._through, out=spans[:, n:])
+        A = self._A
+        A[:n, :2 * n] = spans[:n]
+        A[:n, 2 * n] = cum[:n]
+        A[:n, 2 * n] *= self._feedback
+        A[2 * n, :2 * n] = spans[n]
+        A[2 * n, 2 * n] = cum[n] * self._feedback
+        numpy.negative(beta, out=self._through)
+        numpy.put(A, self._diagonal, self._through)
+        numpy.negative(alpha, out=self._through)
+        numpy.put(A, self._diagonal + n, self._through)
+        self._B[:n] = cum[:n]
+        self._B[2 * n] = cum[n]
+        self._C[:] = A[2 * n]
+        self._filter.prepare(A, self._B, self._C, cum[n])
+
+    def process(self, block, freq, spread, out):
+        step = self._step
+        for start in range(0, len(block), step):
+            middle = start + step // 2
+            sweep = (float(freq[middle]), float(spread[middle]))
+            # The coefficients only change when the sweep has moved
+            if sweep != self._sweep:
+                self._sweep = sweep
+                self._coefficients(*sweep)
+                self._update()
+            self._filter.process(block[start:start + step], out[start:start + step])
+        return out
+
+
+# pyo's Chorus without feedback, as the Tremolo uses it: eight delay lines swept by their own sines, mixed with the
+# dry input
+class _Chorus(object):
+    def __init__(self, blocksize, sr, depth=0.1, bal=0.5):
+        srfac = sr / 44100.0
+        self._delays = CHORUS_VOICES[:, 0:1] * srfac
+        self._devs = CHORUS_VOICES[:, 1:2] * srfac * max(0.0, min(5.0, depth))
+        self._inc = CHORUS_VOICES[:, 2:3] * TABLE_SIZE / float(sr)
+        self._bal = bal
+        self._pointers = numpy.zeros((8, 1))
+        self._advance = numpy.empty((8, 1))
+        self._history = _History(int(self._delays.max() + self._devs.max()) + 2, blocksize)
+        shape = (8, blocksize)
+        self._steps = numpy.tile(numpy.arange(blocksize, dtype=numpy.float64), (8, 1))
+        self._pos = numpy.empty(shape)
+        self._lfo = numpy.empty(shape)
+        self._frac = numpy.empty(shape)
+        self._scratch = numpy.empty(shape)
+        self._voices = numpy.empty(shape)
+        self._index = numpy.empty(shape, dtype=numpy.int64)
+
+    def process(self, block, out):
+        n = len(block)
+        pos, lfo, voices = self._pos[:, :n], self._lfo[:, :n], self._voices[:, :n]
+        numpy.multiply(self._steps[:, :n], self._inc, out=pos)
+        pos += self._pointers
+        numpy.mod(pos, TABLE_SIZE, out=pos)
+        numpy.multiply(self._inc, n, out=self._advance)
+        self._pointers += self._advance
+        numpy.mod(self._pointers, TABLE_SIZE, out=self._pointers)
+        index = self._index[:, :n]
+        _lookup(SINE_TABLE, SINE_SLOPE, pos, lfo, index, self._frac[:, :n])
+        lfo *= self._devs
+        lfo += self._delays
+        start = self._history.write(block)
+        self._history.readFractional(start, lfo, voices, index, self._frac[:, :n], self._scratch[:, :n])
+        numpy.sum(voices, axis=0, out=out)
+        out *= 0.25 * self._bal
+        numpy.multiply(block, 1.0 - self._bal, out=lfo[0])
+        out += lfo[0]
+        return out
+
+
+# pyo's Mixer gains, which ramp from silence to their level over the mixer's time once the effect is built
+class _FadeIn(object):
+    def __init__(self, blocksize, sr, time, level=1.0):
+        self._steps = max(1, int(time * sr))
+        self._level = level
+        self._count = 0
+        self._gain = numpy.empty(blocksize)
+        self._counts = numpy.arange(1, blocksize + 1, dtype=numpy.float64)
+
+    def apply(self, out):
+        if self._count >= self._steps:
+            if self._level != 1.0:
+                out *= self._level
+            return out
+        n = len(out)
+        gain = self._gain[:n]
+        numpy.add(self._counts[:n], self._count, out=gain)
+        numpy.minimum(gain, self._steps, out=gain)
+        gain *= self._level / self._steps
+        self._count += n
+        out *= gain
+        return out
+
+
+class Kernel(abc.ABC):
+    # Shared parameter handling, with the same contract as EffectChain.setParameter(). process() returns one buffer
+    # of output, or a row of it for every channel of a kernel with more than one.
+    channels = 1
+
+    def __init__(self, name, blocksize, sr, values):
+        self.name = name
+        self.blocksize = blocksize
+        self.sr = sr
+        self._ramps = collections.OrderedDict((param, _Ramp(value, blocksize, sr)) for param, value in values)
+        self._out = numpy.zeros(blocksize)
+
+    @property
+    def parameters(self):
+        return list(self._ramps)
+
+    def parameterValues(self):
+        return dict((param, ramp._target) for param, ramp in self._ramps.items())
+
+    def setParameter(self, name, value, time=RAMP_TIME):
+        ramp = self._ramps.get(name)
+        if ramp is None:
+            raise ValueError("%s has no parameter %s" % (self.name, name))
+        if value == ramp._target:
+            return False
+        ramp.set(value, time)
+        return True
+
+    @abc.abstractmethod
+    def process(self, block):
+        # Processes one buffer of mono input, blocksize samples long, returning a view of the output buffer
+        pass
+
+
+class FlangerKernel(Kernel):
+    def __init__(self, depth=.875, lfofreq=.545, blocksize=256, sr=44100, maxdelay=1.5):
+        Kernel.__init__(self, "Flanger", blocksize, sr, [("depth", depth), ("lfofreq", lfofreq)])
+        self._maxdelay = maxdelay
+        self._lfo = _SineModLfo(blocksize, sr)
+        self._history = _History(int(maxdelay * sr), blocksize)
+        self._sweep = numpy.empty(blocksize)
+        self._scaled = numpy.empty(blocksize)
+        self._delays = numpy.empty(blocksize, dtype=numpy.int64)
+        self._index = numpy.empty(blocksize, dtype=numpy.int64)
+        self._fade = _FadeIn(blocksize, sr, 0.05)
+
+    def process(self, block):
+        n = len(block)
+        sweep, scaled, out = self._sweep[:n], self._scaled[:n], self._out[:n]
+        numpy.multiply(self._ramps["lfofreq"].fill(n), 2, out=scaled)
+        self._lfo.process(scaled, sweep)
+        numpy.multiply(self._ramps["depth"].fill(n), 0.005, out=scaled)
+        sweep *= scaled
+        sweep += 0.005
+        # SDelay only delays by whole samples, rounded down like pyo does
+        numpy.clip(sweep, 0.0, self._maxdelay, out=sweep)
+        sweep *= self.sr
+        delays = self._delays[:n]
+        numpy.copyto(delays, sweep, casting="unsafe")
+        start = self._history.write(block)
+        self._history.readWhole(start, delays, out, self._index[:n])
+        # The dry and the delayed signal come out of the mixer's second output, on both of its channels, and both
+        # channels of both outputs carry the mixer's offset
+        out *= 0.9
+        out += block
+        self._fade.apply(out)
+        out *= 2 * 1.02
+        out += 4 * 0.01
+        return out
+
+
+class TremoloKernel(Kernel):
+    def __init__(self, freq=6, blocksize=256, sr=44100):
+        Kernel.__init__(self, "Tremolo", blocksize, sr, [("freq", freq)])
+        self._chorus = _Chorus(blocksize, sr)
+        self._sine = _Sine(blocksize, sr)
+        self._wobble = numpy.empty(blocksize)
+
+    def process(self, block):
+        n = len(block)
+        out, wobble = self._out[:n], self._wobble[:n]
+        self._chorus.process(block, out)
+        self._sine.process(self._ramps["freq"].fill(n), wobble)
+        out *= wobble
+        return out
+
+
+class VibratoKernel(Kernel):
+    def __init__(self, depth=10, blocksize=256, sr=44100):
+        Kernel.__init__(self, "Vibrato", blocksize, sr, [("depth", depth)])
+        self._wobble = _Sine(blocksize, sr)
+        self._hilbert = _Hilbert(blocksize, sr)
+        self._sin = _Sine(blocksize, sr)
+        self._cos = _Sine(blocksize, sr, phase=0.25)
+        self._shift = numpy.empty(blocksize)
+        self._real = numpy.empty(blocksize)
+        self._imag = numpy.empty(blocksize)
+        self._carrier = numpy.empty(blocksize)
+
+    def process(self, block):
+        n = len(block)
+        shift = self._shift[:n]
+        self._wobble.process(self._ramps["depth"].fill(n), shift)
+        shift *= 10
+        shift += 6
+        return _frequencyShift(self, block, shift, self._out[:n])
+
+
+def _frequencyShift(kernel, block, shift, out):
+    # pyo's FreqShift: the two outputs of the Hilbert transform, turned by a pair of sines at the shift frequency
+    n = len(block)
+    real, imag, carrier = kernel._real[:n], kernel._imag[:n], kernel._carrier[:n]
+    kernel._hilbert.process(block, real, imag)
+    kernel._sin.process(shift, carrier)
+    numpy.multiply(real, carrier, out=out)
+    kernel._cos.process(shift, carrier)
+    imag *= carrier
+    out -= imag
+    out *= 0.707
+    return out
+
+
+class LeslieKernel(Kernel):
+    def __init__(self, depth=1, speed=4, mul=.7, blocksize=256, sr=44100):
+        Kernel.__init__(self, "Leslie Speaker", blocksize, sr, [("depth", depth), ("speed", speed)])
+        self._rotorSine = _Sine(blocksize, sr)
+        self._sweepSine = _Sine(blocksize, sr)
+        self._spreadSine = _Sine(blocksize, sr)
+        self._chorus = _Chorus(blocksize, sr)
+        self._phaser = _Phaser(blocksize, sr)
+        self._hilbert = _Hilbert(blocksize, sr)
+        self._sin = _Sine(blocksize, sr)
+        self._cos = _Sine(blocksize, sr, phase=0.25)
+        self._fade = _FadeIn(blocksize, sr, 0.5, mul)
+        self._sweepFreq = numpy.full(blocksize, 0.2)
+        for name in ("_rotor", "_sweep", "_spread", "_voice", "_shift", "_real", "_imag", "_carrier"):
+            setattr(self, name, numpy.empty(blocksize))
+
+    def process(self, block):
+        n = len(block)
+        out, voice = self._out[:n], self._voice[:n]
+        rotor, sweep, spread, shift = self._rotor[:n], self._sweep[:n], self._spread[:n], self._shift[:n]
+        self._rotorSine.process(self._ramps["speed"].fill(n), rotor)
+        # The rotor drives the Tremolo's level and the Vibrato's pitch
+        self._chorus.process(block, out)
+        out *= rotor
+        numpy.multiply(rotor, 10, out=shift)
+        shift += 6
+        _frequencyShift(self, block, shift, voice)
+        out += voice
+        # The Phaser sweeps its frequency at a fixed rate and its spread at a rate set by the depth
+        self._sweepSine.process(self._sweepFreq[:n], sweep)
+        sweep *= 70
+        sweep += 200
+        numpy.multiply(self._ramps["depth"].fill(n), .16, out=spread)
+        self._spreadSine.process(spread, spread)
+        spread *= .6
+        spread += 1.5
+        self._phaser.process(block, sweep, spread, voice)
+        voice *= .1
+        out += voice
+        return self._fade.apply(out)
+
+
+# The kernels by the name of the effect they replace
+KERNELS = collections.OrderedDict([
+    ("Flanger", FlangerKernel),
+    ("Tremolo", TremoloKernel),
+    ("Vibrato", VibratoKernel),
+    ("Leslie Speaker", LeslieKernel),
+])
+
+
+def processArray(kernel, samples):
+    # Runs a whole recording through a kernel, one buffer at a time, padding the last buffer with silence
+    blocks = -(-len(samples) // kernel.blocksize)
+    padded = numpy.zeros(blocks * kernel.blocksize)
+    padded[:len(samples)] = samples
+    out = numpy.empty_like(padded)
+    for start in range(0, len(padded), kernel.blocksize):
+        end = start + kernel.blocksize
+        out[start:end] = kernel.process(padded[start:end])
+    return out[:len(samples)]
+
+
+# Stands in for an EffectChain whose sound comes from a kernel, the same way multicore.RemoteChain stands in for one
+# running in a worker process
+class NumpyChain(object):
+    def __init__(self, kernel, output):
+        self.name = kernel.name
+        self.kernel = kernel
+        self.output = output
+        self.input = None
+        self.parameters = collections.OrderedDict(
+            (param, Parameter(param, None, value, smooth=False)) for param, value in kernel.parameterValues().items())
+        declareRanges(self.name, self.parameters.values())
+        self.playing = False
+
+    def play(self, dur=0, delay=0):
+        self.output.play(dur, delay)
+        self.playing = True
+        return self
+
+    def out(self, chnl=0, inc=1, dur=0, delay=0):
+        self.output.out(chnl, inc, dur, delay)
+        self.playing = True
+        return self
+
+    def stop(self, wait=0):
+        self.output.stop(wait)
+        self.playing = False
+        return self
+
+    def objects(self, exclude=()):
+        return [self.output]
+
+    def isPlaying(self):
+        return self.playing
+
+    def parameterValues(self):
+        return self.kernel.parameterValues()
+
+    def setParameter(self, name, value, time=RAMP_TIME):
+        param = self.parameters.get(name)
+        if param is not None:
+            value = param.clamp(value)
+        changed = self.kernel.setParameter(name, value, time)
+        if changed:
+            self.parameters[name].value = value
+        return changed
+
+
+# Runs kernels inside a pyo server. The input is captured into a table during every buffer, and at the start of the
+# next one every playing kernel processes it into tables of its own, one per channel, which are played back during
+# that buffer. Besides the kernels of the effects named, the bridge runs any kernels given already built.
+class NumpyBridge(object):
+    def __init__(self, input, names=None, sr=44100, buffersize=256, kernels=()):
+        from pyo import DataTable, Mix, Osc, TableFill
+        self._inTable = DataTable(buffersize)
+        self._inMix = Mix(input, voices=1)
+        self._inFill = TableFill(self._inMix, self._inTable)
+        self._inBuffer = numpy.asarray(self._inTable.getBuffer())
+        self._block = numpy.empty(buffersize)
+        self._tables = []
+        self._buffers = []
+        self.chains = []
+        names = names if names is not None else list(KERNELS)
+        for kernel in [KERNELS[name](blocksize=buffersize, sr=sr) for name in names] + list(kernels):
+            tables = [DataTable(buffersize) for i in range(kernel.channels)]
+            output = Osc(tables if kernel.channels > 1 else tables[0], freq=float(sr) / buffersize,
+                         phase=(buffersize - 1.0) / buffersize, interp=1).stop()
+            self._tables.append(tables)
+            self._buffers.append([numpy.asarray(table.getBuffer()) for table in tables])
+            self.chains.append(NumpyChain(kernel, output))
+
+    def start(self, server):
+        server.setCallback(self._process)
+        return self
+
+    def _process(self):
+        numpy.copyto(self._block, self._inBuffer)
+        for chain, buffers in zip(self.chains, self._buffers):
+            if not chain.playing:
+                continue
+            out = chain.kernel.process(self._block)
+            if len(buffers) == 1:
+                buffers[0][:] = out
+            else:
+                for buffer, row in zip(buffers, out):
+                    buffer[:] = row
+
+    def factories(self, factories=EFFECTS):
+        # The pedal's factories with the bridged effects swapped in, for an EffectRegistry built with lazy=False
+        bridged = dict((chain.name, chain) for chain in self.chains)
+        return [(name, (lambda input, clock=None, chain=bridged[name]: chain) if name in bridged else factory)
+                for name, factory in factories]
+
+
+def _readWave(path):
+    with wave.open(path, "rb") as source:
+        frames = source.readframes(source.getnframes())
+    return numpy.frombuffer(frames, dtype="<i2") / 32768.0
+
+
+def renderPyo(name, path, dur, sr=44100, buffersize=256):
+    # Renders the pyo version of an effect over a recording on the offline server, mixed down to mono
+    from pyo import Mix, NewTable, Server, SfPlayer, TableRec
+    server = Server(sr=sr, buffersize=buffersize, audio="offline", nchnls=1)
+    server.setVerbosity(0)
+    server.boot()
+    handle, filename = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    server.recordOptions(dur=dur, filename=filename)
+    source = SfPlayer(path)
+    chain = dict(EFFECTS)[name](source)
+    table = NewTable(dur)
+    recorder = TableRec(Mix(chain.output, voices=1), table).play()
+    try:
+        server.start()
+    finally:
+        os.remove(filename)
+    samples = numpy.asarray(table.getTable())
+    del recorder, chain
+    server.shutdown()
+    return samples
+
+
+def renderPyo64(name, path, dur, sr=44100, buffersize=256):
+    # pyo picks its precision when it is first imported, so the double precision render runs in a process of its own
+    handle, output = tempfile.mkstemp(suffix=".npy")
+    os.close(handle)
+    script = "import pyo64, numpy, numpyEffects; numpy.save(%r, numpyEffects.renderPyo(%r, %r, %r, %d, %d))" % (
+        output, name, path, dur, sr, buffersize)
+    try:
+        subprocess.check_call([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL)
+        return numpy.load(output)
+    finally:
+        os.remove(output)
+
+
+def _difference(reference, ours):
+    length = min(len(reference), len(ours))
+    return numpy.max(numpy.abs(reference[:length] - ours[:length]))
+
+
+def measurePyo(name, dur, sr=44100, buffersize=256):
+    # CPU seconds the pyo version of an effect takes to render dur seconds, on top of its input
+    from pyo import Noise, Server
+    from cpuReport import measureScenario
+    server = Server(sr=sr, buffersize=buffersize, audio="offline")
+    server.setVerbosity(0)
+    bare = measureScenario(server, dur, 3, lambda: Noise(mul=.3).out())
+    return max(measureScenario(server, dur, 3, lambda: dict(EFFECTS)[name](Noise(mul=.3)).out()) - bare, 1e-9)
+
+
+def measureKernel(name, dur, sr=44100, blocksize=256):
+    samples = numpy.random.RandomState(1).uniform(-.3, .3, int(dur * sr))
+    kernel = KERNELS[name](blocksize=blocksize, sr=sr)
+    start = time.process_time()
+    processArray(kernel, samples)
+    return max(time.process_time() - start, 1e-9)
+
+
+def main():
+    from benchmark import writeSyntheticDI
+    parser = argparse.ArgumentParser(description="Check the NumPy effects against pyo and compare their speed")
+    parser.add_argument("--dur", type=float, default=5.0)
+    parser.add_argument("--buffersize", type=int, default=256)
+    parser.add_argument("--offline-blocksize", type=int, default=4096,
+                        help="buffer size for the kernels when processing recordings offline")
+    parser.add_argument("--sr", type=int, default=44100)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    handle, path = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    failed = []
+    try:
+        writeSyntheticDI(path, args.dur, args.sr)
+        samples = _readWave(path)
+        for name, kernel in KERNELS.items():
+            ours = processArray(kernel(blocksize=args.buffersize, sr=args.sr), samples)
+            error = _difference(renderPyo64(name, path, args.dur, args.sr, args.buffersize), ours)
+            single = _difference(renderPyo(name, path, args.dur, args.sr, args.buffersize), ours)
+            pyoTime = measurePyo(name, args.dur, args.sr, args.buffersize)
+            realtime = measureKernel(name, args.dur, args.sr, args.buffersize)
+            offline = measureKernel(name, args.dur, args.sr, args.offline_blocksize)
+            print("%-15s largest difference %.1e from pyo64, %.1e from pyo" % (name, error, single))
+            print("%-15s pyo %.1fx realtime, NumPy %.1fx at %d samples and %.1fx at %d" % (
+                "", args.dur / pyoTime, args.dur / realtime, args.buffersize, args.dur / offline,
+                args.offline_blocksize))
+            if error > args.tolerance:
+                failed.append(name)
+    finally:
+        os.remove(path)
+    if failed:
+        print("Differs from pyo: %s" % ", ".join(failed))
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
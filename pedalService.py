@@ -0,0 +1,255 @@
+# Runs the pedal as a service that comes back quickly when it goes down mid-gig. Next to the running pedal it keeps
+# a warm standby: a second copy of buttonWithSFX.py that has already paid for starting Python, importing pyo and
+# the pedal's modules and reading the presets, and waits before taking the footswitches and the sound card. When
+# the running pedal exits or crashes, the standby is told to go, boots the audio server and picks up the state the
+# pedal saved on its last change, and a fresh standby is started behind it. The standby can't hold the audio
+# server itself, as the sound card is the running pedal's until it goes away.
+#
+# Arguments after -- are passed on to the pedal. Run it from systemd with Restart=always, so the service itself
+# comes back too:
+#
+#     python pedalService.py -- --preset Ambient --control-port 9000
+#
+# Passing --measure instead times a cold start of the pedal and a takeover by the standby after the pedal is killed,
+# checks that the standby comes back on the effect that was selected, and compares both against the startup budget.
+# It runs the pedal on the offline audio host and simulated footswitches, so it works on any machine with pyo.
+#
+#     python pedalService.py --measure --budget 3
+import argparse
+import collections
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PEDAL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "buttonWithSFX.py")
+
+# Seconds a pedal has to run to count as started, shorter runs in a row back off before the next takeover
+MIN_UPTIME = 10.0
+MAX_BACKOFF = 30.0
+
+# Seconds from launching the pedal until it is ready, cold and when taking over from the standby
+COLD_START_BUDGET = 3.0
+TAKEOVER_BUDGET = 1.0
+
+# The modules the pedal imports only when their flags ask for them
+DEFERRED_MODULES = ["multicore", "numpyEffects", "effectCache", "telemetry", "looper"]
+
+# Number of the latest output lines of a pedal kept around, for the checks and for reporting a failed start
+OUTPUT_LINES = 200
+
+
+class _Pedal(object):
+    # One copy of the pedal and the thread forwarding its output, which calls onExit once the pedal has exited
+    def __init__(self, arguments, standby, log, onExit=None):
+        command = [sys.executable, "-u", PEDAL_SCRIPT] + list(arguments) + (["--standby"] if standby else [])
+        self.standby = standby
+        self.launched = time.perf_counter()
+        self.started = None if standby else self.launched
+        self.ready = None
+        self.readyEvent = threading.Event()
+        self.standingBy = threading.Event()
+        self.exited = threading.Event()
+        self.lines = collections.deque(maxlen=OUTPUT_LINES)
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+        self._log = log
+        self._onExit = onExit
+        self._thread = threading.Thread(target=self._forward, name="Pedal %d" % self.process.pid)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _forward(self):
+        for line in iter(self.process.stdout.readline, b""):
+            line = line.decode("utf-8", "replace").rstrip()
+            self.lines.append(line)
+            if line.startswith("Ready in"):
+                self.ready = time.perf_counter()
+                self.readyEvent.set()
+            elif line == "Standing by":
+                self.standingBy.set()
+            self._log(line)
+        self.process.wait()
+        self.exited.set()
+        if self._onExit is not None:
+            self._onExit()
+
+    def go(self):
+        # Tells a standby to take over
+        self.started = time.perf_counter()
+        self.process.stdin.write(b"go\n")
+        self.process.stdin.flush()
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def stop(self, timeout=5.0):
+        if self.alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._thread.join()
+
+
+class PedalService(object):
+    def __init__(self, arguments=(), standby=True, log=print):
+        self._arguments = list(arguments)
+        self._standbyEnabled = standby
+        self._log = log
+        self._stopping = threading.Event()
+        # Set whenever a pedal exits or the service is stopped, which is all run() waits for
+        self._wake = threading.Event()
+        self._quickExits = 0
+        self.active = None
+        self.standby = None
+        self.takeovers = 0
+
+    def _spawnStandby(self):
+        self.standby = _Pedal(self._arguments, True, self._log, self._wake.set) if self._standbyEnabled else None
+
+    def start(self):
+        self.active = _Pedal(self._arguments, False, self._log, self._wake.set)
+        self._spawnStandby()
+        return self
+
+    def _takeOver(self):
+        # Replaces the pedal that went away with the standby, or a cold start if there is none
+        uptime = time.perf_counter() - self.active.started
+        self._quickExits = self._quickExits + 1 if uptime < MIN_UPTIME else 0
+        if self._quickExits > 1:
+            # Something is wrong with every start, so don't spin on it
+            backoff = min(2 ** (self._quickExits - 2), MAX_BACKOFF)
+            self._log("The pedal went down after %.1f s again, waiting %.0f s" % (uptime, backoff))
+            if self._stopping.wait(backoff):
+                return
+        if self.standby is not None and self.standby.alive():
+            self.active = self.standby
+            self.active.go()
+        else:
+            self.active = _Pedal(self._arguments, False, self._log, self._wake.set)
+        self._spawnStandby()
+        self.takeovers += 1
+
+    def run(self, takeovers=None):
+        # Watches the pedal and takes over whenever it goes away, until stopped or after the given number of takeovers
+        while not self._stopping.is_set():
+            # Sleeps until a pedal exits or the service is stopped. The standby exiting wakes it too, so it only
+            # takes over once the running pedal has exited.
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopping.is_set() or not self.active.exited.is_set():
+                continue
+            self._log("The pedal exited with %d, taking over" % self.active.process.returncode)
+            self.active.stop()
+            if takeovers is not None and self.takeovers >= takeovers:
+                break
+            self._takeOver()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        for pedal in (self.active, self.standby):
+            if pedal is not None:
+                pedal.stop()
+        return self
+
+
+def measureDeferredImports():
+    # Seconds the modules the pedal now defers would add to its start, imported after pyo as the pedal used to
+    code = ("import time, pyo; start = time.perf_counter(); import %s; print(time.perf_counter() - start)" %
+            ", ".join(DEFERRED_MODULES))
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(PEDAL_SCRIPT),
+                                     stderr=subprocess.DEVNULL)
+    return float(output.decode().split()[-1])
+
+
+def measure(arguments, budget=COLD_START_BUDGET, takeoverBudget=TAKEOVER_BUDGET, port=9123):
+    from controlServer import sendOsc
+    directory = tempfile.mkdtemp()
+    state = os.path.join(directory, "pedal.json")
+    arguments = list(arguments) + ["--host", "offline", "--simulate", "--state", state, "--control-port", str(port)]
+    failures = []
+    service = PedalService(arguments, log=lambda line: None).start()
+    watcher = threading.Thread(target=service.run, kwargs={"takeovers": 1})
+    watcher.start()
+    try:
+        first = service.active
+        if not first.readyEvent.wait(60) or not service.standby.standingBy.wait(60):
+            raise RuntimeError("the pedal didn't start:\n%s" % "\n".join(first.lines))
+        cold = first.ready - first.launched
+        print("Cold start: ready %.2f s after launch, %s" % (cold, first.lines[-1]))
+
+        # Select an effect and wait for the state to be saved, then crash the pedal
+        sendOsc("/pedal/effect", "Delay", port=port)
+        deadline = time.perf_counter() + 5
+        while '"effect": "Delay"' not in (open(state).read() if os.path.exists(state) else ""):
+            if time.perf_counter() > deadline:
+                raise RuntimeError("the pedal didn't save its state")
+            time.sleep(0.01)
+        killed = time.perf_counter()
+        first.process.kill()
+        watcher.join(10)
+        second = service.active
+        if second is first or not second.readyEvent.wait(60):
+            raise RuntimeError("the standby didn't take over")
+        takeover = second.ready - killed
+        print("Takeover by the standby: ready %.2f s after the pedal was killed, %s" % (takeover, second.lines[-1]))
+        if "Restored Delay, on" not in second.lines:
+            failures.append("the standby didn't come back on the Delay")
+    finally:
+        service.stop()
+        watcher.join()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    deferred = measureDeferredImports()
+    print("Importing %s up front would add %.2f s to every start" % (", ".join(DEFERRED_MODULES), deferred))
+    if cold > budget:
+        failures.append("the cold start took %.2f s, over the budget of %.2f s" % (cold, budget))
+    if takeover > takeoverBudget:
+        failures.append("the takeover took %.2f s, over the budget of %.2f s" % (takeover, takeoverBudget))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pedal with a warm standby that takes over when it goes down",
+                                     usage="%(prog)s [options] [-- pedal arguments]")
+    parser.add_argument("--no-standby", action="store_true", help="restart the pedal cold instead of keeping a standby")
+    parser.add_argument("--measure", action="store_true",
+                        help="time a cold start and a takeover on the offline host and check them against the budget")
+    parser.add_argument("--budget", type=float, default=COLD_START_BUDGET, help="seconds a cold start may take")
+    parser.add_argument("--takeover-budget", type=float, default=TAKEOVER_BUDGET,
+                        help="seconds a takeover by the standby may take")
+    argv = sys.argv[1:]
+    pedalArguments = []
+    if "--" in argv:
+        pedalArguments = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        failures = measure(pedalArguments, args.budget, args.takeover_budget)
+        for failure in failures:
+            print(failure)
+        if failures:
+            raise SystemExit(1)
+        return
+    service = PedalService(pedalArguments, standby=not args.no_standby).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: service.stop())
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# Saves the state of the pedal so it comes back the way it was left after a crash or a power cut. The selected
+# effect, whether it is on, the preset, the tempo and the parameters changed live are written to a small JSON file
+# on every change, and read back when the pedal starts. Every write goes to a temporary file next to the state file,
+# which is synced to disk and then renamed over it, so pulling the plug mid-write leaves either the old state or the
+# new one and never half of each.
+#
+# Changes come from the main loop, and parameter changes from the audio thread, so making a change only flags the
+# state as dirty. A writer thread then saves it a moment later, which folds a burst of knob turns into a single
+# write and keeps the file system off the audio thread.
+#
+# Running this file kills a process writing states over and over at random moments, and checks that the state
+# file can be read every time and never goes backwards, along with how long a write takes.
+#
+#     python pedalState.py --kills 50
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Where the pedal keeps its state
+STATE_PATH = os.path.join(os.path.expanduser("~"), ".local", "state", "cheesywaves", "pedal.json")
+
+# Seconds the writer waits after a change before saving, to fold bursts of changes into one write
+WRITE_INTERVAL = 0.05
+
+# Bumped when the layout of the state changes, older files are then ignored
+VERSION = 1
+
+
+def writeAtomically(path, data):
+    # Writes data to path as JSON by renaming a synced temporary file over it
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    handle, temporary = tempfile.mkstemp(dir=directory, prefix=".state-", suffix=".tmp")
+    try:
+        with os.fdopen(handle, "w") as stream:
+            json.dump(data, stream, sort_keys=True)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    # The rename itself only lasts once the directory is synced too
+    handle = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(handle)
+    finally:
+        os.close(handle)
+
+
+def _temporaries(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith(".state-") and name.endswith(".tmp")]
+
+
+def loadState(path):
+    # Reads the saved state, or returns None if there is none or it can't be used
+    try:
+        with open(path) as stream:
+            state = json.load(stream)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get("version") != VERSION:
+        return None
+    return state
+
+
+def restoreParameters(registry, parameters):
+    # Sets the parameters saved by effect name on the registry, returning how many were set. Effects and parameters
+    # that no longer exist are skipped, as the saved state may come from an older version of the pedal.
+    restored = 0
+    for name, values in parameters.items():
+        if name not in registry.names:
+            continue
+        index = registry.indexOf(name)
+        for param, value in values.items():
+            try:
+                registry.setParameter(index, param, value)
+            except ValueError:
+                continue
+            restored += 1
+    return restored
+
+
+class StateStore(object):
+    def __init__(self, path=STATE_PATH, snapshot=None, interval=WRITE_INTERVAL):
+        # snapshot is called on the writer thread and returns the state to save as a dict
+        self.path = path
+        self._snapshot = snapshot
+        self._interval = interval
+        self._dirty = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.failures = 0
+        self.writeTime = 0.0
+
+    def changed(self):
+        # Flags the state as changed. Cheap enough for the audio thread.
+        self._dirty.set()
+
+    def save(self):
+        # Writes the current state now, returning whether it was written
+        with self._lock:
+            self._dirty.clear()
+            state = dict(self._snapshot())
+            state["version"] = VERSION
+            start = time.perf_counter()
+            try:
+                writeAtomically(self.path, state)
+            except OSError as error:
+                # A full or read-only disk mustn't take the pedal down with it
+                self.failures += 1
+                print("Couldn't save the pedal state to %s: %s" % (self.path, error))
+                return False
+            self.writeTime += time.perf_counter() - start
+            self.writes += 1
+            return True
+
+    def _run(self):
+        while True:
+            self._dirty.wait()
+            if self._stopping:
+                break
+            time.sleep(self._interval)
+            self.save()
+
+    def start(self):
+        # A writer killed mid-write leaves its temporary file behind, which nobody else would clear up
+        for temporary in _temporaries(self.path):
+            os.remove(temporary)
+        self._thread = threading.Thread(target=self._run, name="StateStore")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # Stops the writer, saving any change it hadn't got to yet
+        if self._thread is not None:
+            self._stopping = True
+            pending = self._dirty.is_set()
+            self._dirty.set()
+            self._thread.join()
+            self._thread = None
+            if pending:
+                self.save()
+        return self
+
+
+def _writeForever(path, count):
+    # Writes states with a growing counter as fast as it can, until killed
+    store = StateStore(path, lambda: {"count": count, "parameters": {"Delay": {"feedback": random.random()}}})
+    while True:
+        count += 1
+        store.save()
+
+
+def check(kills, path=None):
+    directory = tempfile.mkdtemp()
+    path = path or os.path.join(directory, "pedal.json")
+    failures = []
+    last = 0
+    try:
+        for kill in range(kills):
+            writer = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--write-forever", path,
+                                       "--count", str(last)])
+            time.sleep(random.uniform(0.05, 0.3))
+            writer.kill()
+            writer.wait()
+            state = loadState(path)
+            if state is None:
+                failures.append("kill %d left a state file that can't be read" % kill)
+                continue
+            if state["count"] < last:
+                failures.append("kill %d left count %d after %d" % (kill, state["count"], last))
+            last = state["count"]
+        temporaries = len(_temporaries(path))
+        store = StateStore(path, lambda: {"count": last, "parameters": {}}).start()
+        for i in range(50):
+            store.save()
+        store.stop()
+        if _temporaries(path):
+            failures.append("starting the store left %d temporary files behind" % len(_temporaries(path)))
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    print("%d kills, %d states read back, %d temporary files left behind by the kills, %.2f ms per write" % (
+        kills, kills - len(failures), temporaries, store.writeTime / store.writes * 1000))
+    for failure in failures:
+        print(failure)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the pedal state survives being killed mid-write")
+    parser.add_argument("--kills", type=int, default=50, help="times to kill the writer")
+    parser.add_argument("--write-forever", metavar="PATH", help=argparse.SUPPRESS)
+    parser.add_argument("--count", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.write_forever:
+        _writeForever(args.write_forever, args.count)
+    if check(args.kills):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
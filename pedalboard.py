@@ -0,0 +1,281 @@
+# A pedalboard of effects played in series, like a row of stompboxes. Each slot of the board holds one of the
+# pedal's effects, and the output of every slot feeds the input of the next one, so Distortion -> Flanger ->
+# Reverb is three slots in that order. A single input node feeds the first slot, instead of every effect
+# tapping the guitar input on its own and being summed in parallel.
+#
+# Every slot can be enabled or bypassed on its own. A bypassed slot passes its input straight through and stops
+# its effect chain, so it costs no CPU. Enabling, bypassing, inserting, removing and moving slots all crossfade
+# over a short fade time rather than cutting the audio. When given a preset bank, every slot is set to the current
+# preset as it is built, and when given a tempo clock, every slot is locked to it, like the effect registry does.
+#
+# The pedal plays a pedalboard when started with --chain, the first button turning the selected slot on and off
+# and the second stepping through the slots.
+#
+#     python buttonWithSFX.py --chain Distortion Flanger Reverb
+#     python pedalboard.py Distortion Flanger Reverb
+import argparse
+import math
+import threading
+
+from pyo import CallAfter, Cos, InputFader, Mix, Sig, Sin, SigTo
+
+from effects import EFFECTS
+
+# Default crossfade time in seconds for re-routing the board and for bypassing slots
+FADE_TIME = 0.05
+
+# Seconds a slot's output takes to switch between the crossfade and the branch it settled on, which sound the same
+SWAP_TIME = 0.002
+
+
+# A single position on the pedalboard. The slot's InputFader is where the previous slot (or the guitar) plugs
+# in, so re-routing the board only has to crossfade the fader to a new source. Bypassing a slot crossfades with
+# equal power between the dry input and the effect. Like the decks of the signal graph, the two are weighted by the
+# cosine and the sine of a single ramp, computed for every sample, where a Selector would only move its gains once
+# per buffer and click.
+#
+# The crossfade only runs while the slot is being enabled or bypassed. The rest of the time the slot's output
+# passes the branch that is heard, the effect or the dry input, straight on to the next slot, and the ramp, the
+# gains and their mix are stopped. A single CallAfter, built with the slot, switches back to the heard branch once
+# the ramp has arrived, where the crossfade sounds exactly like it.
+#
+# Effects like the Reverb and the Flanger put out more audio streams than they take in, and pyo expands every
+# following object to match, so the effect output is mixed down to the board's channel count before it is
+# passed on. Otherwise every slot down the chain would run several copies of itself. An effect that already puts
+# out the board's channel count is passed on as it is.
+class EffectSlot(object):
+    def __init__(self, name, factory, source, enabled=True, fadetime=FADE_TIME, chnls=1, presets=None, clock=None):
+        self.name = name
+        self.source = source
+        self.enabled = enabled
+        self._fadetime = fadetime
+        # Held by the main thread while it switches the slot, the audio thread never waits for it
+        self._lock = threading.Lock()
+
+        self._in = InputFader(source)
+        self.chain = factory(self._in) if clock is None else factory(self._in, clock=clock)
+        if presets is not None:
+            presets.applyTo(self.chain)
+        output = self.chain.output
+        self._wet = output if len(output) == chnls else Mix(output, voices=chnls)
+        # The ramp runs from 0, only the dry input heard, to a quarter turn, only the effect heard
+        self._mix = SigTo(1.0 if enabled else 0.0, time=fadetime, mul=math.pi / 2)
+        self._gains = [Cos(self._mix), Sin(self._mix)]
+        self._weighted = [Sig(self._in, mul=self._gains[0]), Sig(self._wet, mul=self._gains[1])]
+        self._fade = Mix(self._weighted, voices=chnls)
+        self._heard = self._branch()
+        self.output = InputFader(self._heard)
+        self._settle = CallAfter(self._settled, time=fadetime + SWAP_TIME).stop()
+        self._stopFade()
+        if not enabled:
+            self.chain.stop()
+            self._wet.stop()
+
+    def _branch(self):
+        # The branch heard once the slot has settled
+        return self._wet if self.enabled else self._in
+
+    def _route(self, branch):
+        if branch is not self._heard:
+            self._heard = branch
+            self.output.setInput(branch, SWAP_TIME)
+
+    def _fadeObjects(self):
+        return [self._mix, self._fade] + self._gains + self._weighted
+
+    def _stopFade(self, wait=0):
+        for obj in self._fadeObjects():
+            obj.stop(wait)
+
+    def setSource(self, source):
+        # Plugs the slot into a new source, crossfading from the old one
+        if source is not self.source:
+            self.source = source
+            self._in.setInput(source, self._fadetime)
+
+    def setEnabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        with self._lock:
+            self.enabled = enabled
+            # The crossfade starts where the heard branch is, so the output can switch over to it straight away
+            for obj in self._fadeObjects():
+                obj.play()
+            if enabled:
+                self.chain.play()
+                self._wet.play()
+            self._route(self._fade)
+            self._mix.value = 1.0 if enabled else 0.0
+            self._settle.play()
+
+    def _settled(self):
+        # Called on the audio thread once the ramp has arrived. When the main thread holds the lock it is switching
+        # the slot again, which starts the CallAfter over, or stopping or restarting the slot, which settles it.
+        if not self._lock.acquire(False):
+            return
+        try:
+            self._route(self._branch())
+            # The crossfade and a bypassed effect keep running until the output has switched away from them
+            self._stopFade(self._fadetime)
+            if not self.enabled:
+                self.chain.stop(self._fadetime)
+                self._wet.stop(self._fadetime)
+        finally:
+            self._lock.release()
+
+    def play(self):
+        # Starts the slot again after it was stopped, settled, the effect only if the slot is enabled
+        with self._lock:
+            self._settle.stop()
+            self._stopFade()
+            self._route(self._branch())
+            self._in.play()
+            self.output.play()
+            if self.enabled:
+                self.chain.play()
+                self._wet.play()
+
+    def stop(self, wait=0):
+        with self._lock:
+            self._settle.stop()
+            self.chain.stop(wait)
+            self._wet.stop(wait)
+            self._stopFade(wait)
+            self.output.stop(wait)
+            self._in.stop(wait)
+
+
+class Pedalboard(object):
+    def __init__(self, source, factories=EFFECTS, fadetime=FADE_TIME, chnls=1, presets=None, clock=None):
+        self._source = source
+        self._presets = presets
+        self._clock = clock
+        self._factories = dict(factories)
+        self._fadetime = fadetime
+        self._chnls = chnls
+        self._slots = []
+        self._out = InputFader(source)
+
+        # Slots that were removed from the board keep playing until they have faded out, then get released
+        self._retired = []
+        self._release = None
+
+    @property
+    def slots(self):
+        return list(self._slots)
+
+    @property
+    def names(self):
+        return [slot.name for slot in self._slots]
+
+    @property
+    def output(self):
+        return self._out
+
+    def __len__(self):
+        return len(self._slots)
+
+    def append(self, name, enabled=True):
+        return self.insert(len(self._slots), name, enabled)
+
+    def insert(self, position, name, enabled=True):
+        # Builds the named effect into a new slot at the given position of the chain
+        if name not in self._factories:
+            raise ValueError("Unknown effect: %s" % name)
+        position = max(0, min(position, len(self._slots)))
+        source = self._source if position == 0 else self._slots[position - 1].output
+        slot = EffectSlot(name, self._factories[name], source, enabled, self._fadetime, self._chnls, self._presets,
+                          self._clock)
+        self._slots.insert(position, slot)
+        self._reroute()
+        return slot
+
+    def remove(self, position):
+        slot = self._slots.pop(position)
+        self._reroute()
+        self._retire(slot)
+        return slot.name
+
+    def move(self, position, newPosition):
+        slot = self._slots.pop(position)
+        self._slots.insert(newPosition, slot)
+        self._reroute()
+
+    def setEnabled(self, position, enabled):
+        self._slots[position].setEnabled(enabled)
+
+    def toggle(self, position):
+        slot = self._slots[position]
+        slot.setEnabled(not slot.enabled)
+        return slot.enabled
+
+    def enabled(self):
+        # Whether every slot is enabled, in chain order
+        return [slot.enabled for slot in self._slots]
+
+    def _reroute(self):
+        # Walks the chain from the input to the output, plugging every slot into the one before it
+        source = self._source
+        for slot in self._slots:
+            slot.setSource(source)
+            source = slot.output
+        self._out.setInput(source, self._fadetime)
+
+    def _retire(self, slot):
+        self._retired.append(slot)
+        slot.stop(self._fadetime)
+        self._release = CallAfter(self._releaseRetired, time=self._fadetime * 2)
+
+    def _releaseRetired(self):
+        self._retired = []
+
+    def play(self, dur=0, delay=0):
+        # Starts the board again after it was stopped, like the signal graph does when fading to it
+        for slot in self._slots:
+            slot.play()
+        self._out.play(dur, delay)
+        return self
+
+    def out(self, chnl=0, inc=1, dur=0, delay=0):
+        self._out.out(chnl, inc, dur, delay)
+        return self
+
+    def stop(self, wait=0):
+        self._out.stop(wait)
+        for slot in self._slots:
+            slot.stop(wait)
+        return self
+
+
+def compareSerialParallel(names, dur=10.0, buffersize=256, sr=44100, repeats=3):
+    # Renders the named effects offline, once chained on a pedalboard and once the way the pedal used to stack
+    # effects, with every effect tapping the guitar on its own and all of them playing out in parallel.
+    # Returns the CPU time of both renders.
+    from pyo import Noise, Server
+    from cpuReport import measureScenario
+    factories = dict(EFFECTS)
+    server = Server(sr=sr, buffersize=buffersize, audio="offline")
+
+    def buildSerial():
+        board = Pedalboard(Noise(mul=.2))
+        for name in names:
+            board.append(name)
+        return board.out()
+
+    def buildParallel():
+        source = Noise(mul=.2)
+        return [factories[name](source).out() for name in names]
+
+    measureScenario(server, dur, 1, buildSerial)
+    return {"serial": measureScenario(server, dur, repeats, buildSerial),
+            "parallel": measureScenario(server, dur, repeats, buildParallel)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a serial pedalboard chain against parallel effects")
+    parser.add_argument("effects", nargs="*", default=["Distortion", "Flanger", "Reverb"])
+    parser.add_argument("--dur", type=float, default=10.0)
+    args = parser.parse_args()
+    result = compareSerialParallel(args.effects, args.dur)
+    print("%s: serial chain %.3f s CPU, parallel %.3f s CPU" % (" -> ".join(args.effects), result["serial"],
+                                                                result["parallel"]))
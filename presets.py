@@ -0,0 +1,137 @@
+# Preset bank for the pedal. A preset is a named set of parameter values for any of the effects, such as a deeper
+# Flanger sweep or a longer Delay, and the bank holds every preset read from a JSON file:
+#
+#     {"presets": {"Slow Sweep": {"Flanger": {"depth": 1.2, "lfofreq": .2}, "Tremolo": {"freq": 3}}}}
+#
+# Presets are resolved when the bank is loaded: every effect a preset leaves out falls back to the bank's
+# "Default" preset, and every name and value is checked then, the parameters and values against the ranges declared
+# in effects.py, so recalling a preset is a walk over a precomputed list of values. Recall only touches the
+# parameters whose value differs from the one currently set, and each of them is ramped in place through
+# EffectChain.setParameter(), so changing presets never rebuilds an effect and takes far less time than one buffer.
+#
+#     python presets.py --presets presets.json
+import argparse
+import collections
+import json
+import time
+
+from effects import EFFECTS, PARAMETER_RANGES
+
+# The preset every other preset falls back to, and the one the pedal starts with
+DEFAULT = "Default"
+
+
+class PresetBank(object):
+    def __init__(self, presets, factories=EFFECTS, ramptime=None):
+        # presets maps preset names to {effect name: {parameter: value}}
+        self._effectNames = [name for name, factory in factories]
+        self._ramptime = ramptime
+        defaults = presets.get(DEFAULT, {})
+        self._presets = collections.OrderedDict()
+        for name, effects in presets.items():
+            merged = {}
+            for effect, values in list(defaults.items()) + list(effects.items()):
+                merged.setdefault(effect, {}).update(values)
+            self._presets[name] = self._resolve(name, merged)
+        self.current = DEFAULT if DEFAULT in self._presets else None
+
+    def _resolve(self, name, effects):
+        # Turns a preset into {effect name: [(parameter, value), ...]}, in a fixed order
+        resolved = {}
+        for effect, values in effects.items():
+            if effect not in self._effectNames:
+                raise ValueError("Preset %s sets unknown effect %s" % (name, effect))
+            params = []
+            for param, value in sorted(values.items()):
+                if not isinstance(value, (int, float)):
+                    raise ValueError("Preset %s sets %s %s to %r, expected a number" % (name, effect, param, value))
+                if param not in PARAMETER_RANGES.get(effect, {}):
+                    raise ValueError("Preset %s sets unknown parameter %s of %s" % (name, param, effect))
+                low, high = PARAMETER_RANGES[effect][param]
+                if not low <= value <= high:
+                    raise ValueError("Preset %s sets %s %s to %g, outside its range of %g to %g" % (
+                        name, effect, param, value, low, high))
+                params.append((param, float(value)))
+            resolved[effect] = params
+        return resolved
+
+    @classmethod
+    def load(cls, path, factories=EFFECTS):
+        with open(path) as bank:
+            return cls(json.load(bank)["presets"], factories)
+
+    @property
+    def names(self):
+        return list(self._presets)
+
+    def __contains__(self, name):
+        return name in self._presets
+
+    def values(self, name=None):
+        # The resolved parameter values of a preset, the current one by default
+        preset = self._presets[self.current if name is None else name]
+        return dict((effect, dict(params)) for effect, params in preset.items())
+
+    def applyTo(self, chain):
+        # Sets an effect chain to the current preset, returning how many parameters were changed. Used for every
+        # chain the registry builds, and for every built chain when a preset is recalled.
+        if self.current is None:
+            return 0
+        changed = 0
+        for param, value in self._presets[self.current].get(chain.name, ()):
+            if param not in chain.parameters:
+                raise ValueError("Preset %s sets unknown parameter %s of %s" % (self.current, param, chain.name))
+            if self._ramptime is None:
+                changed += chain.setParameter(param, value)
+            else:
+                changed += chain.setParameter(param, value, self._ramptime)
+        return changed
+
+    def recall(self, name, chains):
+        # Switches to the named preset and applies it to the given built effect chains
+        if name not in self._presets:
+            raise ValueError("Unknown preset: %s" % name)
+        self.current = name
+        return sum(self.applyTo(chain) for chain in chains)
+
+
+def measureRecall(bank, buffersize=128, sr=44100):
+    # Builds every effect on an offline server and recalls each preset of the bank in turn, returning the slowest
+    # recall in seconds along with the duration of one audio buffer
+    from pyo import Server, Noise
+    from effectRegistry import EffectRegistry
+    server = Server(sr=sr, buffersize=buffersize, audio="offline")
+    server.setVerbosity(0)
+    server.boot()
+    source = Noise(mul=.2)
+    registry = EffectRegistry(source, lazy=False, presets=bank)
+    chains = registry.built()
+    slowest = 0.0
+    for name in bank.names:
+        start = time.perf_counter()
+        bank.recall(name, chains)
+        slowest = max(slowest, time.perf_counter() - start)
+    server.shutdown()
+    return slowest, buffersize / float(sr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a preset bank and time how long recalling its presets takes")
+    parser.add_argument("--presets", default="presets.json")
+    parser.add_argument("--buffersize", type=int, default=128)
+    parser.add_argument("--sr", type=int, default=44100)
+    args = parser.parse_args()
+    bank = PresetBank.load(args.presets)
+    print("Presets: %s" % ", ".join(bank.names))
+    # A parameter the effect doesn't declare is caught when the bank is loaded, not when it is first applied
+    try:
+        PresetBank({"Typo": {"Flanger": {"dpeth": 1.0}}})
+    except ValueError as error:
+        print("Rejected: %s" % error)
+    else:
+        print("An undeclared parameter got through")
+        raise SystemExit(1)
+    slowest, bufferTime = measureRecall(bank, args.buffersize, args.sr)
+    print("Slowest recall: %.3f ms, one buffer is %.3f ms" % (slowest * 1000, bufferTime * 1000))
+    if slowest > bufferTime:
+        raise SystemExit(1)
@@ -0,0 +1,241 @@
+# Batch re-amping of recorded DI guitar tracks through the pedal's effects, for re-amping sessions and A/B reviews.
+# Every track is rendered on pyo's offline server, so nothing here touches the footswitches, RPi.GPIO or a sound
+# card, and it runs on any machine with pyo installed. The track is streamed from disk a buffer at a time and the
+# result written back the same way, so memory stays bounded however long the recording is. WAV, FLAC and AIFF are
+# read and written, the output format following the extension given with --format, as far as the libsndfile pyo
+# was built with supports them; some pyo wheels come without FLAC, and the files it can't handle are reported.
+#
+# The effects come from the same factories and preset bank as the pedal, and several effects can be chained in the
+# order given, like pedals on a board. The tracks are shared out over a pool of processes, one fresh process per
+# track as pyo allows one server per process, and the run reports how many files it got through per minute and
+# how many times faster than realtime it rendered.
+#
+#     python reamp.py takes/*.wav --effects Distortion Delay --preset Ambient --output-dir reamped
+#
+# Passing --check instead re-amps a few synthetic DI tracks, WAV and FLAC, and checks the length of every result,
+# that every output channel carries sound without clipping, and that no worker loaded the GPIO library.
+#
+#     python reamp.py --check
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from effects import EFFECTS
+from measurements import formatBytes, peakMemory
+
+# Seconds rendered past the end of every track, so the Reverb and Delay tails aren't cut off
+TAIL_TIME = 2.0
+
+# Offline buffer size, larger than the pedal's as nobody is waiting on the result
+BUFFER_SIZE = 1024
+
+# Sample types pyo writes, by bit depth
+SAMPLE_TYPES = {16: 0, 24: 1, 32: 3}
+
+# Channels of the rendered files
+OUTPUT_CHANNELS = 2
+
+# Quietest peak the check accepts on every output channel of a render
+MIN_PEAK = 0.01
+
+
+def outputPath(path, outputDir, suffix, fmt=None):
+    base, ext = os.path.splitext(os.path.basename(path))
+    return os.path.join(outputDir, "%s%s.%s" % (base, suffix, fmt or ext.lstrip(".").lower()))
+
+
+def _reampOne(job):
+    # Renders one track through the effect chain. Runs in its own process.
+    from pyo import Mix, PeakAmp, Server, SfPlayer, sndinfo
+    from presets import PresetBank
+    path, output, effects, presetsPath, preset, bpm, tail, buffersize, bits = job
+    info = sndinfo(path)
+    if info is None:
+        return {"input": path, "output": output, "error": "pyo can't read this file"}
+    frames, dur, sr, chnls = info[:4]
+    server = Server(sr=sr, nchnls=OUTPUT_CHANNELS, buffersize=buffersize, duplex=0, audio="offline")
+    server.setVerbosity(0)
+    server.boot()
+    server.recordOptions(dur=dur + tail, filename=output, sampletype=SAMPLE_TYPES[bits])
+    presets = None
+    if presetsPath:
+        presets = PresetBank.load(presetsPath)
+        presets.current = preset or presets.current
+    clock = None
+    if bpm:
+        from tempo import TempoClock
+        clock = TempoClock(bpm)
+    # The pedal reads a single input channel, so stereo tracks are mixed down first, at the level of one channel
+    factories = dict(EFFECTS)
+    chains = []
+    source = Mix(SfPlayer(path), voices=1, mul=1.0 / chnls)
+    for name in effects:
+        chain = factories[name](source) if clock is None else factories[name](source, clock=clock)
+        if presets is not None:
+            presets.applyTo(chain)
+        chains.append(chain.play())
+        source = chain.output
+    # Spread over every output channel, a mono effect on all of them, a stereo one left and right
+    downmix = Mix(source, voices=OUTPUT_CHANNELS).out()
+    peaks = [0.0] * OUTPUT_CHANNELS
+
+    def trackPeaks(*values):
+        peaks[:] = [max(peak, value) for peak, value in zip(peaks, values)]
+    meter = PeakAmp(downmix, function=trackPeaks)
+    wallStart = time.perf_counter()
+    cpuStart = time.process_time()
+    server.start()
+    cpu = time.process_time() - cpuStart
+    wall = time.perf_counter() - wallStart
+    del chains, source, downmix, meter
+    server.shutdown()
+    if not os.path.getsize(output):
+        # libsndfile leaves an empty file behind for a format it was built without, FLAC in some pyo wheels
+        os.remove(output)
+        return {"input": path, "output": output, "error": "pyo can't write %s files" % os.path.splitext(output)[1]}
+    return {
+        "input": path,
+        "output": output,
+        "dur": dur,
+        "wall": wall,
+        "cpu": cpu,
+        "realtimeFactor": (dur + tail) / wall if wall > 0 else float("inf"),
+        "peakMemory": peakMemory(),
+        "peaks": peaks,
+        "gpio": any(module.startswith("RPi") for module in sys.modules),
+    }
+
+
+def reampFiles(paths, outputDir, effects, presetsPath=None, preset=None, bpm=None, tail=TAIL_TIME,
+               buffersize=BUFFER_SIZE, bits=24, fmt=None, suffix="_reamped", jobs=None, report=print):
+    # Re-amps every file over a pool of processes, returning the results of every file and the totals of the run
+    if not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+    todo = [(path, outputPath(path, outputDir, suffix, fmt), list(effects), presetsPath, preset, bpm, tail,
+             buffersize, bits) for path in paths]
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(todo)))
+    context = multiprocessing.get_context("spawn")
+    results = []
+    start = time.perf_counter()
+    with context.Pool(processes=jobs, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(_reampOne, todo):
+            results.append(result)
+            if report is None:
+                continue
+            if "error" in result:
+                report("%-40s failed, %s" % (os.path.basename(result["input"]), result["error"]))
+            else:
+                report("%-40s %7.1f s of audio, %6.1fx realtime, %s peak" % (
+                    os.path.basename(result["output"]), result["dur"], result["realtimeFactor"],
+                    formatBytes(result["peakMemory"])))
+    elapsed = time.perf_counter() - start
+    done = [result for result in results if "error" not in result]
+    audio = sum(result["dur"] + tail for result in done)
+    totals = {
+        "files": len(done),
+        "failed": len(results) - len(done),
+        "jobs": jobs,
+        "elapsed": elapsed,
+        "audio": audio,
+        "filesPerMinute": len(done) * 60.0 / elapsed if elapsed > 0 else float("inf"),
+        # Seconds of audio rendered per second of wall time over the whole pool
+        "realtimeFactor": audio / elapsed if elapsed > 0 else float("inf"),
+    }
+    return results, totals
+
+
+def formatTotals(totals):
+    text = "%d files in %.1f s over %d processes: %.1f files per minute, %.1fx realtime" % (
+        totals["files"], totals["elapsed"], totals["jobs"], totals["filesPerMinute"], totals["realtimeFactor"])
+    if totals["failed"]:
+        text += ", %d failed" % totals["failed"]
+    return text
+
+
+def check(effects, jobs):
+    # Re-amps synthetic DI tracks to FLAC, re-amps those again to WAV, and checks every result. Some builds of pyo
+    # can't write FLAC, and AIFF stands in for it then.
+    from pyo import sndinfo
+    from benchmark import writeSyntheticDI
+    workdir = tempfile.mkdtemp()
+    failures = []
+    try:
+        inputs = [writeSyntheticDI(os.path.join(workdir, "di%d.wav" % i), dur=3.0 + i, seed=i) for i in range(3)]
+        for formats in (("flac", "aiff"), ("wav",)):
+            for fmt in formats:
+                results, totals = reampFiles(inputs, os.path.join(workdir, fmt), effects, tail=1.0, fmt=fmt,
+                                             jobs=jobs)
+                print(formatTotals(totals))
+                if totals["files"]:
+                    break
+                print("This build of pyo can't write %s files, trying the next format" % fmt.upper())
+            for result in results:
+                if "error" in result:
+                    failures.append("%s: %s" % (result["input"], result["error"]))
+                    continue
+                # The offline server renders whole buffers, so the file can run up to a buffer longer
+                dur, sr = sndinfo(result["output"])[1:3]
+                if not 0 <= dur - (result["dur"] + 1.0) <= BUFFER_SIZE / sr + 0.001:
+                    failures.append("%s is %.3f s long instead of %.3f s" % (
+                        result["output"], dur, result["dur"] + 1.0))
+                for channel, peak in enumerate(result["peaks"]):
+                    if not MIN_PEAK <= peak < 1.0:
+                        failures.append("%s peaks at %.3f on channel %d" % (result["output"], peak, channel))
+                if result["gpio"]:
+                    failures.append("rendering %s loaded RPi.GPIO" % result["input"])
+            inputs = [result["output"] for result in results if "error" not in result]
+    finally:
+        shutil.rmtree(workdir)
+    for failure in failures:
+        print(failure)
+    if failures:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-amp recorded DI tracks through the pedal's effects")
+    parser.add_argument("inputs", nargs="*", help="WAV, FLAC or AIFF DI tracks")
+    parser.add_argument("--effects", nargs="*", default=["Leslie Speaker"],
+                        help="effects to chain, in order, from the pedal's list")
+    parser.add_argument("--presets", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "presets.json"),
+                        help="JSON file with the preset bank")
+    parser.add_argument("--preset", help="preset to render with, the bank's Default preset if left out")
+    parser.add_argument("--bpm", type=float, help="lock the time-based effects to this tempo")
+    parser.add_argument("--output-dir", default="reamped")
+    parser.add_argument("--suffix", default="_reamped", help="added to the name of every rendered file")
+    parser.add_argument("--format", choices=["wav", "flac", "aiff"], help="output format, the input's if left out")
+    parser.add_argument("--bits", type=int, choices=sorted(SAMPLE_TYPES), default=24)
+    parser.add_argument("--tail", type=float, default=TAIL_TIME, help="seconds to render past the end of every track")
+    parser.add_argument("--buffersize", type=int, default=BUFFER_SIZE)
+    parser.add_argument("--jobs", type=int, help="processes to render with, one per core if left out")
+    parser.add_argument("--check", action="store_true", help="re-amp synthetic tracks and check the results")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.effects if name not in dict(EFFECTS)]
+    if unknown:
+        parser.error("unknown effects: %s" % ", ".join(unknown))
+    if args.check:
+        check(args.effects, args.jobs)
+        return
+    if not args.inputs:
+        parser.error("no tracks to re-amp")
+    if args.format == "flac" and args.bits == 32:
+        parser.error("FLAC only takes 16 or 24 bits")
+    if args.preset:
+        from presets import PresetBank
+        bank = PresetBank.load(args.presets)
+        if args.preset not in bank:
+            parser.error("unknown preset %s, the bank has %s" % (args.preset, ", ".join(bank.names)))
+    results, totals = reampFiles(args.inputs, args.output_dir, args.effects, args.presets, args.preset, args.bpm,
+                                 args.tail, args.buffersize, args.bits, args.format, args.suffix, args.jobs)
+    print(formatTotals(totals))
+    if totals["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
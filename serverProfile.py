@@ -0,0 +1,235 @@
+# Audio server profiles for the pedal. A profile collects every setting the pyo Server needs for live playing:
+# the sample rate, the buffer size, the audio host, the channel counts and which sound card devices to use.
+# Profiles are read from a JSON config file, and any setting can be overridden from the command line, so the
+# pedal no longer has to run with the default settings and their long round-trip latency.
+#
+#     {"host": "jack", "sr": 48000, "buffersize": 64, "ichnls": 1, "nchnls": 2}
+#
+# The auto-tune mode steps the buffer size down while watching for dropouts, and backs off to the last buffer
+# size that played cleanly. The DropoutMonitor used for this is also what the telemetry counts dropouts with.
+import json
+import statistics
+import time
+
+from pyo import Abs, Metro, Pattern, Server, Thresh, Timer, TrigFunc, pa_get_input_devices, pa_get_output_devices, \
+    pa_get_default_devices_from_host
+
+# Audio hosts a profile can ask for. On Linux PortAudio talks to ALSA, so "alsa" is PortAudio using the default
+# ALSA devices, while "offline" renders without a sound card for tests and benchmarks.
+HOSTS = ("portaudio", "alsa", "jack", "offline")
+
+# Buffer sizes tried by the auto-tune mode, from the safest to the fastest
+AUTOTUNE_SIZES = (1024, 512, 256, 128, 64, 32)
+
+
+class ServerProfile(object):
+    # Every setting of a profile along with its default value
+    DEFAULTS = {
+        "sr": 44100,
+        "buffersize": 256,
+        "host": "portaudio",
+        "ichnls": 1,
+        "nchnls": 2,
+        "duplex": 1,
+        "inputDevice": None,
+        "outputDevice": None,
+        "jackname": "cheesywaves",
+    }
+
+    def __init__(self, **settings):
+        for name, default in self.DEFAULTS.items():
+            setattr(self, name, default)
+        self.update(settings)
+
+    def update(self, settings):
+        for name, value in settings.items():
+            if name not in self.DEFAULTS:
+                raise ValueError("Unknown server setting: %s" % name)
+            if value is not None:
+                setattr(self, name, value)
+        if self.host not in HOSTS:
+            raise ValueError("Unknown audio host %s, expected one of %s" % (self.host, ", ".join(HOSTS)))
+        return self
+
+    def toDict(self):
+        return dict((name, getattr(self, name)) for name in self.DEFAULTS)
+
+    def nominalLatency(self):
+        # Round-trip latency added by the input and output buffers alone, in seconds
+        return 2.0 * self.buffersize / self.sr
+
+    def __repr__(self):
+        return "ServerProfile(%s)" % ", ".join("%s=%r" % item for item in sorted(self.toDict().items()))
+
+
+def loadProfile(path=None, overrides=None):
+    profile = ServerProfile()
+    if path is not None:
+        with open(path) as config:
+            profile.update(json.load(config))
+    if overrides:
+        profile.update(overrides)
+    return profile
+
+
+def addProfileArguments(parser):
+    group = parser.add_argument_group("audio server")
+    group.add_argument("--config", help="JSON file with the audio server profile")
+    group.add_argument("--host", choices=HOSTS, help="audio host")
+    group.add_argument("--sr", type=int, help="sample rate in Hz")
+    group.add_argument("--buffersize", type=int, help="samples per audio buffer")
+    group.add_argument("--ichnls", type=int, help="number of input channels")
+    group.add_argument("--nchnls", type=int, help="number of output channels")
+    group.add_argument("--input-device", help="input device index or part of its name")
+    group.add_argument("--output-device", help="output device index or part of its name")
+    group.add_argument("--autotune", action="store_true",
+                       help="step the buffer size down until dropouts appear, then back off")
+    group.add_argument("--measure-latency", action="store_true",
+                       help="measure the round trip with the output patched back into the input")
+    return group
+
+
+def profileFromArgs(args):
+    return loadProfile(args.config, {
+        "host": args.host,
+        "sr": args.sr,
+        "buffersize": args.buffersize,
+        "ichnls": args.ichnls,
+        "nchnls": args.nchnls,
+        "inputDevice": args.input_device,
+        "outputDevice": args.output_device,
+    })
+
+
+def _findDevice(device, names, indexes):
+    # Devices can be given by index or by a part of their name, like "USB" for a USB audio interface
+    if device is None or isinstance(device, int):
+        return device
+    if str(device).isdigit():
+        return int(device)
+    for name, index in zip(names, indexes):
+        if str(device).lower() in name.lower():
+            return index
+    raise ValueError("No audio device matching %r, available devices: %s" % (device, ", ".join(names)))
+
+
+def createServer(profile):
+    # Creates the pyo Server described by the profile. The server still has to be booted and started.
+    audio = "portaudio" if profile.host == "alsa" else profile.host
+    server = Server(sr=profile.sr, nchnls=profile.nchnls, buffersize=profile.buffersize, duplex=profile.duplex,
+                    audio=audio, jackname=profile.jackname, ichnls=profile.ichnls)
+    if audio == "portaudio":
+        inputDevice = _findDevice(profile.inputDevice, *pa_get_input_devices())
+        outputDevice = _findDevice(profile.outputDevice, *pa_get_output_devices())
+        if profile.host == "alsa" and (inputDevice is None or outputDevice is None):
+            defaultInput, defaultOutput = pa_get_default_devices_from_host("alsa")
+            inputDevice = defaultInput if inputDevice is None else inputDevice
+            outputDevice = defaultOutput if outputDevice is None else outputDevice
+        if inputDevice is not None:
+            server.setInputDevice(inputDevice)
+        if outputDevice is not None:
+            server.setOutputDevice(outputDevice)
+    return server
+
+
+def describeProfile(profile):
+    return "Audio server: %s, %d Hz, %d samples per buffer, %d in / %d out, nominal round trip %.1f ms" % (
+        profile.host, profile.sr, profile.buffersize, profile.ichnls, profile.nchnls, profile.nominalLatency() * 1000)
+
+
+# Counts dropouts of a running server. Every period, a Pattern compares how much time has passed on the wall
+# clock with how much audio the server has computed. When the server falls behind by more than a buffer
+# between two checks, the sound card ran out of audio and played a dropout (an xrun).
+class DropoutMonitor(object):
+    def __init__(self, server, period=0.25):
+        self._server = server
+        self._blockTime = float(server.getBufferSize()) / server.getSamplingRate()
+        self._period = period
+        self.dropouts = 0
+        self._pattern = None
+        self._lastLag = None
+
+    def _lag(self):
+        audioTime = float(self._server.getCurrentTimeInSamples() - self._startSamples) / self._server.getSamplingRate()
+        return (time.perf_counter() - self._startTime) - audioTime
+
+    def start(self):
+        self._startTime = time.perf_counter()
+        self._startSamples = self._server.getCurrentTimeInSamples()
+        self._lastLag = 0.0
+        if self._pattern is None:
+            self._pattern = Pattern(self._check, time=self._period)
+        self._pattern.play()
+        return self
+
+    def stop(self):
+        if self._pattern is not None:
+            self._pattern.stop()
+        return self
+
+    def _check(self):
+        # Only the change since the last check counts, so the slow drift between the sound card clock and the
+        # system clock doesn't add up to phantom dropouts over a long gig
+        lag = self._lag()
+        if lag - self._lastLag > self._blockTime:
+            self.dropouts += int((lag - self._lastLag) / self._blockTime)
+        self._lastLag = lag
+
+
+def autoTune(profile, buildGraph, trial=5.0, sizes=AUTOTUNE_SIZES, log=print):
+    # Plays the graph built by buildGraph() with smaller and smaller buffers, starting at the profile's buffer
+    # size, until dropouts appear. The profile is left at the last buffer size that played without any, and
+    # returned. If even the first size dropped out, none was found clean: the profile is left at the buffer size
+    # it came with and None is returned, so the caller can tell it wasn't measured as safe.
+    if profile.host == "offline":
+        log("Auto-tune needs a real-time audio host, keeping %d samples" % profile.buffersize)
+        return profile
+    best = None
+    configured = profile.buffersize
+    for size in [size for size in sizes if size <= configured]:
+        profile.buffersize = size
+        server = createServer(profile)
+        server.setVerbosity(1)
+        server.boot()
+        keep = buildGraph()
+        server.start()
+        monitor = DropoutMonitor(server).start()
+        time.sleep(trial)
+        monitor.stop()
+        server.stop()
+        del keep
+        server.shutdown()
+        log("Auto-tune: %d samples, %d dropouts in %.0f s" % (size, monitor.dropouts, trial))
+        if monitor.dropouts > 0:
+            break
+        best = size
+    if best is None:
+        profile.buffersize = configured
+        log("Auto-tune found no buffer size without dropouts, keeping the configured %d samples" % configured)
+        return None
+    profile.buffersize = best
+    log("Auto-tune settled on %d samples per buffer" % best)
+    return profile
+
+
+def measureRoundTrip(server, input, clicks=8, interval=0.25, threshold=0.2):
+    # Measures the real input-to-output latency of a running server. The output has to be patched back into
+    # the input with a cable: a click is played every interval, and Timer measures how long it takes until the
+    # input crosses the threshold. Returns the median latency in seconds, or None if no click came back.
+    metro = Metro(time=interval).out()
+    detect = Thresh(Abs(input), threshold=threshold)
+    timer = Timer(detect, metro)
+    measured = []
+
+    def onDetect():
+        value = timer.get()
+        if 0 < value < interval:
+            measured.append(value)
+
+    callback = TrigFunc(detect, onDetect)
+    time.sleep(clicks * interval + interval)
+    for obj in (callback, timer, detect, metro):
+        obj.stop()
+    if not measured:
+        return None
+    return statistics.median(measured)
@@ -0,0 +1,370 @@
+# State manager for the pedal's signal graph. The pedal is always in exactly one of two states: playing the
+# clean guitar signal, or playing one selected effect. SignalGraph remembers which source is currently
+# sounding and, when the footswitch state changes, only sends the start/stop calls needed to get from the
+# old state to the new one. Nothing is sent to the pyo server while the pedal sits idle.
+#
+# Switching crossfades instead of cutting from one source to the other. The graph has two decks, each an
+# InputFader, summed into a Mix that is the only object sent out. The decks are weighted by the cosine and the
+# sine of a single ramp, which is an equal-power crossfade computed for every sample, where a Selector would only
+# move its gains once per buffer. A switch plugs the new source into the silent deck, lets it run silently for a
+# moment so the clicks of an effect starting up from a stale delay line or filter aren't heard, ramps over to that
+# deck, and stops the old source once the fade is over, so at
+# most two sources are ever computing, and only while the fade lasts. A switch asked for during a fade waits
+# for the fade to end and then fades on from there, with only the last one asked for being played.
+#
+# Every call into the pyo server goes through _call(), which timestamps it, so callsPerSecond() can prove the
+# graph stays quiet between stomps, which the self-check does on the offline server. When onRamp is set, it is called from the audio thread with the target of every
+# fade as its ramp starts, which is when a switch is first heard, queued ones included.
+#
+#     python signalGraph.py [--fadetime 0.05]
+import argparse
+import collections
+import math
+import os
+import tempfile
+import threading
+import time
+
+from pyo import CallAfter, Cos, InputFader, Mix, Sig, Sin, SigTo
+
+# Default crossfade time in seconds between the old and the new source
+FADE_TIME = 0.05
+
+# The silent deck swaps to the new source almost at once, so it no longer carries any of the old source once the
+# ramp reaches it, and the old source is only stopped a little after the fade has ended
+DECK_SWAP_TIME = 0.002
+STOP_MARGIN = 0.01
+
+# Default time the new source plays silently on its deck before the fade starts, which is long enough for the
+# early reflections of the Reverb starting up to die down
+PREROLL_TIME = 0.05
+
+
+class SignalGraph(object):
+    def __init__(self, clean, effects, chnl=0, fadetime=FADE_TIME, chnls=1, preroll=PREROLL_TIME):
+        # clean is the dry guitar signal, effects the indexable list of effect objects to choose from. Every
+        # source is mixed down to chnls audio streams before it reaches a deck, since the effects put out
+        # different numbers of streams.
+        self._clean = clean
+        self._effects = effects
+        self._chnl = chnl
+        self._fadetime = fadetime
+        self._chnls = chnls
+        self._preroll = preroll
+
+        # None stands for the clean signal, otherwise the index of the sounding effect. The sounding object
+        # itself is kept as well, so it can be stopped without looking it up in the effect list again.
+        self._active = None
+        self._activeSource = clean
+        self._started = False
+
+        # The downmix of every source that is playing, by the id of the source
+        self._mixes = {}
+        self._decks = None
+        self._liveDeck = 0
+        self._fade = None
+        self._fadingFrom = None
+        self._fadingFromTarget = None
+        self._pending = None
+
+        # Called with the effect index, or None for the clean signal, when the ramp to it starts
+        self.onRamp = None
+
+        # Guards the fade state, which apply() changes on the main thread and the end of a fade on the audio
+        # thread. It is reentrant, since a fade ending starts the queued one while holding it.
+        self._stateLock = threading.RLock()
+        self._lock = threading.Lock()
+        self._callTimes = collections.deque(maxlen=10000)
+        self._totalCalls = 0
+
+    def _call(self, obj, method, *args):
+        with self._lock:
+            self._callTimes.append(time.monotonic())
+            self._totalCalls += 1
+        return getattr(obj, method)(*args)
+
+    def _source(self, target):
+        if target is None:
+            return self._clean
+        return self._effects[target]
+
+    def _downmix(self, source):
+        mix = self._mixes.get(id(source))
+        if mix is None or mix[0] is not source:
+            output = getattr(source, "output", source)
+            # Built stopped, as a prepared switch that is replaced before it is played shouldn't compute
+            mix = (source, Mix(output, voices=self._chnls).stop())
+            with self._stateLock:
+                self._mixes[id(source)] = mix
+        return mix[1]
+
+    def _prepare(self, target):
+        # Looks up the source of a target and builds its downmix. This is only ever done on the thread calling
+        # apply(), so the audio thread never has to build pyo objects when it starts a queued fade.
+        source = self._source(target)
+        return target, source, self._downmix(source)
+
+    def start(self):
+        # Puts the graph into its initial state, playing the clean signal
+        if not self._started:
+            mix = self._downmix(self._clean)
+            # The ramp runs from 0, only the first deck heard, to a quarter turn, only the second one heard
+            self._voice = SigTo(0, time=self._fadetime, mul=math.pi / 2)
+            self._gains = [Cos(self._voice), Sin(self._voice)]
+            self._decks = [InputFader(mix), InputFader(mix)]
+            self._weighted = [Sig(deck, mul=gain) for deck, gain in zip(self._decks, self._gains)]
+            self._output = Mix(self._weighted, voices=self._chnls)
+            self._call(self._clean, "play")
+            self._call(mix, "play")
+            self._call(self._output, "out", self._chnl)
+            self._activeSource = self._clean
+            self._started = True
+
+    def apply(self, sfxOn, effectIndex):
+        # Moves the graph to the given footswitch state, returning the number of server calls it took.
+        # Turning the same effect on twice, or changing the selection while bypassed, costs nothing.
+        self.start()
+        target = effectIndex if sfxOn else None
+        prepared = None
+        if target != self.requested:
+            prepared = self._prepare(target)
+        before = self._totalCalls
+        # The audio thread ends fades and starts queued ones under the same lock, so the graph is either fading
+        # or not for the whole of the check and the start of the switch
+        with self._stateLock:
+            if self._fadingFrom is not None:
+                # The switch is played once the running fade is over
+                replaced = self._pending
+                self._pending = prepared or self._prepare(target)
+                self._dropUnplayed(replaced)
+                return 0
+            if target == self._active:
+                return 0
+            self._fadeTo(*(prepared or self._prepare(target)))
+        return self._totalCalls - before
+
+    def _dropUnplayed(self, prepared):
+        # Lets go of the downmix of a queued switch that was replaced before it played, unless its source is
+        # sounding or about to, so the registry can free the effect once it evicts it
+        source = prepared[1]
+        if all(source is not other for other in (self._activeSource, self._fadingFrom, self._pending[1])):
+            self._mixes.pop(id(source), None)
+
+    def _pin(self, method, target):
+        # Pins or unpins an effect of the registry, so it isn't torn down while it is playing
+        pin = getattr(self._effects, method, None)
+        if pin is not None and target is not None:
+            pin(target)
+
+    def _fadeTo(self, target, source, mix):
+        # Always called with the state lock held
+        self._pin("pin", target)
+        self._mixes[id(source)] = (source, mix)
+        incoming = 1 - self._liveDeck
+        self._call(source, "play")
+        self._call(mix, "play")
+        self._call(self._decks[incoming], "setInput", mix, DECK_SWAP_TIME)
+        self._fadingFrom = self._activeSource
+        self._fadingFromTarget = self._active
+        self._pending = (target, source, mix)
+        self._liveDeck = incoming
+        self._active = target
+        self._activeSource = source
+        self._fade = CallAfter(self._startRamp, time=self._preroll)
+
+    def _startRamp(self):
+        # Called from the audio thread once the new source has run silently for the preroll
+        with self._stateLock:
+            self._call(self._voice, "setValue", self._liveDeck)
+            active = self._active
+            # The fade is over once the ramp has reached the new deck, which is when the old source is stopped
+            self._fade = CallAfter(self._fadeDone, time=self._fadetime + STOP_MARGIN)
+        if self.onRamp is not None:
+            self.onRamp(active)
+
+    def _fadeDone(self):
+        # Called from the audio thread at the end of a fade. The queued switch was prepared by apply(), so
+        # starting it only sends calls to objects that already exist.
+        with self._stateLock:
+            outgoing = self._fadingFrom
+            self._fadingFrom = None
+            if outgoing is not self._activeSource:
+                # The downmix is let go of along with the source, so an effect torn down by the registry isn't kept
+                self._call(self._mixes.pop(id(outgoing))[1], "stop")
+                self._call(outgoing, "stop")
+                self._pin("unpin", self._fadingFromTarget)
+            if self._pending[0] != self._active:
+                self._fadeTo(*self._pending)
+
+    @property
+    def active(self):
+        # Index of the sounding effect, or None while the clean signal is playing
+        return self._active
+
+    @property
+    def requested(self):
+        # The target the graph is on or heading for, the last one asked for while a fade runs
+        with self._stateLock:
+            return self._pending[0] if self._fadingFrom is not None else self._active
+
+    @property
+    def fading(self):
+        return self._fadingFrom is not None
+
+    @property
+    def output(self):
+        return self._output
+
+    @property
+    def totalCalls(self):
+        return self._totalCalls
+
+    def callsPerSecond(self, window=1.0):
+        # Number of server calls issued per second over the last window seconds
+        now = time.monotonic()
+        with self._lock:
+            recent = sum(1 for t in self._callTimes if now - t <= window)
+        return recent / window
+
+
+def renderSwitch(name, fadetime=FADE_TIME, dur=1.0, switchAt=0.5, sr=44100, buffersize=256):
+    # Renders the clean signal of a steady sine offline and switches to the named effect halfway through. Returns
+    # the rendered samples, the effect's own output recorded alongside, and the sample the switch happened at.
+    from pyo import NewTable, Server, Sine, TableRec
+    from effects import EFFECTS
+    factories = dict(EFFECTS)
+    server = Server(sr=sr, buffersize=buffersize, audio="offline", nchnls=1)
+    server.setVerbosity(0)
+    server.boot()
+    handle, filename = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    server.recordOptions(dur=dur, filename=filename)
+    source = Sine(freq=220, mul=.3)
+    chain = factories[name](source)
+    chain.stop()
+    graph = SignalGraph(Sig(source), [chain], fadetime=fadetime)
+    graph.start()
+    table = NewTable(dur)
+    recorder = TableRec(graph.output, table).play()
+    effectTable = NewTable(dur)
+    effectRecorder = TableRec(Mix(chain.output, voices=1), effectTable).play()
+    switch = CallAfter(lambda: graph.apply(True, 0), time=switchAt)
+    try:
+        server.start()
+    finally:
+        os.remove(filename)
+    samples = table.getTable()
+    effectSamples = effectTable.getTable()
+    del recorder, effectRecorder, switch
+    server.shutdown()
+    return samples, effectSamples, int(switchAt * sr)
+
+
+def discontinuity(samples, effectSamples, at, window, settle=0.2, sr=44100):
+    # Ratio of the largest sample-to-sample step in the window after a switch to the largest one of the clean
+    # signal before the switch, or of the effect's own output once it has settled. A click or a hard gap makes a
+    # step far larger than either of them, so a clean switch stays close to 1.
+    def largestStep(signal, start, end):
+        return max(abs(signal[i] - signal[i - 1]) for i in range(max(start, 1), min(end, len(signal))))
+    steady = max(largestStep(samples, at - window, at),
+                 largestStep(effectSamples, at + int(settle * sr), len(effectSamples)))
+    return largestStep(samples, at, at + 2 * window) / max(steady, 1e-9)
+
+
+def measureOverhead(fadetime=FADE_TIME, dur=10.0, sr=44100, buffersize=256, repeats=5):
+    # CPU the crossfading graph adds on top of sending the clean signal straight out, in seconds per buffer. While a
+    # fade runs, the only other extra work is the outgoing source itself, since at most two sources play at once.
+    # The two are rendered in turn, and the median, lowest and highest of the differences are returned, which can be
+    # negative when the overhead is lost in the timing noise.
+    from pyo import Noise, Server
+    from cpuReport import measureScenario
+    server = Server(sr=sr, buffersize=buffersize, audio="offline")
+    server.setVerbosity(0)
+
+    def buildDirect():
+        return Sig(Noise(mul=.2)).out()
+
+    def buildGraph():
+        graph = SignalGraph(Sig(Noise(mul=.2)), [], fadetime=fadetime)
+        graph.start()
+        return graph
+
+    measureScenario(server, dur, 1, buildDirect)
+    buffers = dur * sr / buffersize
+    differences = sorted((measureScenario(server, dur, 1, buildGraph) - measureScenario(server, dur, 1, buildDirect))
+                         / buffers for i in range(repeats))
+    return {"overhead": differences[len(differences) // 2], "low": differences[0], "high": differences[-1],
+            "repeats": repeats}
+
+
+def checkIdleCalls(fadetime=FADE_TIME, sr=44100, buffersize=256):
+    # Switches to an effect on the offline server and returns the server calls per second callsPerSecond() reads
+    # over the switch, and over the rest of the render once the fades are over and the pedal sits idle
+    from pyo import Noise, Server
+    from effects import EFFECTS
+    server = Server(sr=sr, buffersize=buffersize, audio="offline", nchnls=1)
+    server.setVerbosity(0)
+    server.boot()
+    handle, filename = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    switchAt = 0.1
+    idleAt = switchAt + PREROLL_TIME + fadetime + STOP_MARGIN + 0.1
+    server.recordOptions(dur=idleAt + 1.0, filename=filename)
+    source = Noise(mul=.2)
+    chain = EFFECTS[0][1](source)
+    chain.stop()
+    graph = SignalGraph(Sig(source), [chain], fadetime=fadetime)
+    graph.start()
+    started = []
+    readings = {}
+
+    def switch():
+        started.append(time.monotonic())
+        graph.apply(True, 0)
+
+    def idle():
+        readings["switch"] = graph.callsPerSecond(time.monotonic() - started[0])
+        started.append(time.monotonic())
+
+    def end():
+        # The window starts after the idle mark, so it only covers the time the pedal sat idle
+        readings["idle"] = graph.callsPerSecond(time.monotonic() - started[1])
+
+    timers = [CallAfter(switch, time=switchAt), CallAfter(idle, time=idleAt), CallAfter(end, time=idleAt + 0.95)]
+    try:
+        server.start()
+    finally:
+        os.remove(filename)
+    del timers
+    server.shutdown()
+    return readings
+
+
+if __name__ == "__main__":
+    # Renders a switch from the clean signal to every effect, once crossfaded and once cut like the pedal used to,
+    # and fails if any crossfaded switch makes a step larger than the audio around it
+    from effects import EFFECTS
+    parser = argparse.ArgumentParser(description="Check effect switches for clicks on the offline server")
+    parser.add_argument("--fadetime", type=float, default=FADE_TIME)
+    parser.add_argument("--tolerance", type=float, default=2.0,
+                        help="largest allowed step during a switch, relative to the steps around it")
+    args = parser.parse_args()
+    window = int(max(args.fadetime, 0.01) * 44100)
+    failed = []
+    for name, factory in EFFECTS:
+        crossfaded = discontinuity(*renderSwitch(name, args.fadetime), window=window)
+        cut = discontinuity(*renderSwitch(name, 0.0), window=window)
+        print("%-18s crossfaded %5.2f, cut %5.2f" % (name, crossfaded, cut))
+        if crossfaded > args.tolerance:
+            failed.append(name)
+    overhead = measureOverhead(args.fadetime)
+    print("Crossfade overhead: %.1f us per buffer, %.1f to %.1f us over %d renders" % (
+        overhead["overhead"] * 1e6, overhead["low"] * 1e6, overhead["high"] * 1e6, overhead["repeats"]))
+    calls = checkIdleCalls(args.fadetime)
+    print("Server calls: %.0f per second over a switch, %.0f per second idle" % (calls["switch"], calls["idle"]))
+    if failed:
+        print("Clicks when switching to %s" % ", ".join(failed))
+    if not calls["switch"] or calls["idle"]:
+        print("The graph should only call the server while switching")
+    if failed or not calls["switch"] or calls["idle"]:
+        raise SystemExit(1)
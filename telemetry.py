@@ -0,0 +1,296 @@
+# Telemetry for the pedal, so an overloaded Pi shows up as numbers instead of crackles. Once a period, the
+# telemetry samples the CPU time of the whole pedal process, which covers the audio thread along with the main loop,
+# the control server and every other thread, the dropouts counted by the DropoutMonitor and the effect that was
+# playing. Every footswitch stomp is recorded along with how long it took until the new effect was actually
+# audible: the signal graph lets the new source run silently for its preroll before ramping over to it, so a switch
+# counts as heard when the ramp starts, which the graph reports from the audio thread. A stomp the graph queues
+# behind a running fade is heard once its own fade starts. Records are kept in a bounded ring buffer, so the
+# telemetry can run for a whole gig without growing.
+#
+# The records are served as JSON over a small HTTP endpoint on localhost, and this module doubles as the CLI
+# that tails it from a shell on the Pi. "check" runs the telemetry on the offline server with a few stomps and
+# checks the records it serves.
+#
+#     python buttonWithSFX.py --telemetry-port 8765
+#     python telemetry.py tail --url http://127.0.0.1:8765
+#     python telemetry.py check
+import argparse
+import collections
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Kinds of records kept by the telemetry
+SAMPLE = "sample"
+SWITCH = "switch"
+
+
+# pyo is only imported by the Telemetry itself, so the tail CLI also runs on machines without it
+class Telemetry(object):
+    def __init__(self, server, capacity=1000, period=1.0, clock=time.perf_counter):
+        # clock is what stomps are timestamped with, the footswitch's perf_counter unless checking offline
+        from serverProfile import DropoutMonitor
+        self._server = server
+        self._period = period
+        self._clock = clock
+        self._records = collections.deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._monitor = DropoutMonitor(server)
+        self._thread = None
+        self._running = False
+        self._lastDropouts = 0
+        self._lastWall = time.perf_counter()
+        self._lastCpu = time.process_time()
+        # The name and press time of the first stomp asking for each target that hasn't been heard yet
+        self._requested = {}
+        self.activeEffect = "Clean"
+
+    def _append(self, record):
+        with self._lock:
+            self._seq += 1
+            record["seq"] = self._seq
+            record["time"] = time.time()
+            self._records.append(record)
+
+    def start(self):
+        # Starts counting dropouts, and sampling on a thread of its own unless the period is None, when whoever
+        # runs the telemetry calls sampleNow() instead
+        self._monitor.start()
+        if self._period is not None:
+            self._running = True
+            self._thread = threading.Thread(target=self._sampleLoop, name="telemetry", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._monitor.stop()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _sampleLoop(self):
+        while self._running:
+            time.sleep(self._period)
+            self.sampleNow()
+
+    def sampleNow(self):
+        # Records the CPU the process took since the previous sample
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        self.sample(100.0 * (cpu - self._lastCpu) / max(wall - self._lastWall, 1e-9))
+        self._lastWall = wall
+        self._lastCpu = cpu
+
+    def sample(self, processCpu):
+        # Records the process CPU load (in percent of one core) along with the dropouts since the previous sample
+        dropouts = self._monitor.dropouts
+        self._append({
+            "type": SAMPLE,
+            "processCpu": round(processCpu, 1),
+            "dropouts": dropouts - self._lastDropouts,
+            "dropoutsTotal": dropouts,
+            "effect": self.activeEffect,
+        })
+        self._lastDropouts = dropouts
+
+    def requestSwitch(self, target, effect, pressTime):
+        # Called when a stomp asks the signal graph for another target, the effect index or None for the clean
+        # signal, whether the graph switches at once or queues it. Later stomps for the same target before it is
+        # heard don't restart the clock.
+        with self._lock:
+            self._requested.setdefault(target, (effect, pressTime))
+
+    def switchAudible(self, target):
+        # Set as the signal graph's onRamp, called from the audio thread when the ramp to a target starts. Stomps
+        # for other targets made before this one were overtaken by it and are dropped, while later ones are still
+        # queued behind this fade.
+        with self._lock:
+            request = self._requested.pop(target, None)
+            if request is not None:
+                for other, (effect, pressTime) in list(self._requested.items()):
+                    if pressTime <= request[1]:
+                        del self._requested[other]
+        if request is not None:
+            effect, pressTime = request
+            self.activeEffect = effect
+            self._append({"type": SWITCH, "effect": effect, "latency": self._clock() - pressTime})
+
+    def records(self, since=0):
+        # Returns the records newer than the given sequence number
+        with self._lock:
+            return [record for record in self._records if record["seq"] > since]
+
+    @property
+    def dropouts(self):
+        return self._monitor.dropouts
+
+
+class _TelemetryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != "/telemetry":
+            self.send_error(404)
+            return
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            since = int(query.get("since", ["0"])[0])
+        except ValueError:
+            self.send_error(400, "since must be a sequence number")
+            return
+        body = json.dumps({"records": self.server.telemetry.records(since)}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the pedal's console free of request logs
+        pass
+
+
+# Serves the telemetry records at http://host:port/telemetry?since=<seq> from a background thread
+class TelemetryServer(object):
+    def __init__(self, telemetry, port=8765, host="127.0.0.1"):
+        self._httpd = ThreadingHTTPServer((host, port), _TelemetryHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.telemetry = telemetry
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="telemetry-http", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def formatRecord(record):
+    stamp = time.strftime("%H:%M:%S", time.localtime(record["time"]))
+    if record["type"] == SWITCH:
+        return "%s switch  %-16s latency %.1f ms" % (stamp, record["effect"], record["latency"] * 1000)
+    return "%s sample  %-16s process cpu %5.1f%%  dropouts %d (total %d)" % (
+        stamp, record["effect"], record["processCpu"], record["dropouts"], record["dropoutsTotal"])
+
+
+def tail(url, interval=1.0):
+    # Prints new telemetry records as they come in, like tail -f
+    since = 0
+    while True:
+        with urllib.request.urlopen("%s/telemetry?since=%d" % (url.rstrip("/"), since), timeout=5) as response:
+            records = json.load(response)["records"]
+        for record in records:
+            print(formatRecord(record))
+            since = record["seq"]
+        time.sleep(interval)
+
+
+def check(dur=2.0, sr=44100, buffersize=256, period=0.25):
+    # Runs the telemetry on the offline server behind a signal graph, stomping to an effect, to another one while
+    # the first fade still runs, and back to the clean signal. Stomps are timestamped with the server's clock, so
+    # the latencies come out in audio time. Returns the records served over HTTP and the failures found.
+    import os
+    import tempfile
+    from pyo import CallAfter, Noise, Pattern, Server, Sig
+    from effects import EFFECTS
+    from signalGraph import FADE_TIME, PREROLL_TIME, SignalGraph
+    server = Server(sr=sr, buffersize=buffersize, audio="offline", nchnls=1)
+    server.setVerbosity(0)
+    server.boot()
+    handle, filename = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    server.recordOptions(dur=dur, filename=filename)
+
+    def clock():
+        return server.getCurrentTimeInSamples() / float(sr)
+
+    telemetry = Telemetry(server, period=None, clock=clock).start()
+    source = Noise(mul=.2)
+    names = ["Distortion", "Tremolo"]
+    factories = dict(EFFECTS)
+    effects = [factories[name](source) for name in names]
+    for effect in effects:
+        effect.stop()
+    graph = SignalGraph(Sig(source), effects)
+    graph.start()
+    graph.onRamp = telemetry.switchAudible
+
+    def stomp(target):
+        # What the pedal's main loop does with a stomp
+        if target != graph.requested:
+            telemetry.requestSwitch(target, "Clean" if target is None else names[target], clock())
+        graph.apply(target is not None, target or 0)
+
+    stomps = [(0.5, 0), (0.52, 1), (1.2, None)]
+    calls = [CallAfter(lambda target=target: stomp(target), time=at) for at, target in stomps]
+    sampler = Pattern(telemetry.sampleNow, time=period).play()
+    try:
+        server.start()
+    finally:
+        os.remove(filename)
+    telemetry.stop()
+    del calls, sampler
+    server.shutdown()
+
+    httpd = TelemetryServer(telemetry, port=0).start()
+    try:
+        with urllib.request.urlopen("http://127.0.0.1:%d/telemetry" % httpd.port, timeout=5) as response:
+            records = json.load(response)["records"]
+    finally:
+        httpd.stop()
+
+    failures = []
+    switches = [record for record in records if record["type"] == SWITCH]
+    samples = [record for record in records if record["type"] == SAMPLE]
+    if [record["effect"] for record in switches] != ["Distortion", "Tremolo", "Clean"]:
+        failures.append("recorded switches to %s" % [record["effect"] for record in switches])
+    else:
+        block = buffersize / float(sr)
+        for record in switches:
+            if record["latency"] < PREROLL_TIME - block:
+                failures.append("the switch to %s was heard after %.1f ms, before the preroll was over" % (
+                    record["effect"], record["latency"] * 1000))
+        # The queued stomp waits for the rest of the running fade and then for its own preroll
+        queued = stomps[0][0] + PREROLL_TIME + FADE_TIME - stomps[1][0] + PREROLL_TIME
+        if switches[1]["latency"] < queued - block:
+            failures.append("the queued switch was heard after %.1f ms, under the %.1f ms it had to wait" % (
+                switches[1]["latency"] * 1000, queued * 1000))
+    if len(samples) < int(dur / period) - 1:
+        failures.append("only %d samples were taken" % len(samples))
+    if any(record["dropouts"] for record in samples):
+        failures.append("dropouts were counted on the offline server")
+    return records, failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pedal telemetry tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    tailCommand = commands.add_parser("tail", help="print the pedal's telemetry as it comes in")
+    tailCommand.add_argument("--url", default="http://127.0.0.1:8765")
+    tailCommand.add_argument("--interval", type=float, default=1.0)
+    commands.add_parser("check", help="run the telemetry on the offline server and check what it records")
+    args = parser.parse_args()
+    if args.command == "check":
+        records, failures = check()
+        for record in records:
+            print(formatRecord(record))
+        for failure in failures:
+            print(failure)
+        if failures:
+            raise SystemExit(1)
+    else:
+        try:
+            tail(args.url, args.interval)
+        except KeyboardInterrupt:
+            pass
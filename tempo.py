@@ -0,0 +1,195 @@
+# Shared tempo clock for the time-based effects of the pedal. Instead of every effect running its own oscillator at
+# a fixed rate, the clock runs a single master phase, and the Tremolo, Vibrato, Flanger, Phaser and Leslie sweeps
+# read a shared sine table at a whole multiple of it, so they all stay locked to the beat. The Delay's time follows
+# the beat as well.
+#
+# The master phase goes round once every CYCLE_BEATS beats, so an LFO can run at any multiple of 1/CYCLE_BEATS cycles
+# per beat without a jump when the master phase wraps. Effect rates are still given in Hz, as they sound at the
+# reference tempo of 120 BPM, and scale with the tempo from there. Changing the tempo only ramps the speed of the
+# master phase and the length of a beat, so nothing is rebuilt and the LFOs slide smoothly to their new rates.
+#
+# The tempo is tapped in on the second footswitch: hold it down to start tapping, tap the beat a few times, and hold
+# it down again to go back to changing effects.
+#
+#     python tempo.py
+import argparse
+
+from pyo import HarmTable, Phasor, Pointer, PyoObject, Sig, SigTo, convertArgsToLists
+
+# The tempo the effect rates and delay times are given at
+REFERENCE_BPM = 120.0
+
+# Beats per turn of the master phase. 192 lets LFOs run at any multiple of a 64th note, a triplet or a bar.
+CYCLE_BEATS = 192
+
+# Tempo range the clock accepts, from tapping or otherwise
+MIN_BPM = 40.0
+MAX_BPM = 300.0
+
+# Time over which a tempo change is ramped
+RAMP_TIME = 0.2
+
+# Taps further apart than this start a new tempo, and only the last few taps are averaged
+TAP_TIMEOUT = 2.0
+MAX_TAPS = 5
+
+# How long the second footswitch has to be held down to start or stop tapping
+HOLD_TIME = 0.8
+
+
+class TempoClock(object):
+    def __init__(self, bpm=REFERENCE_BPM, cycleBeats=CYCLE_BEATS, ramptime=RAMP_TIME):
+        self._cycleBeats = cycleBeats
+        self.bpm = self._clamp(bpm)
+        self._freq = SigTo(self.bpm / 60.0 / cycleBeats, time=ramptime, init=self.bpm / 60.0 / cycleBeats)
+        self.phase = Phasor(freq=self._freq)
+        # Seconds per beat, for the Delay
+        self.beatTime = SigTo(60.0 / self.bpm, time=ramptime, init=60.0 / self.bpm)
+        self.table = HarmTable()
+        self._taps = []
+
+    @staticmethod
+    def _clamp(bpm):
+        return max(MIN_BPM, min(MAX_BPM, float(bpm)))
+
+    @property
+    def referenceBeat(self):
+        return 60.0 / REFERENCE_BPM
+
+    def multiple(self, freq):
+        # Turns of the shared table per turn of the master phase for an LFO of freq Hz at the reference tempo
+        return max(1, int(round(freq * self.referenceBeat * self._cycleBeats)))
+
+    def lfo(self, freq, mul=1, add=0):
+        return TempoLfo(self, freq, mul, add)
+
+    def setBpm(self, bpm):
+        self.bpm = self._clamp(bpm)
+        self._freq.value = self.bpm / 60.0 / self._cycleBeats
+        self.beatTime.value = 60.0 / self.bpm
+        return self.bpm
+
+    def tap(self, timestamp):
+        # Adds a tap at the given time in seconds. Returns the new tempo once there are two taps or more.
+        if self._taps and timestamp - self._taps[-1] > TAP_TIMEOUT:
+            self._taps = []
+        self._taps.append(timestamp)
+        del self._taps[:-MAX_TAPS]
+        if len(self._taps) < 2:
+            return None
+        interval = (self._taps[-1] - self._taps[0]) / (len(self._taps) - 1)
+        return self.setBpm(60.0 / interval)
+
+    def resetTaps(self):
+        self._taps = []
+
+    def objects(self):
+        return [self._freq, self.phase, self.beatTime]
+
+    def stop(self):
+        for obj in self.objects():
+            obj.stop()
+
+
+# A sine LFO locked to the tempo clock. It reads the clock's shared table at a whole multiple of the master phase,
+# so it costs a table lookup instead of an oscillator of its own. freq is in Hz at the reference tempo and can be a
+# list for several LFOs at once, like the Phaser's. Changing it jumps the LFO to the matching point of the beat.
+class TempoLfo(PyoObject):
+    def __init__(self, clock, freq, mul=1, add=0):
+        PyoObject.__init__(self)
+        self._clock = clock
+        self._freq = freq
+        freqs, lmax = convertArgsToLists(freq)
+        self._index = Sig(clock.phase, mul=[clock.multiple(f) for f in freqs])
+        self._lookup = Pointer(clock.table, self._index, mul=mul, add=add)
+        self._base_objs = self._lookup.getBaseObjects()
+
+    def setFreq(self, x):
+        self._freq = x
+        freqs, lmax = convertArgsToLists(x)
+        self._index.mul = [self._clock.multiple(f) for f in freqs]
+
+    @property
+    def freq(self):
+        return self._freq
+    @freq.setter
+    def freq(self, x):
+        self.setFreq(x)
+
+    def play(self, dur=0, delay=0):
+        self._index.play(dur, delay)
+        self._lookup.play(dur, delay)
+        return PyoObject.play(self, dur, delay)
+
+    def out(self, chnl=0, inc=1, dur=0, delay=0):
+        self._index.play(dur, delay)
+        self._lookup.play(dur, delay)
+        return PyoObject.out(self, chnl, inc, dur, delay)
+
+    def stop(self, wait=0):
+        self._index.stop(wait)
+        self._lookup.stop(wait)
+        return PyoObject.stop(self, wait)
+
+
+def countOscillators(synced):
+    # Builds every effect with or without a tempo clock and counts the oscillator streams they run
+    from pyo import LFO, Noise, Server, Sine
+    from effectRegistry import EffectRegistry
+    server = Server(audio="offline")
+    server.setVerbosity(0)
+    server.boot()
+    clock = TempoClock() if synced else None
+    source = Noise(mul=.2)
+    registry = EffectRegistry(source, lazy=False, clock=clock)
+    count = 1 if synced else 0
+    for chain in registry.built():
+        for obj in chain.objects():
+            if isinstance(obj, (Sine, LFO, Phasor)):
+                count += len(obj.getBaseObjects())
+    server.shutdown()
+    return count
+
+
+def renderTempoChange(fromBpm, toBpm, freq=6.0, dur=2.0, sr=44100):
+    # Renders a tempo-locked LFO offline while the tempo changes halfway through, and returns the largest step
+    # between two samples along with the largest one before the change
+    import os
+    import tempfile
+    from pyo import CallAfter, NewTable, Server, TableRec
+    server = Server(sr=sr, audio="offline", nchnls=1)
+    server.setVerbosity(0)
+    server.boot()
+    handle, filename = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    server.recordOptions(dur=dur, filename=filename)
+    clock = TempoClock(fromBpm)
+    lfo = clock.lfo(freq)
+    table = NewTable(dur)
+    recorder = TableRec(lfo, table).play()
+    change = CallAfter(lambda: clock.setBpm(toBpm), time=dur / 2)
+    try:
+        server.start()
+    finally:
+        os.remove(filename)
+    samples = table.getTable()
+    del recorder, change
+    server.shutdown()
+    steps = [abs(samples[i] - samples[i - 1]) for i in range(1, len(samples))]
+    half = len(steps) // 2
+    return max(steps), max(steps[:half])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the tempo clock on the offline server")
+    parser.add_argument("--from-bpm", type=float, default=100.0)
+    parser.add_argument("--to-bpm", type=float, default=140.0)
+    args = parser.parse_args()
+    print("Oscillators: %d free-running, %d locked to the tempo clock" % (countOscillators(False),
+                                                                        countOscillators(True)))
+    largest, before = renderTempoChange(args.from_bpm, args.to_bpm)
+    print("Tempo change %.0f -> %.0f BPM: largest LFO step %.5f, %.5f before the change" % (
+        args.from_bpm, args.to_bpm, largest, before))
+    # At the faster tempo the LFO moves faster, so its steps grow in proportion, but a glitch would be far larger
+    if largest > before * args.to_bpm / args.from_bpm * 1.1:
+        raise SystemExit(1)